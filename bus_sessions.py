@@ -0,0 +1,219 @@
+"""
+Bus sessions for the web server
+One session per CAN adapter, each with its own interface, receive pipeline, message history and metrics
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from can_interface import CANInterface
+from servo_protocol import ServoProtocol
+from servo_client import ServoClient
+from message_stream import MessageBroadcaster, MessageHistory
+from metrics import MetricsRegistry, MetricsWriter, CANInterfaceMetrics, ServoClientMetrics
+from telemetry import TelemetryStore
+
+logger = logging.getLogger(__name__)
+
+# Name of the session served by the routes without a session prefix
+DEFAULT_SESSION = 'default'
+
+class BusSession:
+    """
+    Everything the web server keeps for one CAN bus
+
+    Sessions share nothing: each has its own receive thread, servo
+    protocol state (detected packet formats), pending reads, message
+    history, register telemetry and stream clients, so a busy or failing bus does not slow
+    down the others.
+    """
+
+    def __init__(self, name: str, channel: str = '', bitrate: int = 500000, history_depth: int = 1000,
+                 state: Optional[Dict[str, Any]] = None):
+        """
+        Initialize session
+
+        Args:
+            name: Session name used in URLs and metric labels
+            channel: CAN channel, or '' to choose one when connecting
+            bitrate: CAN bus bitrate in bps
+            history_depth: Messages kept for polling and reconnecting clients
+            state: Dictionary to keep the connection state in, a new one if None
+        """
+        self.name = name
+        # Frames reach the history and stream clients through callbacks; nothing polls the receive queue
+        self.can_interface = (CANInterface(channel, bitrate, queue_received=False) if channel
+                              else CANInterface(bitrate=bitrate, queue_received=False))
+        self.servo_protocol = ServoProtocol()
+        self.servo_client = ServoClient(self.can_interface, self.servo_protocol)
+        self.history = MessageHistory(history_depth)
+        self.telemetry = TelemetryStore()
+        self.broadcaster = MessageBroadcaster(history=self.history, telemetry=self.telemetry)
+
+        self.state = state if state is not None else {}
+        self.state.update({
+            'connected': False,
+            'channel': channel,
+            'bitrate': bitrate,
+            'connection_status': 'Disconnected',
+            'last_update': datetime.now().isoformat()
+        })
+
+        labels = {'session': name}
+        self.collectors: List[Callable[[MetricsWriter], None]] = [
+            CANInterfaceMetrics(self.can_interface, labels),
+            ServoClientMetrics(self.servo_client, labels),
+            self.collect_metrics
+        ]
+
+    @property
+    def connected(self) -> bool:
+        return self.state['connected']
+
+    def connect(self, channel: str, bitrate: int) -> bool:
+        """
+        Connect the session's interface
+
+        Returns:
+            True if connection successful
+        """
+        self.can_interface.channel = channel
+        self.can_interface.bitrate = bitrate
+        if not self.can_interface.connect():
+            return False
+
+        self.state.update({
+            'connected': True,
+            'channel': channel,
+            'bitrate': bitrate,
+            'connection_status': f'Connected to {channel} @ {bitrate} bps'
+        })
+        logger.info(f"Session {self.name} connected to {channel} @ {bitrate} bps")
+        return True
+
+    def disconnect(self):
+        """Disconnect the interface and drop the message history and telemetry"""
+        self.can_interface.disconnect()
+        self.state['connected'] = False
+        self.state['connection_status'] = 'Disconnected'
+        self.history.clear()
+        self.broadcaster.clear_trace()
+        self.telemetry.clear()
+
+    def touch(self):
+        """Note that a message was received"""
+        self.state['last_update'] = datetime.now().isoformat()
+
+    def collect_metrics(self, writer: MetricsWriter):
+        """Write stream and history metrics"""
+        labels = {'session': self.name}
+        clients = self.broadcaster.get_stats()
+        writer.gauge('stream_clients', "Connected live stream clients", [(labels, len(clients))])
+        writer.counter('stream_published_messages', "Messages published to live stream clients",
+                       [(labels, self.broadcaster.published)])
+        writer.counter('stream_dropped_messages', "Messages discarded because a stream client fell behind",
+                       [(labels, self.broadcaster.dropped)])
+        writer.gauge('stream_pending_messages', "Messages queued for stream clients",
+                     [(labels, sum(client['pending'] for client in clients))])
+        writer.gauge('history_last_seq', "Sequence number of the newest message in the history",
+                     [(labels, self.history.last_seq)])
+        writer.gauge('telemetry_series', "Servo register time series kept for plotting",
+                     [(labels, len(self.telemetry.series))])
+
+    def get_info(self) -> Dict[str, Any]:
+        """Summary for the session list"""
+        return {
+            'name': self.name,
+            'channel': self.state['channel'],
+            'bitrate': self.state['bitrate'],
+            'connected': self.state['connected'],
+            'connection_status': self.state['connection_status'],
+            'stream_clients': len(self.broadcaster.get_stats()),
+            'last_seq': self.history.last_seq,
+            'last_update': self.state['last_update']
+        }
+
+class SessionRegistry:
+    """Bus sessions by name; sessions opened for an adapter are named after its channel"""
+
+    def __init__(self, metrics_registry: Optional[MetricsRegistry] = None):
+        """
+        Initialize registry
+
+        Args:
+            metrics_registry: Registry that gets each session's collectors, if any
+        """
+        self.metrics_registry = metrics_registry
+        self.sessions: Dict[str, BusSession] = {}
+        self.lock = threading.Lock()
+
+    def add(self, session: BusSession):
+        """
+        Add a session
+
+        Raises:
+            ValueError: If a session of that name exists
+        """
+        with self.lock:
+            if session.name in self.sessions:
+                raise ValueError(f"Session {session.name} already exists")
+            self.sessions[session.name] = session
+        self._add_collectors(session)
+
+    def get(self, name: str) -> Optional[BusSession]:
+        """Get a session by name"""
+        return self.sessions.get(name)
+
+    def get_or_create(self, name: str, factory: Callable[[], BusSession]) -> BusSession:
+        """Get a session, creating it with factory() if it does not exist"""
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is not None:
+                return session
+            session = self.sessions[name] = factory()
+        self._add_collectors(session)
+        return session
+
+    def remove(self, name: str) -> Optional[BusSession]:
+        """Remove a session and its metrics; the caller disconnects it"""
+        with self.lock:
+            session = self.sessions.pop(name, None)
+        if session is not None and self.metrics_registry is not None:
+            for collector in session.collectors:
+                self.metrics_registry.remove_collector(collector)
+        return session
+
+    def get_sessions(self) -> List[BusSession]:
+        """All sessions in creation order"""
+        with self.lock:
+            return list(self.sessions.values())
+
+    def connect(self, session: BusSession, channel: str, bitrate: int) -> bool:
+        """
+        Connect a session, making sure no other session has the channel open
+
+        Returns:
+            True if connection successful
+
+        Raises:
+            ValueError: If another session is connected to the channel
+        """
+        # Held across the connect so two sessions cannot claim one adapter at once
+        with self.lock:
+            for other in self.sessions.values():
+                if other is not session and other.connected and other.state['channel'] == channel:
+                    raise ValueError(f"{channel} is already open in session {other.name}")
+            return session.connect(channel, bitrate)
+
+    def disconnect_all(self):
+        """Disconnect every connected session"""
+        for session in self.get_sessions():
+            if session.connected:
+                session.disconnect()
+
+    def _add_collectors(self, session: BusSession):
+        if self.metrics_registry is not None:
+            for collector in session.collectors:
+                self.metrics_registry.add_collector(collector)
@@ -11,6 +11,11 @@ from typing import Optional, Callable, List, Dict, Any
 from dataclasses import dataclass
 from queue import Queue, Empty
 
+from metrics import Histogram, CALLBACK_DURATION_BUCKETS
+
+# Bits of a data frame besides its data bytes (without stuff bits), for bus load
+FRAME_OVERHEAD_BITS = {False: 47, True: 67}
+
 @dataclass
 class CANMessage:
     """CAN message data structure"""
@@ -23,22 +28,31 @@ class CANMessage:
 class CANInterface:
     """PCAN interface wrapper using python-can library"""
     
-    def __init__(self, channel: str = 'PCAN_USBBUS1', bitrate: int = 500000):
+    def __init__(self, channel: str = 'PCAN_USBBUS1', bitrate: int = 500000, interface: str = 'pcan',
+                 queue_received: bool = True):
         """
         Initialize CAN interface
         
         Args:
             channel: PCAN channel (e.g., 'PCAN_USBBUS1')
             bitrate: CAN bus bitrate in bps
+            interface: python-can interface name ('pcan', or e.g. 'virtual' for testing)
+            queue_received: Keep received messages for get_received_messages; turn off
+                when everything is consumed through callbacks, or the queue only overflows
         """
         self.logger = logging.getLogger(__name__)
         self.channel = channel
         self.bitrate = bitrate
+        self.interface = interface
         self.bus: Optional[can.Bus] = None
         self.is_connected = False
         self.receive_thread: Optional[threading.Thread] = None
         self.stop_receive = threading.Event()
         self.message_callbacks: List[Callable[[CANMessage], None]] = []
+        self.transmit_callbacks: List[Callable[[CANMessage], None]] = []
+        self.error_frame_callbacks: List[Callable[[CANMessage], None]] = []
+        self.log_sinks: List[Any] = []
+        self.queue_received = queue_received
         self.received_messages = Queue(maxsize=1000)
         self.lock = threading.Lock()
         
@@ -49,6 +63,16 @@ class CANInterface:
         self.max_errors_per_minute = 10
         self.auto_reset_enabled = True
         
+        # Cumulative counters for metrics; never reset. Updated from the receive
+        # and sending threads, so changes and snapshots go through counters_lock
+        self.counters_lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            'rx_frames': 0, 'rx_bits': 0, 'tx_frames': 0, 'tx_bits': 0, 'tx_failed': 0,
+            'error_frames': 0, 'bus_errors': 0, 'auto_resets': 0, 'auto_reset_failures': 0,
+            'rx_queue_dropped': 0
+        }
+        self.callback_durations = Histogram(CALLBACK_DURATION_BUCKETS)
+        
     def connect(self) -> bool:
         """
         Connect to PCAN interface
@@ -59,9 +83,9 @@ class CANInterface:
         try:
             self.logger.info(f"Connecting to {self.channel} at {self.bitrate} bps")
             
-            # Initialize CAN bus using python-can with PCAN interface
+            # Initialize CAN bus using python-can (PCAN unless configured otherwise)
             self.bus = can.Bus(
-                interface='pcan',
+                interface=self.interface,
                 channel=self.channel,
                 bitrate=self.bitrate,
                 receive_own_messages=False
@@ -98,6 +122,36 @@ class CANInterface:
         except Exception as e:
             self.logger.error(f"Error during disconnect: {e}")
     
+    def reconnect(self, timeout: float = 3.0, initial_interval: float = 0.05, max_interval: float = 0.5) -> bool:
+        """
+        Reopen the bus, retrying with backoff until the adapter accepts it
+
+        Args:
+            timeout: Maximum time to keep retrying in seconds
+            initial_interval: Delay before the second attempt in seconds
+            max_interval: Largest delay between attempts in seconds
+
+        Returns:
+            True if the bus was reopened, False if every attempt failed
+        """
+        self.disconnect()
+
+        deadline = time.perf_counter() + timeout
+        interval = initial_interval
+        attempts = 0
+        while True:
+            attempts += 1
+            if self.connect():
+                self.logger.info(f"Reconnected to {self.channel} after {attempts} attempt(s)")
+                return True
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.logger.error(f"Could not reconnect to {self.channel} within {timeout:.1f} s")
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+
     def start_receive_thread(self):
         """Start the message receive thread"""
         if self.receive_thread and self.receive_thread.is_alive():
@@ -131,6 +185,7 @@ class CANInterface:
                 
                 # Check for error frames
                 if hasattr(msg, 'is_error_frame') and msg.is_error_frame:
+                    self._notify_error_frame(msg)
                     self._handle_bus_error("Error frame detected")
                     continue
                 
@@ -143,32 +198,7 @@ class CANInterface:
                     is_error_frame=getattr(msg, 'is_error_frame', False)
                 )
                 
-                # Add to queue with overflow protection
-                try:
-                    self.received_messages.put_nowait(can_msg)
-                except:
-                    # Queue full, remove oldest messages to prevent overflow
-                    messages_removed = 0
-                    while messages_removed < 100:  # Remove up to 100 old messages
-                        try:
-                            self.received_messages.get_nowait()
-                            messages_removed += 1
-                        except:
-                            break
-                    
-                    # Try to add current message
-                    try:
-                        self.received_messages.put_nowait(can_msg)
-                    except:
-                        pass  # Skip if still can't add
-                
-                # Notify callbacks
-                with self.lock:
-                    for callback in self.message_callbacks:
-                        try:
-                            callback(can_msg)
-                        except Exception as e:
-                            self.logger.error(f"Error in message callback: {e}")
+                self._dispatch_message(can_msg)
                 
             except Exception as e:
                 if self.is_connected:
@@ -181,7 +211,92 @@ class CANInterface:
         
         self.logger.debug("Receive worker stopped")
     
-    def send_message(self, arbitration_id: int, data: bytes, is_extended_id: bool = False) -> bool:
+    def _count(self, **amounts: int):
+        """Add to metric counters"""
+        with self.counters_lock:
+            counters = self.counters
+            for name, amount in amounts.items():
+                counters[name] += amount
+    
+    def get_counters(self) -> Dict[str, int]:
+        """Get a consistent snapshot of the metric counters"""
+        with self.counters_lock:
+            return dict(self.counters)
+    
+    def _dispatch_message(self, can_msg: CANMessage):
+        """Queue a received message and pass it to message callbacks"""
+        self._count(rx_frames=1, rx_bits=FRAME_OVERHEAD_BITS[can_msg.is_extended_id] + 8 * len(can_msg.data))
+        
+        # Add to queue with overflow protection
+        if self.queue_received:
+            try:
+                self.received_messages.put_nowait(can_msg)
+            except:
+                # Queue full, remove oldest messages to prevent overflow
+                messages_removed = 0
+                while messages_removed < 100:  # Remove up to 100 old messages
+                    try:
+                        self.received_messages.get_nowait()
+                        messages_removed += 1
+                    except:
+                        break
+                
+                self._count(rx_queue_dropped=messages_removed)
+                
+                # Try to add current message
+                try:
+                    self.received_messages.put_nowait(can_msg)
+                except:
+                    self._count(rx_queue_dropped=1)  # Skip if still can't add
+        
+        # Notify callbacks
+        with self.lock:
+            if not self.message_callbacks:
+                return
+            start = time.perf_counter()
+            for callback in self.message_callbacks:
+                try:
+                    callback(can_msg)
+                except Exception as e:
+                    self.logger.error(f"Error in message callback: {e}")
+        self.callback_durations.observe(time.perf_counter() - start)
+    
+    def inject_message(self, can_msg: CANMessage):
+        """
+        Feed a message into the receive pipeline as if it came from the bus
+        
+        Used to replay captures through the same queue and callbacks as live
+        traffic without a bus. Error frames only reach error frame callbacks.
+        
+        Args:
+            can_msg: Message to deliver
+        """
+        if can_msg.is_error_frame:
+            self._notify_error_frame(can_msg)
+        else:
+            self._dispatch_message(can_msg)
+    
+    def _notify_error_frame(self, msg: can.Message):
+        """Pass a received error frame to error frame callbacks"""
+        self._count(error_frames=1)
+        if not self.error_frame_callbacks:
+            return
+        error_msg = CANMessage(
+            arbitration_id=msg.arbitration_id,
+            data=bytes(msg.data),
+            is_extended_id=msg.is_extended_id,
+            timestamp=msg.timestamp,
+            is_error_frame=True
+        )
+        with self.lock:
+            for callback in self.error_frame_callbacks:
+                try:
+                    callback(error_msg)
+                except Exception as e:
+                    self.logger.error(f"Error in error frame callback: {e}")
+    
+    def send_message(self, arbitration_id: int, data: bytes, is_extended_id: bool = False,
+                     is_remote_frame: bool = False, dlc: Optional[int] = None) -> bool:
         """
         Send a CAN message
         
@@ -189,6 +304,8 @@ class CANInterface:
             arbitration_id: CAN message ID
             data: Message data bytes
             is_extended_id: True for 29-bit extended ID, False for 11-bit standard ID
+            is_remote_frame: Send a remote (RTR) frame instead of a data frame
+            dlc: Data length code for remote frames (defaults to len(data))
             
         Returns:
             True if message sent successfully, False otherwise
@@ -196,22 +313,43 @@ class CANInterface:
         try:
             if not self.is_connected or not self.bus:
                 self.logger.error("CAN interface not connected")
+                self._count(tx_failed=1)
                 return False
             
             # Create CAN message
             msg = can.Message(
                 arbitration_id=arbitration_id,
                 data=data,
-                is_extended_id=is_extended_id
+                is_extended_id=is_extended_id,
+                is_remote_frame=is_remote_frame,
+                dlc=dlc
             )
             
             # Send message
             self.bus.send(msg)
             self.logger.debug(f"Sent CAN message: ID=0x{arbitration_id:X}, Data={data.hex()}")
+            self._count(tx_frames=1,
+                        tx_bits=FRAME_OVERHEAD_BITS[is_extended_id] + 8 * (0 if is_remote_frame else len(data)))
+            
+            # Notify transmit callbacks (e.g. capture recorders)
+            if self.transmit_callbacks:
+                sent_msg = CANMessage(
+                    arbitration_id=arbitration_id,
+                    data=bytes(data),
+                    is_extended_id=is_extended_id,
+                    timestamp=time.time()
+                )
+                with self.lock:
+                    for callback in self.transmit_callbacks:
+                        try:
+                            callback(sent_msg)
+                        except Exception as e:
+                            self.logger.error(f"Error in transmit callback: {e}")
             return True
             
         except Exception as e:
             self.logger.error(f"Failed to send CAN message: {e}")
+            self._count(tx_failed=1)
             return False
     
     def add_message_callback(self, callback: Callable[[CANMessage], None]):
@@ -226,6 +364,60 @@ class CANInterface:
             if callback in self.message_callbacks:
                 self.message_callbacks.remove(callback)
     
+    def add_transmit_callback(self, callback: Callable[[CANMessage], None]):
+        """Add a callback for successfully sent messages"""
+        with self.lock:
+            if callback not in self.transmit_callbacks:
+                self.transmit_callbacks.append(callback)
+    
+    def remove_transmit_callback(self, callback: Callable[[CANMessage], None]):
+        """Remove a transmit callback"""
+        with self.lock:
+            if callback in self.transmit_callbacks:
+                self.transmit_callbacks.remove(callback)
+    
+    def add_error_frame_callback(self, callback: Callable[[CANMessage], None]):
+        """Add a callback for received error frames"""
+        with self.lock:
+            if callback not in self.error_frame_callbacks:
+                self.error_frame_callbacks.append(callback)
+    
+    def remove_error_frame_callback(self, callback: Callable[[CANMessage], None]):
+        """Remove an error frame callback"""
+        with self.lock:
+            if callback in self.error_frame_callbacks:
+                self.error_frame_callbacks.remove(callback)
+    
+    def add_log_sink(self, sink) -> bool:
+        """
+        Start a log sink and feed it every received, sent and error frame
+        
+        Args:
+            sink: log_sinks.LogSink (or any object with start/stop/on_receive/on_transmit/get_stats)
+            
+        Returns:
+            True if the sink started, False otherwise
+        """
+        if sink in self.log_sinks:
+            return True
+        if not sink.start():
+            return False
+        self.log_sinks.append(sink)
+        self.add_message_callback(sink.on_receive)
+        self.add_error_frame_callback(sink.on_receive)
+        self.add_transmit_callback(sink.on_transmit)
+        return True
+    
+    def remove_log_sink(self, sink):
+        """Detach a log sink and close its file"""
+        if sink not in self.log_sinks:
+            return
+        self.remove_message_callback(sink.on_receive)
+        self.remove_error_frame_callback(sink.on_receive)
+        self.remove_transmit_callback(sink.on_transmit)
+        self.log_sinks.remove(sink)
+        sink.stop()
+    
     def get_received_messages(self, max_count: int = 100) -> List[CANMessage]:
         """Get received messages from queue"""
         messages = []
@@ -295,6 +487,7 @@ class CANInterface:
             self.bus_error_count = 0
         
         self.bus_error_count += 1
+        self._count(bus_errors=1)
         self.last_error_time = current_time
         
         self.logger.warning(f"CAN Bus Error #{self.bus_error_count}: {error_message}")
@@ -320,18 +513,10 @@ class CANInterface:
             # Clear message queue to prevent overflow
             self.clear_received_messages()
             
-            # Disconnect and reconnect
-            old_channel = self.channel
-            old_bitrate = self.bitrate
-            
-            self.disconnect()
-            time.sleep(1)  # Wait before reconnecting
-            
-            self.channel = old_channel
-            self.bitrate = old_bitrate
-            
-            if self.connect():
+            # Reopen as soon as the adapter accepts it instead of waiting a fixed time
+            if self.reconnect():
                 self.bus_error_count = 0  # Reset error count on successful reconnection
+                self._count(auto_resets=1)
                 self.logger.info("Auto-reset successful")
                 
                 # Notify callbacks of successful reset
@@ -342,6 +527,7 @@ class CANInterface:
                         except Exception as e:
                             self.logger.error(f"Error in reset callback: {e}")
             else:
+                self._count(auto_reset_failures=1)
                 self.logger.error("Auto-reset failed - could not reconnect")
                 
         except Exception as e:
@@ -360,7 +546,8 @@ class CANInterface:
             'bitrate': self.bitrate,
             'error_count': self.bus_error_count,
             'queue_size': self.received_messages.qsize(),
-            'auto_reset_enabled': self.auto_reset_enabled
+            'auto_reset_enabled': self.auto_reset_enabled,
+            'log_sinks': [sink.get_stats() for sink in self.log_sinks]
         }
     
     def enable_auto_reset(self, enabled: bool = True):
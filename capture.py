@@ -0,0 +1,408 @@
+"""
+Binary capture files for CAN traffic
+Records every received and sent frame to a compact fixed-width file for analysis and replay
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from math import gcd
+from queue import Queue, Empty, Full
+from typing import Any, Dict, Iterator, Optional
+
+from can_interface import CANInterface, CANMessage
+
+CAPTURE_EXTENSION = ".hcap"
+CAPTURE_MAGIC = b"HCANCAP1"
+CAPTURE_VERSION = 1
+
+# File header: magic, version, record size, header size, start time (ns), record count
+HEADER_FORMAT = '<8sHHH2xQQ16x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+_COUNT_OFFSET = 24
+
+# One record per frame: timestamp (ns since epoch), arbitration ID, flags, DLC, 8 data bytes
+RECORD_FORMAT = '<QIBB2x8s'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Record flags
+FLAG_EXTENDED = 0x01
+FLAG_TX = 0x02
+FLAG_ERROR = 0x04
+
+RECORD_STRUCT = struct.Struct(RECORD_FORMAT)
+
+@dataclass
+class CaptureRecord:
+    """One frame read back from a capture file"""
+    timestamp_ns: int
+    arbitration_id: int
+    flags: int
+    dlc: int
+    data: bytes
+
+    @property
+    def timestamp(self) -> float:
+        """Timestamp in seconds since the epoch"""
+        return self.timestamp_ns / 1e9
+
+    @property
+    def is_extended_id(self) -> bool:
+        return bool(self.flags & FLAG_EXTENDED)
+
+    @property
+    def is_tx(self) -> bool:
+        return bool(self.flags & FLAG_TX)
+
+    @property
+    def is_error_frame(self) -> bool:
+        return bool(self.flags & FLAG_ERROR)
+
+    def to_message(self) -> CANMessage:
+        """Convert to the CANMessage passed to CANInterface callbacks"""
+        return CANMessage(
+            arbitration_id=self.arbitration_id,
+            data=self.data,
+            is_extended_id=self.is_extended_id,
+            timestamp=self.timestamp,
+            is_error_frame=self.is_error_frame
+        )
+
+def pack_record(msg: CANMessage, is_tx: bool = False) -> bytes:
+    """
+    Pack a message into its fixed-width capture record
+
+    Args:
+        msg: Received or sent message
+        is_tx: True if the message was sent by this tool
+
+    Returns:
+        RECORD_SIZE bytes
+    """
+    flags = (FLAG_EXTENDED if msg.is_extended_id else 0) | (FLAG_TX if is_tx else 0) | \
+            (FLAG_ERROR if msg.is_error_frame else 0)
+    timestamp_ns = int(msg.timestamp * 1e9) if msg.timestamp else time.time_ns()
+    data = bytes(msg.data[:8])
+    return RECORD_STRUCT.pack(timestamp_ns, msg.arbitration_id, flags, len(data), data)
+
+def unpack_record(buffer, offset: int = 0) -> CaptureRecord:
+    """Unpack one capture record from a buffer"""
+    timestamp_ns, arbitration_id, flags, dlc, data = RECORD_STRUCT.unpack_from(buffer, offset)
+    return CaptureRecord(timestamp_ns, arbitration_id, flags, dlc, data[:dlc])
+
+class CaptureRecorder:
+    """
+    Appends every frame seen by a CANInterface to a capture file
+
+    Callbacks only pack the frame and put it on a bounded queue; a background
+    writer copies records into a memory-mapped window of the file. The file is
+    grown one window at a time and only one window is mapped, so memory use
+    stays constant however long the recording runs. If the writer falls
+    behind, new frames are dropped and counted rather than buffered.
+    """
+
+    def __init__(self, filename: str, window_size: int = 16 * 1024 * 1024, queue_size: int = 65536,
+                 flush_interval: float = 1.0, index_builder=None):
+        """
+        Initialize capture recorder
+
+        Args:
+            filename: Capture file to create (overwritten if it exists)
+            window_size: Bytes mapped and pre-grown at a time
+            queue_size: Maximum frames waiting for the writer
+            flush_interval: Seconds between header updates, bounding what a crash can lose
+            index_builder: capture_index.CaptureIndexBuilder fed by the writer, finished on stop
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.index_builder = index_builder
+
+        # Windows must start on an allocation boundary and hold whole records
+        granularity = mmap.ALLOCATIONGRANULARITY
+        unit = RECORD_SIZE * granularity // gcd(RECORD_SIZE, granularity)
+        self.window_size = max(1, window_size // unit) * unit
+
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.records_written = 0
+        self.dropped = 0
+        self.start_time_ns = 0
+
+        self.can_interface: Optional[CANInterface] = None
+        self.writer_thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.is_recording = False
+
+        self._file = None
+        self._header: Optional[mmap.mmap] = None
+        self._window: Optional[mmap.mmap] = None
+        self._window_index = 0
+        self._position = 0
+
+    def attach(self, can_interface: CANInterface):
+        """Subscribe to received, sent and error frames of a CAN interface"""
+        self.can_interface = can_interface
+        can_interface.add_message_callback(self.on_receive)
+        can_interface.add_error_frame_callback(self.on_receive)
+        can_interface.add_transmit_callback(self.on_transmit)
+
+    def detach(self):
+        """Unsubscribe from the CAN interface"""
+        if self.can_interface:
+            self.can_interface.remove_message_callback(self.on_receive)
+            self.can_interface.remove_error_frame_callback(self.on_receive)
+            self.can_interface.remove_transmit_callback(self.on_transmit)
+            self.can_interface = None
+
+    def on_receive(self, msg: CANMessage):
+        """CANInterface callback for received frames"""
+        self.record(msg, is_tx=False)
+
+    def on_transmit(self, msg: CANMessage):
+        """CANInterface callback for sent frames"""
+        self.record(msg, is_tx=True)
+
+    def record(self, msg: CANMessage, is_tx: bool = False):
+        """
+        Queue a frame for writing without blocking the caller
+
+        Args:
+            msg: Frame to record
+            is_tx: True if the frame was sent by this tool
+        """
+        if not self.is_recording:
+            return
+        try:
+            self.queue.put_nowait(pack_record(msg, is_tx))
+        except Full:
+            self.dropped += 1
+
+    def start(self) -> bool:
+        """
+        Create the capture file and start the writer thread
+
+        Returns:
+            True if recording started, False otherwise
+        """
+        if self.is_recording:
+            return True
+        if self._file is not None:
+            # Writer failed since the last start
+            self.stop()
+        try:
+            self._file = open(self.filename, 'w+b')
+            self._file.truncate(self.window_size)
+            self.start_time_ns = time.time_ns()
+
+            self._header = mmap.mmap(self._file.fileno(), HEADER_SIZE)
+            self._header[:] = struct.pack(HEADER_FORMAT, CAPTURE_MAGIC, CAPTURE_VERSION, RECORD_SIZE,
+                                          HEADER_SIZE, self.start_time_ns, 0)
+            self._map_window(0)
+            self._position = HEADER_SIZE
+
+            self.records_written = 0
+            self.dropped = 0
+            self.stop_event.clear()
+            self.is_recording = True
+            self.writer_thread = threading.Thread(target=self._writer_worker, name="capture-writer", daemon=True)
+            self.writer_thread.start()
+
+            self.logger.info(f"Recording capture to {self.filename}")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"Failed to start capture: {e}")
+            self._close_file()
+            return False
+
+    def stop(self):
+        """Write remaining frames, finalize the header and trim the file"""
+        # The writer clears is_recording when it fails, but the file still needs finalizing
+        if self._file is None:
+            return
+        self.is_recording = False
+        self.stop_event.set()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=5.0)
+            self.writer_thread = None
+
+        try:
+            self._update_header()
+            if self._window is not None:
+                self._window.flush()
+                self._window.close()
+                self._window = None
+            self._header.flush()
+            self._header.close()
+            self._header = None
+            self._file.truncate(HEADER_SIZE + self.records_written * RECORD_SIZE)
+            if self.index_builder:
+                self.index_builder.finish()
+            self.logger.info(f"Capture {self.filename} closed: {self.records_written} records, "
+                             f"{self.dropped} dropped")
+        except Exception as e:
+            self.logger.error(f"Error closing capture: {e}")
+        finally:
+            self._close_file()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get recording statistics"""
+        return {
+            'filename': self.filename,
+            'recording': self.is_recording,
+            'records_written': self.records_written,
+            'dropped': self.dropped,
+            'queue_depth': self.queue.qsize(),
+            'bytes_written': HEADER_SIZE + self.records_written * RECORD_SIZE
+        }
+
+    def _map_window(self, index: int):
+        """Map window `index` of the file, growing the file to hold it"""
+        if self._window is not None:
+            self._window.flush()
+            self._window.close()
+            self._window = None
+        end = (index + 1) * self.window_size
+        if os.fstat(self._file.fileno()).st_size < end:
+            self._file.truncate(end)
+        self._window = mmap.mmap(self._file.fileno(), self.window_size, offset=index * self.window_size)
+        self._window_index = index
+
+    def _update_header(self):
+        """Publish the number of complete records to readers"""
+        struct.pack_into('<Q', self._header, _COUNT_OFFSET, self.records_written)
+
+    def _writer_worker(self):
+        """Copy queued records into the mapped window"""
+        last_flush = time.monotonic()
+
+        while True:
+            try:
+                record = self.queue.get(timeout=0.1)
+            except Empty:
+                record = None
+                if self.stop_event.is_set():
+                    break
+
+            try:
+                while record is not None:
+                    if self._position == self.window_size:
+                        self._map_window(self._window_index + 1)
+                        self._position = 0
+                    self._window[self._position:self._position + RECORD_SIZE] = record
+                    self._position += RECORD_SIZE
+                    if self.index_builder:
+                        self.index_builder.add_record(self.records_written, record)
+                    self.records_written += 1
+                    try:
+                        record = self.queue.get_nowait()
+                    except Empty:
+                        record = None
+
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    self._update_header()
+                    last_flush = time.monotonic()
+
+            except Exception as e:
+                self.logger.error(f"Error in capture writer: {e}")
+                self.is_recording = False
+                break
+
+    def _close_file(self):
+        """Close the capture file and any mappings"""
+        for mapping in (self._window, self._header):
+            if mapping is not None:
+                try:
+                    mapping.close()
+                except Exception:
+                    pass
+        self._window = None
+        self._header = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class CaptureReader:
+    """Random access to the records of a capture file through a read-only memory map"""
+
+    def __init__(self, filename: str):
+        """
+        Open a capture file
+
+        Args:
+            filename: Capture file written by CaptureRecorder
+        """
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER_SIZE:
+            self._file.close()
+            raise ValueError(f"{filename} is not a capture file")
+
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, header_size, self.start_time_ns, count = \
+            struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != CAPTURE_MAGIC or record_size != RECORD_SIZE or header_size != HEADER_SIZE:
+            self.close()
+            raise ValueError(f"{filename} is not a capture file")
+        if version > CAPTURE_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported capture version {version}")
+
+        # A capture still being written (or cut short) may have a stale count
+        self.count = min(count, (size - HEADER_SIZE) // RECORD_SIZE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> CaptureRecord:
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("capture record index out of range")
+        return unpack_record(self._map, HEADER_SIZE + index * RECORD_SIZE)
+
+    def __iter__(self) -> Iterator[CaptureRecord]:
+        return self.records()
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> Iterator[CaptureRecord]:
+        """
+        Iterate over a range of records
+
+        Args:
+            start: First record index
+            stop: Index after the last record, end of capture if None
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        view = self.record_buffer(start, stop)
+        for timestamp_ns, arbitration_id, flags, dlc, data in RECORD_STRUCT.iter_unpack(view):
+            yield CaptureRecord(timestamp_ns, arbitration_id, flags, dlc, data[:dlc])
+
+    def record_buffer(self, start: int = 0, stop: Optional[int] = None) -> memoryview:
+        """Raw bytes of a range of records, e.g. for numpy.frombuffer"""
+        stop = self.count if stop is None else min(stop, self.count)
+        start = max(0, min(start, stop))
+        return memoryview(self._map)[HEADER_SIZE + start * RECORD_SIZE:HEADER_SIZE + stop * RECORD_SIZE]
+
+    def close(self):
+        """Release the memory map and file"""
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Views handed out by record_buffer are still alive; the map closes with them
+                pass
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Transaction-aligned capture diff
+Compares two captures request/response transaction by transaction instead of frame by frame
+"""
+
+import argparse
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from bulk_decoder import capture_records, decode_frames
+from capture import FLAG_ERROR
+from capture_stats import ROLE_REQUEST, ROLE_RESPONSE, LatencyStats, frame_roles, match_requests
+from compressed_capture import open_capture
+from servo_protocol import FRAME_LAYOUTS, ServoProtocol
+
+logger = logging.getLogger(__name__)
+
+# One request and the response it got, if any
+TRANSACTION_DTYPE = np.dtype([
+    ('request_ns', np.int64),
+    ('response_ns', np.int64),  # -1 when unanswered
+    ('servo_id', np.uint8),
+    ('opcode', np.uint8),       # Request opcode
+    ('address', np.uint8),
+    ('answered', np.bool_),
+    ('value', np.uint16),
+    ('value_b', np.uint16)      # Second register of dual responses, else 0
+])
+
+# Request and response frames while they are being paired
+_EVENT_DTYPE = np.dtype([
+    ('key', np.int64),          # servo_id << 8 | address
+    ('time', np.int64),
+    ('role', np.uint8),
+    ('opcode', np.uint8),
+    ('value', np.uint16),
+    ('value_b', np.uint16)
+])
+
+# Transactions waiting for their counterpart in the other capture
+_ALIGN_DTYPE = np.dtype(TRANSACTION_DTYPE.descr + [('key', np.int64), ('offset', np.float64)])
+
+class TransactionStream:
+    """
+    Pairs requests with responses while streaming a capture
+
+    Iterating yields arrays of TRANSACTION_DTYPE block by block. A response
+    answers the latest request for the same (servo, register) if it arrives
+    within max_latency and no other response came in between; a request to
+    servo 0 takes the first unclaimed response for its register from any
+    servo (see capture_stats.match_requests). Requests that
+    may still be answered in the next block are held back, so every block's
+    transactions are final.
+    """
+
+    def __init__(self, reader, max_latency: float = 1.0, block_records: int = 1 << 20):
+        """
+        Initialize stream
+
+        Args:
+            reader: Open capture (see compressed_capture.open_capture)
+            max_latency: Longest request to response time accepted, in seconds
+            block_records: Records decoded per block
+        """
+        self.reader = reader
+        self.max_latency_ns = int(max_latency * 1e9)
+        self.block_records = block_records
+        self.unsolicited = 0            # Responses without a matching request
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        pending = np.zeros(0, dtype=_EVENT_DTYPE)
+        total = len(self.reader)
+        for start in range(0, total, self.block_records):
+            records = capture_records(self.reader, start, min(start + self.block_records, total))
+            records = records[(records['flags'] & FLAG_ERROR) == 0]
+            if not len(records):
+                continue
+            decoded = decode_frames(records['data'], records['dlc'], records['arb_id'])
+            roles = frame_roles(decoded, records['data'])
+            decoded, roles = decoded[roles != 0], roles[roles != 0]
+
+            events = np.empty(len(decoded), dtype=_EVENT_DTYPE)
+            events['key'] = (decoded['servo_id'].astype(np.int64) << 8) | decoded['address']
+            events['time'] = records['timestamp_ns'][decoded['index']]
+            events['role'] = roles
+            events['opcode'] = decoded['opcode']
+            events['value'] = decoded['value']
+            events['value_b'] = decoded['value_b']
+
+            transactions, pending = self._pair(np.concatenate([pending, events]),
+                                               int(records['timestamp_ns'].max()))
+            yield transactions
+
+        # Whatever is still open never got an answer
+        transactions, _ = self._pair(pending, None)
+        if len(transactions):
+            yield transactions
+
+    def _pair(self, events: np.ndarray, end_ns: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pair responses with requests
+
+        Args:
+            events: Held-back requests followed by this block's events, in capture order
+            end_ns: Newest timestamp of the block, None to close every request
+
+        Returns:
+            Tuple of (final transactions in request time order, requests to hold back)
+        """
+        if not len(events):
+            return np.zeros(0, dtype=TRANSACTION_DTYPE), events
+
+        keys, roles, times = events['key'], events['role'], events['time']
+        responses, answered_requests, open_requests = match_requests(keys, roles, times, self.max_latency_ns)
+        self.unsolicited += int(np.count_nonzero(roles == ROLE_RESPONSE)) - len(responses)
+
+        answer = np.full(len(events), -1, dtype=np.int64)
+        answer[answered_requests] = responses
+
+        requests = np.flatnonzero(roles == ROLE_REQUEST)
+        hold = np.zeros(len(requests), dtype=bool)
+        if end_ns is not None:
+            # An unanswered request with nothing after it may be answered in the next block
+            is_open = np.zeros(len(events), dtype=bool)
+            is_open[open_requests] = True
+            hold = is_open[requests] & (end_ns - times[requests] <= self.max_latency_ns)
+
+        held = events[requests[hold]]
+        requests = requests[~hold]
+        request_answers = answer[requests]
+        answered = request_answers >= 0
+        response_events = events[np.where(answered, request_answers, 0)]
+
+        transactions = np.empty(len(requests), dtype=TRANSACTION_DTYPE)
+        transactions['request_ns'] = times[requests]
+        transactions['response_ns'] = np.where(answered, response_events['time'], -1)
+        transactions['servo_id'] = keys[requests] >> 8
+        transactions['opcode'] = events['opcode'][requests]
+        transactions['address'] = keys[requests] & 0xFF
+        transactions['answered'] = answered
+        transactions['value'] = np.where(answered, response_events['value'], 0)
+        transactions['value_b'] = np.where(answered, response_events['value_b'], 0)
+
+        return transactions[np.argsort(transactions['request_ns'], kind='stable')], held
+
+@dataclass
+class KeyDiff:
+    """Differences for one (servo, request opcode, register)"""
+    aligned: int = 0
+    changed: int = 0            # Both answered with different values
+    missing_in_a: int = 0       # Answered only in B
+    missing_in_b: int = 0       # Answered only in A
+    unanswered: int = 0         # Unanswered in both
+    only_in_a: int = 0          # Request with no counterpart in B
+    only_in_b: int = 0
+    latency_a: LatencyStats = field(default_factory=LatencyStats)
+    latency_b: LatencyStats = field(default_factory=LatencyStats)
+    shift_total: float = 0.0    # Sum of B - A latency over transactions answered in both
+    shift_count: int = 0
+
+class CaptureDiff:
+    """
+    Aligns two transaction streams and accumulates their differences
+
+    Transactions are compared per (servo, request opcode, register), so
+    unrelated traffic and interleaving do not matter. Within a key both
+    sequences are walked in order and paired by request time relative to
+    each capture's first transaction: a pair must agree within a tolerance
+    of the previous pair's time difference, which follows slow drift, and a
+    transaction with no counterpart in time counts as only in its capture
+    instead of shifting every later pair. The tolerance is capped at half
+    the key's request interval so neighbouring polls cannot be confused.
+
+    Transactions are held only until their counterpart arrives; one still
+    unmatched once the other capture is more than window seconds past it
+    counts as only in its capture, which bounds memory.
+    """
+
+    def __init__(self, window: float = 60.0, tolerance: float = 0.25, max_examples: int = 20):
+        """
+        Initialize diff
+
+        Args:
+            window: Seconds of capture time to wait for a counterpart
+            tolerance: Largest change in relative request time between aligned pairs, in seconds
+            max_examples: Number of value changes to keep as examples
+        """
+        self.window = window
+        self.tolerance = tolerance
+        self.max_examples = max_examples
+        self.keys: Dict[int, KeyDiff] = {}
+        self.examples: List[Dict[str, Any]] = []
+        self.buffers = [np.zeros(0, dtype=_ALIGN_DTYPE), np.zeros(0, dtype=_ALIGN_DTYPE)]
+        self.alignment: Dict[int, Tuple[float, Optional[float]]] = {}  # key -> (B - A offset, last A offset)
+        self.origins: List[Optional[int]] = [None, None]
+        self.cursors = [0.0, 0.0]   # Capture time reached by each side, seconds from its first transaction
+        self.finished = [False, False]
+
+    def add(self, side: int, transactions: np.ndarray):
+        """
+        Add transactions from one capture
+
+        Args:
+            side: 0 for capture A, 1 for capture B
+            transactions: Transactions in request time order
+        """
+        if not len(transactions):
+            return
+        if self.origins[side] is None:
+            self.origins[side] = int(transactions['request_ns'][0])
+
+        added = np.empty(len(transactions), dtype=_ALIGN_DTYPE)
+        for name in TRANSACTION_DTYPE.names:
+            added[name] = transactions[name]
+        added['key'] = (transactions['servo_id'].astype(np.int64) << 16) | \
+                       (transactions['opcode'].astype(np.int64) << 8) | transactions['address']
+        added['offset'] = (transactions['request_ns'] - self.origins[side]) / 1e9
+
+        self.buffers[side] = np.concatenate([self.buffers[side], added])
+        self.cursors[side] = max(self.cursors[side], float(added['offset'].max()))
+        self._match()
+        self._expire()
+
+    def finish(self, side: int):
+        """Mark one capture as complete"""
+        self.finished[side] = True
+        self._expire()
+
+    def _align_key(self, key: int, offsets_a: List[float], offsets_b: List[float]
+                   ) -> Tuple[List[Tuple[int, int]], List[int], List[int]]:
+        """
+        Walk one key's buffered transactions of both captures in time order
+
+        Returns:
+            Tuple of (aligned (A, B) positions, positions only in A, positions only in B)
+        """
+        delta, last_a = self.alignment.get(key, (0.0, None))
+        pairs, only_a, only_b = [], [], []
+        i = j = 0
+        while i < len(offsets_a) and j < len(offsets_b):
+            offset_a = offsets_a[i]
+            tolerance = self.tolerance
+            if last_a is not None and offset_a > last_a:
+                tolerance = min(tolerance, (offset_a - last_a) / 2)
+
+            error = offsets_b[j] - offset_a - delta
+            if abs(error) <= tolerance:
+                pairs.append((i, j))
+                delta = offsets_b[j] - offset_a
+                last_a = offset_a
+                i += 1
+                j += 1
+            elif error < 0:
+                # Too early for this and therefore every later A transaction
+                only_b.append(j)
+                j += 1
+            else:
+                only_a.append(i)
+                last_a = offset_a
+                i += 1
+
+        self.alignment[key] = (delta, last_a)
+        return pairs, only_a, only_b
+
+    def _match(self):
+        """Align transactions of keys present in both buffers"""
+        buffer_a, buffer_b = self.buffers
+        common = np.intersect1d(buffer_a['key'], buffer_b['key'])
+        if not len(common):
+            return
+
+        # Group each buffer by key, in time order within a key
+        order_a = np.lexsort((buffer_a['offset'], buffer_a['key']))
+        order_b = np.lexsort((buffer_b['offset'], buffer_b['key']))
+        sorted_a, sorted_b = buffer_a['key'][order_a], buffer_b['key'][order_b]
+        bounds_a = zip(np.searchsorted(sorted_a, common), np.searchsorted(sorted_a, common, side='right'))
+        bounds_b = zip(np.searchsorted(sorted_b, common), np.searchsorted(sorted_b, common, side='right'))
+
+        index_a, index_b, lone_a, lone_b = [], [], [], []
+        for key, (start_a, end_a), (start_b, end_b) in zip(common, bounds_a, bounds_b):
+            rows_a, rows_b = order_a[start_a:end_a], order_b[start_b:end_b]
+            pairs, only_a, only_b = self._align_key(int(key), buffer_a['offset'][rows_a].tolist(),
+                                                    buffer_b['offset'][rows_b].tolist())
+            index_a.extend(rows_a[i] for i, _ in pairs)
+            index_b.extend(rows_b[j] for _, j in pairs)
+            lone_a.extend(rows_a[i] for i in only_a)
+            lone_b.extend(rows_b[j] for j in only_b)
+
+        self._count_only(0, buffer_a[lone_a])
+        self._count_only(1, buffer_b[lone_b])
+        self.buffers[0] = np.delete(buffer_a, index_a + lone_a)
+        self.buffers[1] = np.delete(buffer_b, index_b + lone_b)
+        if index_a:
+            self._compare(buffer_a[index_a], buffer_b[index_b])
+
+    def _compare(self, a: np.ndarray, b: np.ndarray):
+        """Accumulate differences of aligned transactions"""
+        both = a['answered'] & b['answered']
+        changed = both & ((a['value'] != b['value']) | (a['value_b'] != b['value_b']))
+        latency_a = (a['response_ns'] - a['request_ns']) / 1e9
+        latency_b = (b['response_ns'] - b['request_ns']) / 1e9
+        keys = a['key']
+
+        for key in np.unique(keys):
+            selected = keys == key
+            diff = self.keys.setdefault(int(key), KeyDiff())
+            answered_a = a['answered'][selected]
+            answered_b = b['answered'][selected]
+            paired = both[selected]
+            diff.aligned += int(np.count_nonzero(selected))
+            diff.changed += int(np.count_nonzero(changed[selected]))
+            diff.missing_in_a += int(np.count_nonzero(~answered_a & answered_b))
+            diff.missing_in_b += int(np.count_nonzero(answered_a & ~answered_b))
+            diff.unanswered += int(np.count_nonzero(~answered_a & ~answered_b))
+            diff.latency_a.add(latency_a[selected][answered_a])
+            diff.latency_b.add(latency_b[selected][answered_b])
+            diff.shift_total += float((latency_b[selected][paired] - latency_a[selected][paired]).sum())
+            diff.shift_count += int(np.count_nonzero(paired))
+
+        for position in np.flatnonzero(changed)[:self.max_examples - len(self.examples)]:
+            self.examples.append({
+                'servo_id': int(a['servo_id'][position]),
+                'opcode': int(a['opcode'][position]),
+                'address': int(a['address'][position]),
+                'offset_a_s': float(a['offset'][position]),
+                'offset_b_s': float(b['offset'][position]),
+                'value_a': [int(a['value'][position]), int(a['value_b'][position])],
+                'value_b': [int(b['value'][position]), int(b['value_b'][position])]
+            })
+
+    def _count_only(self, side: int, transactions: np.ndarray):
+        """Count transactions that have no counterpart in the other capture"""
+        unique_keys, counts = np.unique(transactions['key'], return_counts=True)
+        for key, count in zip(unique_keys, counts):
+            diff = self.keys.setdefault(int(key), KeyDiff())
+            if side == 0:
+                diff.only_in_a += int(count)
+            else:
+                diff.only_in_b += int(count)
+
+    def _expire(self):
+        """Give up on transactions the other capture has moved well past"""
+        for side in (0, 1):
+            other = 1 - side
+            buffer = self.buffers[side]
+            if not len(buffer):
+                continue
+            if self.finished[other]:
+                expired = np.ones(len(buffer), dtype=bool)
+            else:
+                expired = buffer['offset'] < self.cursors[other] - self.window
+            if expired.any():
+                self._count_only(side, buffer[expired])
+                self.buffers[side] = buffer[~expired]
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Summarize the differences
+
+        Returns:
+            Dictionary with totals, per-key differences (most different first) and value change examples
+        """
+        protocol_registers = ServoProtocol.REGISTERS
+        rows = []
+        for key, diff in self.keys.items():
+            servo_id, opcode, address = key >> 16, (key >> 8) & 0xFF, key & 0xFF
+            register = protocol_registers.get(address)
+            mean_shift = diff.shift_total / diff.shift_count if diff.shift_count else 0.0
+            rows.append({
+                'servo_id': servo_id,
+                'request': FRAME_LAYOUTS[opcode][0] if opcode in FRAME_LAYOUTS else f"0x{opcode:02X}",
+                'address': f"0x{address:02X}",
+                'register': register.name if register else "",
+                'aligned': diff.aligned,
+                'changed': diff.changed,
+                'missing_in_a': diff.missing_in_a,
+                'missing_in_b': diff.missing_in_b,
+                'unanswered': diff.unanswered,
+                'only_in_a': diff.only_in_a,
+                'only_in_b': diff.only_in_b,
+                'latency_a_p50_ms': diff.latency_a.percentile(50) * 1000,
+                'latency_b_p50_ms': diff.latency_b.percentile(50) * 1000,
+                'latency_a_p99_ms': diff.latency_a.percentile(99) * 1000,
+                'latency_b_p99_ms': diff.latency_b.percentile(99) * 1000,
+                'latency_shift_ms': mean_shift * 1000
+            })
+        rows.sort(key=lambda row: (-(row['changed'] + row['missing_in_a'] + row['missing_in_b'] +
+                                     row['only_in_a'] + row['only_in_b']), -abs(row['latency_shift_ms'])))
+
+        totals = {name: sum(row[name] for row in rows) for name in
+                  ('aligned', 'changed', 'missing_in_a', 'missing_in_b', 'unanswered', 'only_in_a', 'only_in_b')}
+        return {'totals': totals, 'keys': rows, 'examples': self.examples}
+
+def diff_captures(filename_a: str, filename_b: str, max_latency: float = 1.0, window: float = 60.0,
+                  tolerance: float = 0.25, max_examples: int = 20, block_records: int = 1 << 18) -> Dict[str, Any]:
+    """
+    Diff two capture files by request/response transactions
+
+    Both captures are read block by block, always advancing the one that is
+    behind in capture time, so memory stays bounded by the block size and
+    the alignment window.
+
+    Args:
+        filename_a: Reference capture (plain or compressed)
+        filename_b: Capture to compare against it
+        max_latency: Longest request to response time accepted, in seconds
+        window: Seconds to wait for a transaction's counterpart
+        tolerance: Largest change in relative request time between aligned pairs, in seconds
+        max_examples: Number of value changes to list
+        block_records: Records decoded per block
+
+    Returns:
+        Report dictionary (see CaptureDiff.report)
+    """
+    diff = CaptureDiff(window, tolerance, max_examples)
+    with open_capture(filename_a) as reader_a, open_capture(filename_b) as reader_b:
+        streams = [TransactionStream(reader_a, max_latency, block_records),
+                   TransactionStream(reader_b, max_latency, block_records)]
+        iterators = [iter(stream) for stream in streams]
+        while not all(diff.finished):
+            side = min((side for side in (0, 1) if not diff.finished[side]), key=lambda side: diff.cursors[side])
+            try:
+                diff.add(side, next(iterators[side]))
+            except StopIteration:
+                diff.finish(side)
+
+    report = diff.report()
+    report['totals']['unsolicited_a'] = streams[0].unsolicited
+    report['totals']['unsolicited_b'] = streams[1].unsolicited
+    return report
+
+def format_report(report: Dict[str, Any], top: int = 30) -> str:
+    """Render a diff report as plain text"""
+    totals = report['totals']
+    lines = [
+        f"Aligned transactions: {totals['aligned']}",
+        f"Changed values:       {totals['changed']}",
+        f"Missing responses:    {totals['missing_in_a']} in A, {totals['missing_in_b']} in B "
+        f"({totals['unanswered']} unanswered in both)",
+        f"Unaligned requests:   {totals['only_in_a']} only in A, {totals['only_in_b']} only in B",
+        f"Unsolicited:          {totals['unsolicited_a']} responses in A, {totals['unsolicited_b']} in B",
+        "",
+        f"{'servo':<6}{'request':<18}{'register':<20}{'aligned':>9}{'changed':>9}{'miss A':>8}{'miss B':>8}"
+        f"{'only A':>8}{'only B':>8}{'p50 A ms':>10}{'p50 B ms':>10}{'shift ms':>10}"
+    ]
+    for row in report['keys'][:top]:
+        register = f"{row['address']} {row['register']}"
+        lines.append(f"{row['servo_id']:<6}{row['request']:<18}{register:<20}{row['aligned']:>9}{row['changed']:>9}"
+                     f"{row['missing_in_a']:>8}{row['missing_in_b']:>8}{row['only_in_a']:>8}{row['only_in_b']:>8}"
+                     f"{row['latency_a_p50_ms']:>10.3f}{row['latency_b_p50_ms']:>10.3f}"
+                     f"{row['latency_shift_ms']:>+10.3f}")
+    if len(report['keys']) > top:
+        lines.append(f"... {len(report['keys']) - top} more")
+
+    if report['examples']:
+        lines += ["", "First value changes:"]
+        for example in report['examples']:
+            lines.append(f"  servo {example['servo_id']} 0x{example['address']:02X} at {example['offset_a_s']:.3f} s "
+                         f"(B {example['offset_b_s']:.3f} s): {example['value_a']} -> {example['value_b']}")
+    return '\n'.join(lines)
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Compare two captures by request/response transactions")
+    parser.add_argument('capture_a', help="Reference capture (.hcap or .hcapz)")
+    parser.add_argument('capture_b', help="Capture to compare")
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help="Seconds after which a request counts as unanswered")
+    parser.add_argument('--window', type=float, default=60.0,
+                        help="Seconds of capture time to wait for a counterpart transaction")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Seconds of request timing change allowed between aligned transactions")
+    parser.add_argument('--examples', type=int, default=20, help="Number of value changes to list")
+    parser.add_argument('--top', type=int, default=30, help="Number of keys to list")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = diff_captures(args.capture_a, args.capture_b, args.max_latency, args.window,
+                           args.tolerance, args.examples)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, args.top))
+
+if __name__ == "__main__":
+    main()
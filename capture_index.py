@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Sidecar index for capture files
+Lets time range and servo/register/CAN ID queries read only the capture blocks that can match
+"""
+
+import argparse
+import logging
+import os
+import struct
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from capture import CaptureReader, CaptureRecord, unpack_record, FLAG_TX
+from compressed_capture import open_capture
+from servo_protocol import decode_frame, FRAME_LAYOUTS, RESPONSE_FRAME_TYPES
+
+try:
+    import numpy as np
+    from bulk_decoder import capture_records, decode_frames
+except ImportError:
+    np = None
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"HCAPIDX1"
+INDEX_VERSION = 1
+
+# Index header: magic, version, records per block, indexed records, blocks, arbitration IDs, registers
+_HEADER_FORMAT = '<8sHxxIQIII'
+_ARB_ENTRY_FORMAT = '<II'           # arbitration ID, posting count
+_REG_ENTRY_FORMAT = '<BBxxI'        # servo ID, address, posting count
+
+DEFAULT_BLOCK_RECORDS = 4096
+
+# Opcodes whose frames also carry a second register address
+_DUAL_OPCODES = tuple(opcode for opcode, (_, _, layout) in FRAME_LAYOUTS.items() if layout.endswith('_dual'))
+
+def index_filename(capture_filename: str) -> str:
+    """Sidecar index path for a capture file"""
+    return capture_filename + INDEX_SUFFIX
+
+class CaptureIndex:
+    """
+    Block index of a capture file
+
+    The capture is divided into blocks of a fixed number of records. For each
+    block the index keeps the first and last timestamp, and for every
+    arbitration ID and every (servo_id, address) pair it keeps a posting list
+    of the blocks containing that key. A query intersects these and only the
+    surviving blocks are read from the capture.
+    """
+
+    def __init__(self, block_records: int = DEFAULT_BLOCK_RECORDS):
+        self.block_records = block_records
+        self.indexed_records = 0
+        self.block_first_ns = array('Q')
+        self.block_last_ns = array('Q')
+        self.arb_postings: Dict[int, array] = {}
+        self.register_postings: Dict[Tuple[int, int], array] = {}
+
+    @property
+    def block_count(self) -> int:
+        return len(self.block_first_ns)
+
+    def blocks_for(self, start_ns: Optional[int] = None, end_ns: Optional[int] = None,
+                   arb_id: Optional[int] = None, servo_id: Optional[int] = None,
+                   address: Optional[int] = None) -> List[int]:
+        """
+        Find the blocks that may hold matching records
+
+        Args:
+            start_ns: Earliest timestamp in ns
+            end_ns: Latest timestamp in ns
+            arb_id: Arbitration ID
+            servo_id: Servo ID (with or without address)
+            address: Register address (with or without servo ID)
+
+        Returns:
+            Sorted block numbers
+        """
+        candidates: Optional[Set[int]] = None
+
+        if arb_id is not None:
+            candidates = set(self.arb_postings.get(arb_id, ()))
+
+        if servo_id is not None or address is not None:
+            blocks: Set[int] = set()
+            for (key_servo, key_address), postings in self.register_postings.items():
+                if (servo_id is None or key_servo == servo_id) and (address is None or key_address == address):
+                    blocks.update(postings)
+            candidates = blocks if candidates is None else candidates & blocks
+
+        if candidates is None:
+            candidates = set(range(self.block_count))
+
+        if start_ns is not None or end_ns is not None:
+            low = start_ns if start_ns is not None else 0
+            high = end_ns if end_ns is not None else 2 ** 64 - 1
+            candidates = {block for block in candidates
+                          if self.block_first_ns[block] <= high and self.block_last_ns[block] >= low}
+
+        return sorted(candidates)
+
+    def save(self, filename: str):
+        """Write the index to a file"""
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(struct.pack(_HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, self.block_records, self.indexed_records,
+                                self.block_count, len(self.arb_postings), len(self.register_postings)))
+            f.write(self.block_first_ns.tobytes())
+            f.write(self.block_last_ns.tobytes())
+            for arb_id, postings in sorted(self.arb_postings.items()):
+                f.write(struct.pack(_ARB_ENTRY_FORMAT, arb_id, len(postings)))
+                f.write(postings.tobytes())
+            for (servo_id, address), postings in sorted(self.register_postings.items()):
+                f.write(struct.pack(_REG_ENTRY_FORMAT, servo_id, address, len(postings)))
+                f.write(postings.tobytes())
+        # Replace atomically so readers never see a half-written index
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename: str) -> 'CaptureIndex':
+        """
+        Read an index file
+
+        Args:
+            filename: Index file written by save()
+
+        Returns:
+            CaptureIndex
+        """
+        with open(filename, 'rb') as f:
+            payload = f.read()
+
+        header_size = struct.calcsize(_HEADER_FORMAT)
+        magic, version, block_records, indexed_records, blocks, arb_count, register_count = \
+            struct.unpack_from(_HEADER_FORMAT, payload, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{filename} is not a capture index")
+        if version > INDEX_VERSION:
+            raise ValueError(f"Unsupported capture index version {version}")
+
+        index = cls(block_records)
+        index.indexed_records = indexed_records
+        offset = header_size
+
+        def read_array(typecode: str, count: int) -> array:
+            nonlocal offset
+            values = array(typecode)
+            values.frombytes(payload[offset:offset + count * values.itemsize])
+            offset += count * values.itemsize
+            return values
+
+        index.block_first_ns = read_array('Q', blocks)
+        index.block_last_ns = read_array('Q', blocks)
+        for _ in range(arb_count):
+            arb_id, count = struct.unpack_from(_ARB_ENTRY_FORMAT, payload, offset)
+            offset += struct.calcsize(_ARB_ENTRY_FORMAT)
+            index.arb_postings[arb_id] = read_array('I', count)
+        for _ in range(register_count):
+            servo_id, address, count = struct.unpack_from(_REG_ENTRY_FORMAT, payload, offset)
+            offset += struct.calcsize(_REG_ENTRY_FORMAT)
+            index.register_postings[(servo_id, address)] = read_array('I', count)
+        return index
+
+class CaptureIndexBuilder:
+    """
+    Builds a CaptureIndex one record at a time
+
+    Pass one to CaptureRecorder to index while recording; the finished
+    index is written next to the capture when the recording stops.
+    """
+
+    def __init__(self, filename: Optional[str] = None, block_records: int = DEFAULT_BLOCK_RECORDS):
+        """
+        Initialize index builder
+
+        Args:
+            filename: Index file written by finish(), None to keep it in memory only
+            block_records: Records per index block
+        """
+        self.filename = filename
+        self.index = CaptureIndex(block_records)
+        self._block_arb_ids: Set[int] = set()
+        self._block_registers: Set[Tuple[int, int]] = set()
+        self._block_first_ns = 0
+        self._block_last_ns = 0
+        self._block_count = 0
+
+    @classmethod
+    def for_capture(cls, capture_filename: str, block_records: int = DEFAULT_BLOCK_RECORDS) -> 'CaptureIndexBuilder':
+        """Builder that writes the sidecar index of a capture file"""
+        return cls(index_filename(capture_filename), block_records)
+
+    def add_record(self, record_index: int, record: bytes):
+        """
+        Index one packed capture record
+
+        Args:
+            record_index: Position of the record in the capture
+            record: Packed record (capture.RECORD_FORMAT)
+        """
+        self.add(record_index, unpack_record(record))
+
+    def add(self, record_index: int, record: CaptureRecord):
+        """Index one capture record"""
+        if self._block_count == 0:
+            self._block_first_ns = record.timestamp_ns
+            self._block_last_ns = record.timestamp_ns
+        else:
+            # Frames from different threads are not strictly ordered, so track the range
+            self._block_first_ns = min(self._block_first_ns, record.timestamp_ns)
+            self._block_last_ns = max(self._block_last_ns, record.timestamp_ns)
+
+        self._block_arb_ids.add(record.arbitration_id)
+        frame = decode_frame(record.data)
+        if frame:
+            self._block_registers.add((frame['servo_id'], frame['address']))
+            if frame['address_b'] is not None:
+                self._block_registers.add((frame['servo_id'], frame['address_b']))
+
+        self._block_count += 1
+        self.index.indexed_records = record_index + 1
+        if self._block_count == self.index.block_records:
+            self._close_block()
+
+    def add_block(self, first_ns: int, last_ns: int, arb_ids, registers, records: int):
+        """Index a whole block at once (used by the vectorized builder)"""
+        self._block_first_ns, self._block_last_ns = first_ns, last_ns
+        self._block_arb_ids = set(arb_ids)
+        self._block_registers = set(registers)
+        self._block_count = records
+        self.index.indexed_records += records
+        self._close_block()
+
+    def _close_block(self):
+        """Add the current block to the block table and posting lists"""
+        block = self.index.block_count
+        self.index.block_first_ns.append(self._block_first_ns)
+        self.index.block_last_ns.append(self._block_last_ns)
+        for arb_id in self._block_arb_ids:
+            self.index.arb_postings.setdefault(arb_id, array('I')).append(block)
+        for key in self._block_registers:
+            self.index.register_postings.setdefault(key, array('I')).append(block)
+        self._block_arb_ids = set()
+        self._block_registers = set()
+        self._block_count = 0
+
+    def finish(self) -> CaptureIndex:
+        """Close the last partial block and write the index file"""
+        if self._block_count:
+            self._close_block()
+        if self.filename:
+            self.index.save(self.filename)
+        return self.index
+
+def build_index(capture_filename: str, block_records: int = DEFAULT_BLOCK_RECORDS,
+                save: bool = True) -> CaptureIndex:
+    """
+    Index an existing capture in one pass
+
+    Uses the vectorized decoder when NumPy is installed.
+
+    Args:
+        capture_filename: Capture file
+        block_records: Records per index block
+        save: Write the sidecar index file
+
+    Returns:
+        CaptureIndex
+    """
+    builder = CaptureIndexBuilder(index_filename(capture_filename) if save else None, block_records)
+    with open_capture(capture_filename) as reader:
+        if np is not None:
+            for start in range(0, len(reader), block_records):
+                records = capture_records(reader, start, start + block_records)
+                decoded = decode_frames(records['data'], records['dlc'], records['arb_id'])
+                registers = set(zip(decoded['servo_id'].tolist(), decoded['address'].tolist()))
+                dual = decoded[np.isin(decoded['opcode'], _DUAL_OPCODES)]
+                registers.update(zip(dual['servo_id'].tolist(), dual['address_b'].tolist()))
+                timestamps = records['timestamp_ns']
+                builder.add_block(int(timestamps.min()), int(timestamps.max()),
+                                  np.unique(records['arb_id']).tolist(), registers, len(records))
+                del records, decoded, dual, timestamps
+        else:
+            for record_index, record in enumerate(reader):
+                builder.add(record_index, record)
+    return builder.finish()
+
+def load_index(capture_filename: str) -> Optional[CaptureIndex]:
+    """Load a capture's sidecar index if it exists"""
+    filename = index_filename(capture_filename)
+    if not os.path.exists(filename):
+        return None
+    return CaptureIndex.load(filename)
+
+def search_capture(reader: CaptureReader, index: Optional[CaptureIndex] = None,
+                   start_time: Optional[float] = None, end_time: Optional[float] = None,
+                   arb_id: Optional[int] = None, servo_id: Optional[int] = None,
+                   address: Optional[int] = None, responses_only: bool = False
+                   ) -> Iterator[Tuple[int, CaptureRecord, Optional[Dict]]]:
+    """
+    Find capture records by time range, arbitration ID, servo and register
+
+    With an index, only candidate blocks are read; records written after the
+    index was built are scanned directly. Without one the whole capture is
+    scanned.
+
+    Args:
+        reader: Open capture file
+        index: Its index, or None to scan
+        start_time: Earliest timestamp in seconds since the epoch
+        end_time: Latest timestamp in seconds since the epoch
+        arb_id: Arbitration ID
+        servo_id: Servo ID
+        address: Register address (also matches the second register of dual frames)
+        responses_only: Only match servo responses
+
+    Yields:
+        Tuples of (record index, CaptureRecord, decoded frame or None)
+    """
+    start_ns = int(start_time * 1e9) if start_time is not None else None
+    end_ns = int(end_time * 1e9) if end_time is not None else None
+    need_frame = servo_id is not None or address is not None or responses_only
+
+    def matches(record: CaptureRecord) -> Tuple[bool, Optional[Dict]]:
+        if start_ns is not None and record.timestamp_ns < start_ns:
+            return False, None
+        if end_ns is not None and record.timestamp_ns > end_ns:
+            return False, None
+        if arb_id is not None and record.arbitration_id != arb_id:
+            return False, None
+        frame = decode_frame(record.data)
+        if need_frame:
+            if frame is None:
+                return False, None
+            if servo_id is not None and frame['servo_id'] != servo_id:
+                return False, None
+            if address is not None and address not in (frame['address'], frame['address_b']):
+                return False, None
+            if responses_only and (frame['type'] not in RESPONSE_FRAME_TYPES or record.flags & FLAG_TX):
+                return False, None
+        return True, frame
+
+    if index is not None:
+        ranges = [(block * index.block_records, min((block + 1) * index.block_records, index.indexed_records))
+                  for block in index.blocks_for(start_ns, end_ns, arb_id, servo_id, address)]
+        if index.indexed_records < len(reader):
+            ranges.append((index.indexed_records, len(reader)))
+    else:
+        ranges = [(0, len(reader))]
+
+    for start, stop in ranges:
+        for record_index, record in enumerate(reader.records(start, stop), start):
+            matched, frame = matches(record)
+            if matched:
+                yield record_index, record, frame
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Build or query a capture's sidecar index")
+    parser.add_argument('capture', help="Capture file (.hcap or .hcapz)")
+    parser.add_argument('--build', action='store_true', help="(Re)build the index")
+    parser.add_argument('--block-records', type=int, default=DEFAULT_BLOCK_RECORDS, help="Records per index block")
+    parser.add_argument('--servo', type=lambda v: int(v, 0), help="Servo ID")
+    parser.add_argument('--register', type=lambda v: int(v, 0), help="Register address, e.g. 0x0C")
+    parser.add_argument('--arb-id', type=lambda v: int(v, 0), help="Arbitration ID")
+    parser.add_argument('--start', type=float, help="Start time (seconds since epoch)")
+    parser.add_argument('--end', type=float, help="End time (seconds since epoch)")
+    parser.add_argument('--responses', action='store_true', help="Only servo responses")
+    parser.add_argument('--limit', type=int, default=100, help="Maximum records to print")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    index = build_index(args.capture, args.block_records) if args.build else load_index(args.capture)
+    if args.build:
+        print(f"Indexed {index.indexed_records} records in {index.block_count} blocks")
+
+    if any(value is not None for value in (args.servo, args.register, args.arb_id, args.start, args.end)) or args.responses:
+        with open_capture(args.capture) as reader:
+            results = search_capture(reader, index, args.start, args.end, args.arb_id,
+                                     args.servo, args.register, args.responses)
+            for count, (record_index, record, frame) in enumerate(results):
+                if count >= args.limit:
+                    break
+                direction = "TX" if record.is_tx else "RX"
+                data = ' '.join(f"{b:02X}" for b in record.data)
+                print(f"{record_index:>10} {record.timestamp:.6f} {direction} 0x{record.arbitration_id:X} {data}")
+            results.close()
+
+if __name__ == "__main__":
+    main()
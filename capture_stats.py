@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Streaming capture statistics
+Summarizes a capture in one pass with memory bounded by the number of IDs and servos, not frames
+"""
+
+import argparse
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from bulk_decoder import capture_records, decode_frames
+from capture import FLAG_ERROR, FLAG_EXTENDED, FLAG_TX
+from compressed_capture import open_capture
+from servo_protocol import FRAME_LAYOUTS, LEGACY_REQUEST_HEADER, RESPONSE_FRAME_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Frame types that ask the servo for a response (old format reads are decided per frame)
+REQUEST_FRAME_TYPES = ('read_single', 'read_dual', 'write_single_read', 'write_dual_read')
+
+# Latency histogram: 40 log-spaced bins per decade from 1 us to 10 s (about 6% resolution)
+LATENCY_BIN_EDGES_US = np.logspace(0, 7, 281)
+
+# Request/response roles of decoded frames
+ROLE_NONE = 0
+ROLE_REQUEST = 1
+ROLE_RESPONSE = 2
+
+def _build_role_table() -> np.ndarray:
+    """Per-opcode request/response role"""
+    roles = np.zeros(256, dtype=np.uint8)
+    for opcode, (frame_type, _, _) in FRAME_LAYOUTS.items():
+        if frame_type in REQUEST_FRAME_TYPES:
+            roles[opcode] = ROLE_REQUEST
+        elif frame_type in RESPONSE_FRAME_TYPES:
+            roles[opcode] = ROLE_RESPONSE
+    return roles
+
+_OPCODE_ROLES = _build_role_table()
+
+def frame_roles(decoded: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """
+    Classify decoded frames as requests that expect a response, responses, or neither
+
+    Args:
+        decoded: Frames from bulk_decoder.decode_frames
+        data: Payload array the frames were decoded from, shape (N, 8)
+
+    Returns:
+        Array of ROLE_* values, one per decoded frame
+    """
+    roles = _OPCODE_ROLES[decoded['opcode']]
+    legacy_request = decoded['opcode'] == LEGACY_REQUEST_HEADER
+    if legacy_request.any():
+        # Old format reads have REG length 0
+        reg_length = data[decoded['index'], 3]
+        roles[legacy_request] = np.where(reg_length[legacy_request] == 0, ROLE_REQUEST, ROLE_NONE)
+    return roles
+
+def _match_keyed(keys: np.ndarray, roles: np.ndarray, times: np.ndarray,
+                 max_latency_ns: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pair responses with the latest request of the same key; see match_requests"""
+    order = np.argsort(keys, kind='stable')
+    keys, roles, times = keys[order], roles[order], times[order]
+    positions = np.arange(len(keys))
+    group_start = np.maximum.accumulate(np.where(np.r_[True, keys[1:] != keys[:-1]], positions, 0))
+
+    # Latest request, and latest response strictly before each event, within the same key
+    last_request = np.maximum.accumulate(np.where(roles == ROLE_REQUEST, positions, -1))
+    last_response = np.maximum.accumulate(np.where(roles == ROLE_RESPONSE, positions, -1))
+    previous_response = np.r_[-1, last_response[:-1]]
+
+    responses = np.flatnonzero((roles == ROLE_RESPONSE) & (last_request >= group_start) &
+                               (previous_response < last_request))
+    requests = last_request[responses]
+    latency = times[responses] - times[requests]
+    in_range = (latency >= 0) & (latency <= max_latency_ns)
+
+    # The last event of each key is an open request unless a response follows it
+    last_of_key = np.r_[keys[1:] != keys[:-1], True]
+    open_requests = np.flatnonzero(last_of_key & (roles == ROLE_REQUEST))
+    return order[responses[in_range]], order[requests[in_range]], order[open_requests]
+
+def match_requests(keys: np.ndarray, roles: np.ndarray, times: np.ndarray,
+                   max_latency_ns: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pair responses with the requests they answer
+
+    A response answers the latest request for the same servo and register
+    if it arrives within max_latency_ns and no other response came in
+    between. A request to servo 0 goes to every servo, so it is answered by
+    the first response for its register from any servo that no request
+    addressed to that servo claimed.
+
+    Args:
+        keys: servo_id << 8 | address per event
+        roles: ROLE_REQUEST or ROLE_RESPONSE per event
+        times: Timestamps in nanoseconds, events in capture order
+        max_latency_ns: Longest request to response time accepted
+
+    Returns:
+        Tuple of (response indices, indices of the requests they answer,
+        indices of requests still open: unanswered with nothing after them)
+    """
+    broadcast = (roles == ROLE_REQUEST) & ((keys >> 8) == 0)
+    addressed = np.flatnonzero(~broadcast)
+    responses, requests, open_requests = (addressed[found] for found in
+                                          _match_keyed(keys[addressed], roles[addressed], times[addressed],
+                                                       max_latency_ns))
+    if not broadcast.any():
+        return responses, requests, open_requests
+
+    # Broadcast requests against the responses left over, by register alone
+    answered = np.zeros(len(keys), dtype=bool)
+    answered[responses] = True
+    rest = np.flatnonzero(broadcast | ((roles == ROLE_RESPONSE) & ~answered))
+    more_responses, more_requests, more_open = (rest[found] for found in
+                                                _match_keyed(keys[rest] & 0xFF, roles[rest], times[rest],
+                                                             max_latency_ns))
+    return (np.concatenate([responses, more_responses]), np.concatenate([requests, more_requests]),
+            np.concatenate([open_requests, more_open]))
+
+def frame_bits(dlc: np.ndarray, extended: np.ndarray, stuffing: bool = False) -> np.ndarray:
+    """
+    Bits on the wire per data frame, including interframe space
+
+    Args:
+        dlc: Data length codes
+        extended: True for 29-bit identifiers
+        stuffing: Add the worst-case number of stuff bits
+
+    Returns:
+        Bits per frame (int64)
+    """
+    data_bits = dlc.astype(np.int64) * 8
+    bits = np.where(extended, 67, 47) + data_bits
+    if stuffing:
+        # Only SOF through CRC is stuffed: 34 (standard) or 54 (extended) bits plus the data
+        bits += (np.where(extended, 54, 34) + data_bits - 1) // 4
+    return bits
+
+@dataclass
+class IdStats:
+    """Arrival statistics of one arbitration ID"""
+    count: int = 0
+    first_ns: int = 0
+    last_ns: int = 0
+    intervals: int = 0
+    mean_interval: float = 0.0  # Seconds
+    m2_interval: float = 0.0    # Sum of squared deviations (Chan et al. merge)
+    min_interval: float = float('inf')
+    max_interval: float = 0.0
+
+    def merge_intervals(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        """Fold a batch of interval statistics into the running totals"""
+        total = self.intervals + count
+        delta = mean - self.mean_interval
+        self.mean_interval += delta * count / total
+        self.m2_interval += m2 + delta * delta * self.intervals * count / total
+        self.intervals = total
+        self.min_interval = min(self.min_interval, minimum)
+        self.max_interval = max(self.max_interval, maximum)
+
+@dataclass
+class LatencyStats:
+    """Request to response latency of one servo"""
+    histogram: np.ndarray = field(default_factory=lambda: np.zeros(len(LATENCY_BIN_EDGES_US) + 1, dtype=np.int64))
+    count: int = 0
+    total: float = 0.0          # Seconds
+    minimum: float = float('inf')
+    maximum: float = 0.0
+
+    def add(self, latencies: np.ndarray):
+        """Add latencies in seconds"""
+        if not len(latencies):
+            return
+        bins = np.searchsorted(LATENCY_BIN_EDGES_US, latencies * 1e6)
+        self.histogram += np.bincount(bins, minlength=len(self.histogram))
+        self.count += len(latencies)
+        self.total += float(latencies.sum())
+        self.minimum = min(self.minimum, float(latencies.min()))
+        self.maximum = max(self.maximum, float(latencies.max()))
+
+    @property
+    def mean(self) -> float:
+        """Mean latency in seconds"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Approximate percentile in seconds (upper edge of the bin holding it)"""
+        if not self.count:
+            return 0.0
+        rank = np.searchsorted(np.cumsum(self.histogram), q / 100.0 * self.count)
+        if rank >= len(LATENCY_BIN_EDGES_US):
+            return self.maximum
+        return min(float(LATENCY_BIN_EDGES_US[rank]) / 1e6, self.maximum)
+
+class CaptureStatistics:
+    """
+    Accumulates capture statistics block by block
+
+    Every block is processed with NumPy and then discarded. Request/response
+    matching pairs each response with the latest unanswered request for the
+    same (servo, register); requests still open at the end of a block carry
+    over to the next one, so results do not depend on the block size.
+    """
+
+    def __init__(self, bitrate: int = 500000, max_latency: float = 1.0):
+        """
+        Initialize statistics
+
+        Args:
+            bitrate: Nominal bus bitrate in bps, for bus load
+            max_latency: Responses later than this many seconds count as unanswered
+        """
+        self.bitrate = bitrate
+        self.max_latency_ns = int(max_latency * 1e9)
+
+        self.frames = 0
+        self.tx_frames = 0
+        self.error_frames = 0
+        self.undecoded_frames = 0
+        self.first_ns: Optional[int] = None
+        self.last_ns: Optional[int] = None
+        self.bits = 0
+        self.stuffed_bits = 0
+
+        self.ids: Dict[int, IdStats] = {}       # Key: arb_id | FLAG_EXTENDED << 32
+        self.opcodes = np.zeros(256, dtype=np.int64)
+        self.requests = 0
+        self.responses = 0
+        self.matched = 0
+        self.latency: Dict[int, LatencyStats] = {}
+        self.pending: Dict[int, int] = {}       # servo_id << 8 | address -> request timestamp_ns
+
+        self.window_bits: Dict[int, int] = {}   # Whole second since first frame -> bits
+        self.peak_window_bits = 0
+
+    def update(self, records: np.ndarray):
+        """
+        Add a block of capture records
+
+        Args:
+            records: Structured array of CAPTURE_RECORD_DTYPE, in capture order
+        """
+        if not len(records):
+            return
+
+        timestamps = records['timestamp_ns'].astype(np.int64)
+        flags = records['flags']
+        if self.first_ns is None:
+            self.first_ns = int(timestamps[0])
+        self.first_ns = min(self.first_ns, int(timestamps.min()))
+        self.last_ns = max(self.last_ns or 0, int(timestamps.max()))
+
+        self.frames += len(records)
+        self.tx_frames += int(np.count_nonzero(flags & FLAG_TX))
+        is_error = (flags & FLAG_ERROR) != 0
+        self.error_frames += int(np.count_nonzero(is_error))
+
+        frames = records[~is_error]
+        frame_timestamps = timestamps[~is_error]
+        extended = (frames['flags'] & FLAG_EXTENDED) != 0
+        self._update_bus_load(frames['dlc'], extended, frame_timestamps)
+        self._update_ids(frames['arb_id'].astype(np.int64) | (extended.astype(np.int64) << 32), frame_timestamps)
+
+        decoded = decode_frames(frames['data'], frames['dlc'], frames['arb_id'])
+        self.undecoded_frames += len(frames) - len(decoded)
+        self.opcodes += np.bincount(decoded['opcode'], minlength=256)
+        self._update_latency(decoded, frames['data'], frame_timestamps)
+
+    def _update_bus_load(self, dlc: np.ndarray, extended: np.ndarray, timestamps: np.ndarray):
+        """Accumulate wire bits overall and per one-second window"""
+        bits = frame_bits(dlc, extended)
+        self.bits += int(bits.sum())
+        self.stuffed_bits += int(frame_bits(dlc, extended, stuffing=True).sum())
+        if not len(bits):
+            return
+
+        seconds = (timestamps - self.first_ns) // 1_000_000_000
+        offset = int(seconds.min())
+        per_second = np.bincount(seconds - offset, weights=bits)
+        for second in np.flatnonzero(per_second):
+            key = offset + int(second)
+            self.window_bits[key] = self.window_bits.get(key, 0) + int(per_second[second])
+
+        # Windows more than a second before this block are complete
+        for key in [key for key in self.window_bits if key < offset - 1]:
+            self.peak_window_bits = max(self.peak_window_bits, self.window_bits.pop(key))
+
+    def _update_ids(self, keys: np.ndarray, timestamps: np.ndarray):
+        """Accumulate per-ID counts and arrival intervals"""
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        groups = inverse[order]
+        ordered = timestamps[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        ends = np.r_[starts[1:], len(groups)]
+
+        for group, key in enumerate(unique_keys):
+            key = int(key)
+            group_times = ordered[starts[group]:ends[group]]
+            stats = self.ids.get(key)
+            if stats is None:
+                stats = self.ids[key] = IdStats(first_ns=int(group_times[0]), last_ns=int(group_times[0]))
+                intervals = np.diff(group_times)
+            else:
+                intervals = np.diff(group_times, prepend=stats.last_ns)
+            stats.count += len(group_times)
+            stats.last_ns = int(group_times[-1])
+
+            if len(intervals):
+                intervals = intervals / 1e9
+                mean = float(intervals.mean())
+                stats.merge_intervals(len(intervals), mean, float(((intervals - mean) ** 2).sum()),
+                                      float(intervals.min()), float(intervals.max()))
+
+    def _update_latency(self, decoded: np.ndarray, data: np.ndarray, timestamps: np.ndarray):
+        """Match responses to requests and accumulate per-servo latency"""
+        roles = frame_roles(decoded, data)
+        events = decoded[roles != 0]
+        roles = roles[roles != 0]
+        self.requests += int(np.count_nonzero(roles == ROLE_REQUEST))
+        self.responses += int(np.count_nonzero(roles == ROLE_RESPONSE))
+
+        # Requests left open by earlier blocks go first
+        carried_keys = np.fromiter(self.pending.keys(), dtype=np.int64, count=len(self.pending))
+        carried_times = np.fromiter(self.pending.values(), dtype=np.int64, count=len(self.pending))
+        keys = np.concatenate([carried_keys, (events['servo_id'].astype(np.int64) << 8) | events['address']])
+        times = np.concatenate([carried_times, timestamps[events['index']]])
+        roles = np.concatenate([np.full(len(carried_keys), ROLE_REQUEST, dtype=np.uint8), roles])
+        if not len(keys):
+            return
+
+        responses, requests, open_requests = match_requests(keys, roles, times, self.max_latency_ns)
+        latencies = (times[responses] - times[requests]) / 1e9
+        self.matched += len(latencies)
+
+        # Broadcast requests count toward the servo that answered
+        servos = keys[responses] >> 8
+        for servo in np.unique(servos):
+            self.latency.setdefault(int(servo), LatencyStats()).add(latencies[servos == servo])
+
+        self.pending = {int(keys[index]): int(times[index]) for index in open_requests}
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Summarize everything seen so far
+
+        Returns:
+            Dictionary of capture, per-ID, opcode, latency and bus load statistics
+        """
+        duration = (self.last_ns - self.first_ns) / 1e9 if self.frames else 0.0
+        capacity = duration * self.bitrate if duration > 0 else 0.0
+        peak_bits = max([self.peak_window_bits] + list(self.window_bits.values()))
+
+        ids = []
+        for key, stats in sorted(self.ids.items(), key=lambda item: -item[1].count):
+            extended = bool(key >> 32)
+            arb_id = key & 0xFFFFFFFF
+            ids.append({
+                'arb_id': f"0x{arb_id:08X}" if extended else f"0x{arb_id:03X}",
+                'frames': stats.count,
+                'frames_per_s': stats.count / duration if duration > 0 else 0.0,
+                'cycle_mean_ms': stats.mean_interval * 1000,
+                'cycle_jitter_ms': (stats.m2_interval / stats.intervals) ** 0.5 * 1000 if stats.intervals else 0.0,
+                'cycle_min_ms': stats.min_interval * 1000 if stats.intervals else 0.0,
+                'cycle_max_ms': stats.max_interval * 1000
+            })
+
+        latency = {}
+        for servo, stats in sorted(self.latency.items()):
+            latency[servo] = {
+                'responses': stats.count,
+                'mean_ms': stats.mean * 1000,
+                'min_ms': stats.minimum * 1000,
+                'p50_ms': stats.percentile(50) * 1000,
+                'p90_ms': stats.percentile(90) * 1000,
+                'p99_ms': stats.percentile(99) * 1000,
+                'max_ms': stats.maximum * 1000
+            }
+
+        opcodes = {}
+        for opcode in np.flatnonzero(self.opcodes):
+            frame_type = FRAME_LAYOUTS[int(opcode)][0]
+            opcodes[f"0x{int(opcode):02X} {frame_type}"] = int(self.opcodes[opcode])
+
+        return {
+            'frames': self.frames,
+            'tx_frames': self.tx_frames,
+            'error_frames': self.error_frames,
+            'undecoded_frames': self.undecoded_frames,
+            'duration_s': duration,
+            'frames_per_s': self.frames / duration if duration > 0 else 0.0,
+            'bus_load_percent': self.bits / capacity * 100 if capacity else 0.0,
+            'bus_load_stuffed_percent': self.stuffed_bits / capacity * 100 if capacity else 0.0,
+            'peak_bus_load_percent': peak_bits / self.bitrate * 100,
+            'bitrate': self.bitrate,
+            'requests': self.requests,
+            'responses': self.responses,
+            'matched_responses': self.matched,
+            'unanswered_requests': self.requests - self.matched,
+            'ids': ids,
+            'opcodes': opcodes,
+            'latency': latency
+        }
+
+def analyze_capture(filename: str, bitrate: int = 500000, max_latency: float = 1.0,
+                    block_records: int = 1 << 20) -> Dict[str, Any]:
+    """
+    Compute statistics for a capture file in one pass
+
+    Args:
+        filename: Plain or compressed capture
+        bitrate: Nominal bus bitrate in bps
+        max_latency: Longest request to response time accepted, in seconds
+        block_records: Records processed per block (bounds memory use)
+
+    Returns:
+        Report dictionary (see CaptureStatistics.report)
+    """
+    statistics = CaptureStatistics(bitrate, max_latency)
+    with open_capture(filename) as reader:
+        total = len(reader)
+        for start in range(0, total, block_records):
+            statistics.update(capture_records(reader, start, min(start + block_records, total)))
+            logger.debug(f"Processed {min(start + block_records, total)}/{total} records")
+    return statistics.report()
+
+def format_report(report: Dict[str, Any], top: int = 20) -> str:
+    """Render a report as plain text"""
+    lines = [
+        f"Frames:         {report['frames']} ({report['tx_frames']} TX, {report['error_frames']} error, "
+        f"{report['undecoded_frames']} not servo protocol)",
+        f"Duration:       {report['duration_s']:.3f} s, {report['frames_per_s']:.1f} frames/s",
+        f"Bus load:       {report['bus_load_percent']:.2f}% "
+        f"({report['bus_load_stuffed_percent']:.2f}% with worst-case stuffing), "
+        f"peak {report['peak_bus_load_percent']:.2f}% over 1 s at {report['bitrate']} bps",
+        f"Requests:       {report['requests']}, {report['responses']} responses, "
+        f"{report['matched_responses']} matched, {report['unanswered_requests']} unanswered",
+        "",
+        f"{'ID':<12}{'frames':>10}{'frames/s':>11}{'cycle ms':>11}{'jitter ms':>11}{'min ms':>10}{'max ms':>10}"
+    ]
+    for item in report['ids'][:top]:
+        lines.append(f"{item['arb_id']:<12}{item['frames']:>10}{item['frames_per_s']:>11.1f}"
+                     f"{item['cycle_mean_ms']:>11.3f}{item['cycle_jitter_ms']:>11.3f}"
+                     f"{item['cycle_min_ms']:>10.3f}{item['cycle_max_ms']:>10.3f}")
+    if len(report['ids']) > top:
+        lines.append(f"... {len(report['ids']) - top} more IDs")
+
+    lines += ["", "Opcode mix:"]
+    for name, count in sorted(report['opcodes'].items(), key=lambda item: -item[1]):
+        lines.append(f"  {name:<24}{count:>10}")
+
+    lines += ["", f"{'Servo':<7}{'responses':>10}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for servo, item in report['latency'].items():
+        lines.append(f"{servo:<7}{item['responses']:>10}{item['mean_ms']:>10.3f}{item['p50_ms']:>10.3f}"
+                     f"{item['p90_ms']:>10.3f}{item['p99_ms']:>10.3f}{item['max_ms']:>10.3f}")
+    return '\n'.join(lines)
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Summarize a capture in one streaming pass")
+    parser.add_argument('capture', help="Capture file (.hcap or .hcapz)")
+    parser.add_argument('--bitrate', type=int, default=500000, help="CAN bitrate in bps, for bus load")
+    parser.add_argument('--max-latency', type=float, default=1.0,
+                        help="Seconds after which a request counts as unanswered")
+    parser.add_argument('--block-records', type=int, default=1 << 20, help="Records per processing block")
+    parser.add_argument('--top', type=int, default=20, help="Number of IDs to list")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = analyze_capture(args.capture, args.bitrate, args.max_latency, args.block_records)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, args.top))
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,8 @@ class ConfigManager:
             'last_log_directory': '',
             'auto_connect': False,
             'message_display_limit': 1000,
+            'web_history_depth': 1000,
+            'metrics_port': 0,
             'log_level': 'INFO'
         }
     
@@ -211,6 +213,16 @@ class ConfigManager:
                 if 100 <= limit <= 10000:
                     validated['message_display_limit'] = limit
             
+            if 'web_history_depth' in config:
+                depth = int(config['web_history_depth'])
+                if 100 <= depth <= 1000000:
+                    validated['web_history_depth'] = depth
+            
+            if 'metrics_port' in config:
+                port = int(config['metrics_port'])
+                if 0 <= port <= 65535:
+                    validated['metrics_port'] = port
+            
             if 'log_level' in config and config['log_level'] in ['DEBUG', 'INFO', 'WARNING', 'ERROR']:
                 validated['log_level'] = config['log_level']
             
@@ -10,11 +10,16 @@ import threading
 import time
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 
 from can_interface import CANInterface
-from servo_protocol import ServoProtocol
+from servo_protocol import ServoProtocol, decode_frame
 from config_manager import ConfigManager
+from servo_client import ServoClient
+from metrics import MetricsExporter, start_exporter
+from capture import CaptureRecorder, CAPTURE_EXTENSION
+from capture_index import CaptureIndexBuilder
+from compressed_capture import CompressedCaptureRecorder, COMPRESSED_CAPTURE_EXTENSION
 import utils
 
 class ServoControlGUI:
@@ -32,13 +37,20 @@ class ServoControlGUI:
         self.logger = logging.getLogger(__name__)
         
         # Initialize components
-        self.can_interface = CANInterface()
+        self.can_interface = CANInterface(queue_received=False)  # Consumed through callbacks only
         self.servo_protocol = ServoProtocol()
+        self.servo_client = ServoClient(self.can_interface, self.servo_protocol)
         self.config_manager = ConfigManager()
+        self.capture_recorder: Optional[Union[CaptureRecorder, CompressedCaptureRecorder]] = None
         
         # Load configuration
         self.config = self.config_manager.load_config()
         
+        # Prometheus exporter for unattended benches, off unless a port is configured
+        self.metrics_exporter: Optional[MetricsExporter] = None
+        if self.config.get('metrics_port'):
+            self.metrics_exporter = start_exporter(self.config['metrics_port'], self.can_interface, self.servo_client)
+        
         # Create main window first
         self.root = tk.Tk()
         self.root.title("Hitec CAN Servo Programming Tool")
@@ -330,6 +342,8 @@ Troubleshooting:
         
         ttk.Button(controls_frame, text="Clear Messages", command=self.clear_messages).pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(controls_frame, text="Save Log", command=self.save_message_log).pack(side=tk.LEFT, padx=(0, 10))
+        self.capture_btn = ttk.Button(controls_frame, text="Record Capture", command=self.toggle_capture)
+        self.capture_btn.pack(side=tk.LEFT, padx=(0, 10))
         
         # Message count
         self.message_count_var = tk.StringVar(value="Messages: 0")
@@ -564,7 +578,7 @@ Troubleshooting:
             addr = int(register_addr, 16) if register_addr.startswith('0x') else int(register_addr, 16)
             
             is_extended = self.extended_id_var.get()
-            arbitration_id, message_data = self.servo_protocol.create_read_message(servo_id, addr, is_extended)
+            arbitration_id, message_data = self.servo_protocol.create_read_for_servo(servo_id, addr, is_extended)
             
             if self.can_interface.send_message(arbitration_id, message_data, is_extended):
                 self.status_label.config(text=f"Read command sent to servo {servo_id}, register {register_addr}")
@@ -593,7 +607,7 @@ Troubleshooting:
             value = int(register_value, 16) if register_value.startswith('0x') else int(register_value, 16)
             
             is_extended = self.extended_id_var.get()
-            arbitration_id, message_data = self.servo_protocol.create_write_message(servo_id, addr, value, is_extended)
+            arbitration_id, message_data = self.servo_protocol.create_write_for_servo(servo_id, addr, value, is_extended)
             
             if self.can_interface.send_message(arbitration_id, message_data, is_extended):
                 self.status_label.config(text=f"Write command sent to servo {servo_id}, register {register_addr} = {register_value}")
@@ -735,8 +749,9 @@ Troubleshooting:
             is_extended = self.extended_id_var.get()
             
             # Send CAN message to set CAN ID LOW (register 0x06)
-            arbitration_id, data = self.servo_protocol.create_write_message(servo_id, 0x3E, new_id, is_extended)
+            arbitration_id, data = self.servo_protocol.create_write_for_servo(servo_id, 0x3E, new_id, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.servo_client.note_identity_write(servo_id, 0x3E, new_id)
                 self.results_text.insert(tk.END, f"Set CAN ID LOW to {new_id} for servo {servo_id}\n")
                 self.results_text.see(tk.END)
                 self.status_label.config(text=f"CAN ID LOW set to {new_id}")
@@ -756,8 +771,9 @@ Troubleshooting:
             is_extended = self.extended_id_var.get()
             
             # Send CAN message to set CAN ID HIGH (register 0x07)
-            arbitration_id, data = self.servo_protocol.create_write_message(servo_id, 0x3C, new_id, is_extended)
+            arbitration_id, data = self.servo_protocol.create_write_for_servo(servo_id, 0x3C, new_id, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.servo_client.note_identity_write(servo_id, 0x3C, new_id)
                 self.results_text.insert(tk.END, f"Set CAN ID HIGH to {new_id} for servo {servo_id}\n")
                 self.results_text.see(tk.END)
                 self.status_label.config(text=f"CAN ID HIGH set to {new_id}")
@@ -777,8 +793,9 @@ Troubleshooting:
             is_extended = self.extended_id_var.get()
             
             # Send CAN message to set CAN mode (register 0x6A)
-            arbitration_id, data = self.servo_protocol.create_write_message(servo_id, 0x6A, mode, is_extended)
+            arbitration_id, data = self.servo_protocol.create_write_for_servo(servo_id, 0x6A, mode, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.servo_client.note_identity_write(servo_id, 0x6A, mode)
                 mode_str = "Extended" if mode == 1 else "Standard"
                 self.results_text.insert(tk.END, f"Set CAN mode to {mode_str} for servo {servo_id}\n")
                 self.results_text.see(tk.END)
@@ -799,8 +816,9 @@ Troubleshooting:
             is_extended = self.extended_id_var.get()
             
             # Send CAN message to set servo node ID (register 0x32)
-            arbitration_id, data = self.servo_protocol.create_write_message(servo_id, 0x32, new_node_id, is_extended)
+            arbitration_id, data = self.servo_protocol.create_write_for_servo(servo_id, 0x32, new_node_id, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.servo_client.note_identity_write(servo_id, 0x32, new_node_id)
                 self.results_text.insert(tk.END, f"Set servo node ID to {new_node_id} for servo {servo_id}\n")
                 self.results_text.see(tk.END)
                 self.status_label.config(text=f"Servo node ID set to {new_node_id}")
@@ -820,7 +838,7 @@ Troubleshooting:
             is_extended = self.extended_id_var.get()
             
             # Send CAN message to set position (register 0x0C)
-            arbitration_id, data = self.servo_protocol.create_write_message(servo_id, 0x1E, position, is_extended)
+            arbitration_id, data = self.servo_protocol.create_write_for_servo(servo_id, 0x1E, position, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
                 self.results_text.insert(tk.END, f"Set position to {position} for servo {servo_id}\n")
                 self.results_text.see(tk.END)
@@ -855,7 +873,7 @@ Troubleshooting:
                 return
             
             # Send CAN message to read register
-            arbitration_id, data = self.servo_protocol.create_read_message(servo_id, register_addr, is_extended)
+            arbitration_id, data = self.servo_protocol.create_read_for_servo(servo_id, register_addr, is_extended)
             if self.can_interface.send_message(arbitration_id, data, is_extended):
                 self.results_text.insert(tk.END, f"📤 Reading register 0x{register_addr:02X} from servo {servo_id}...\n")
                 self.results_text.see(tk.END)
@@ -880,8 +898,15 @@ Troubleshooting:
                 servo_id = msg.data[1]
                 register = msg.data[2]
                 
-                # Handle single register response (0x76)
-                if command == 0x76 and len(msg.data) >= 5:
+                # Handle single register response (0x76) and old format response (0x69)
+                if command == 0x69:
+                    parsed = self.servo_protocol.parse_response_message(msg.data)
+                    if parsed:
+                        reg_name = self.get_register_name(register)
+                        self.results_text.insert(tk.END, f"✅ Servo {servo_id} register 0x{register:02X} ({reg_name}) = {parsed['value']} (old format)\n")
+                        self.results_text.see(tk.END)
+                    
+                elif command == 0x76 and len(msg.data) >= 5:
                     value = msg.data[3] | (msg.data[4] << 8)  # Little endian
                     reg_name = self.get_register_name(register)
                     
@@ -936,29 +961,31 @@ Troubleshooting:
         """Save servo configuration and reset"""
         try:
             servo_id = int(self.target_servo_var.get())
-            is_extended = self.extended_id_var.get()
+            self.servo_client.is_extended = self.extended_id_var.get()
             
-            # Send save configuration command
-            arbitration_id, data = self.servo_protocol.create_save_reset_message(servo_id, is_extended)
-            if self.can_interface.send_message(arbitration_id, data, is_extended):
-                self.results_text.insert(tk.END, f"Saving configuration for servo {servo_id}\n")
-                self.results_text.see(tk.END)
-                self.status_label.config(text="Configuration saved")
-                
-                # Optional: Send reset command after save
-                time.sleep(0.1)  # Brief delay
-                arbitration_id, data = self.servo_protocol.create_save_reset_message(servo_id, is_extended)
-                if self.can_interface.send_message(arbitration_id, data, is_extended):
-                    self.results_text.insert(tk.END, f"Reset command sent to servo {servo_id}\n")
-                    self.results_text.see(tk.END)
-            else:
-                self.results_text.insert(tk.END, f"Failed to save configuration\n")
-                self.results_text.see(tk.END)
+            # A single SAVE_RESET frame both saves and resets the servo; wait for it in the
+            # background until it answers under its new identity instead of a fixed delay
+            self.status_label.config(text=f"Saving servo {servo_id}, waiting for reset...")
+            threading.Thread(target=self.save_and_reset_worker, args=(servo_id,), daemon=True).start()
                 
         except Exception as e:
             self.logger.error(f"Error saving and resetting servo: {e}")
             messagebox.showerror("Error", f"Failed to save and reset servo: {e}")
     
+    def save_and_reset_worker(self, servo_id: int):
+        """Send save & reset and report once the servo is back"""
+        try:
+            result = self.servo_client.save_reset_and_wait(servo_id)
+            self.root.after(0, lambda: self.show_readiness_result(result))
+        except Exception as e:
+            self.logger.error(f"Error saving and resetting servo: {e}")
+    
+    def show_readiness_result(self, result):
+        """Show the outcome of a save & reset"""
+        self.results_text.insert(tk.END, f"Save and reset: {result.message}\n")
+        self.results_text.see(tk.END)
+        self.status_label.config(text="Configuration saved" if result.ready else "Servo did not come back")
+    
     # Message Monitoring Methods
     def toggle_monitoring(self):
         """Toggle message monitoring"""
@@ -995,6 +1022,45 @@ Troubleshooting:
             self.logger.error(f"Error saving message log: {e}")
             messagebox.showerror("Error", f"Failed to save message log: {e}")
     
+    def toggle_capture(self):
+        """Start or stop recording all CAN traffic to a binary capture file"""
+        try:
+            recorder = self.capture_recorder
+            if recorder:
+                self.capture_recorder = None
+                recorder.detach()
+                recorder.stop()
+                stats = recorder.get_stats()
+                self.capture_btn.config(text="Record Capture")
+                self.status_label.config(text=f"Capture saved: {stats['records_written']} frames, {stats['dropped']} dropped")
+                return
+            
+            from tkinter import filedialog
+            filename = filedialog.asksaveasfilename(
+                defaultextension=CAPTURE_EXTENSION,
+                filetypes=[("CAN captures", f"*{CAPTURE_EXTENSION}"),
+                           ("Compressed CAN captures", f"*{COMPRESSED_CAPTURE_EXTENSION}"), ("All files", "*.*")]
+            )
+            if not filename:
+                return
+            
+            index_builder = CaptureIndexBuilder.for_capture(filename)
+            if filename.endswith(COMPRESSED_CAPTURE_EXTENSION):
+                recorder = CompressedCaptureRecorder(filename, index_builder=index_builder)
+            else:
+                recorder = CaptureRecorder(filename, index_builder=index_builder)
+            if not recorder.start():
+                messagebox.showerror("Error", f"Could not create capture file {filename}")
+                return
+            recorder.attach(self.can_interface)
+            self.capture_recorder = recorder
+            self.capture_btn.config(text="Stop Capture")
+            self.status_label.config(text=f"Recording capture to {filename}")
+            
+        except Exception as e:
+            self.logger.error(f"Error toggling capture: {e}")
+            messagebox.showerror("Error", f"Failed to toggle capture: {e}")
+    
     # Configuration Methods
     def save_configuration(self):
         """Save current configuration to file"""
@@ -1140,6 +1206,17 @@ Troubleshooting:
                         return f"Response {reg_name} (0x{register:02X}) from servo {servo_id}"
                 elif command == 0x56:  # Dual register response
                     return f"Dual register response from servo {servo_id}"
+                elif command in (0x96, 0x69):  # Old format packet
+                    frame = decode_frame(data)
+                    if frame is None:
+                        return f"Old format packet with bad checksum (servo {servo_id})"
+                    reg_name = self.get_register_name(register)
+                    if frame['type'] == 'legacy_read':
+                        return f"Old format read {reg_name} (0x{register:02X}) from servo {servo_id}"
+                    elif frame['type'] == 'legacy_write':
+                        return f"Old format write {reg_name} (0x{register:02X}) = {frame['value']} to servo {servo_id}"
+                    else:
+                        return f"Old format response {reg_name} (0x{register:02X}) = {frame['value']} from servo {servo_id}"
                 else:
                     return f"Command 0x{command:02X} to servo {servo_id}, register 0x{register:02X}"
             
@@ -1165,13 +1242,19 @@ Troubleshooting:
         }
         return register_names.get(register, f"REG_0x{register:02X}")
     
+    def format_can_message(self, msg):
+        """Format a CAN message as (timestamp, ID, data, description) for the message tree"""
+        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        msg_id_str = f"0x{msg.arbitration_id:03X}"
+        data_str = ' '.join([f"{b:02X}" for b in msg.data])
+        description = self.decode_message_description(msg.arbitration_id, msg.data)
+        return timestamp, msg_id_str, data_str, description
+    
     def on_can_message_received(self, msg):
         """Handle received CAN message with description"""
         try:
-            timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-            msg_id_str = f"0x{msg.arbitration_id:03X}"
-            data_str = ' '.join([f"{b:02X}" for b in msg.data])
-            description = self.decode_message_description(msg.arbitration_id, msg.data)
+            self.servo_protocol.observe_frame(msg.data)
+            timestamp, msg_id_str, data_str, description = self.format_can_message(msg)
             
             # Update message count
             self.message_count += 1
@@ -1242,8 +1325,13 @@ Troubleshooting:
         """Handle application closing"""
         try:
             self.save_config()
+            if self.capture_recorder:
+                self.capture_recorder.detach()
+                self.capture_recorder.stop()
             if self.connected:
                 self.disconnect_can()
+            if self.metrics_exporter:
+                self.metrics_exporter.stop()
             self.root.destroy()
         except Exception as e:
             self.logger.error(f"Error during shutdown: {e}")
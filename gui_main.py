@@ -8,12 +8,17 @@ import threading
 import time
 import json
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime
 
 from can_interface import CANInterface, CANMessage
 from servo_protocol import ServoProtocol, MessageType
 from config_manager import ConfigManager
+from servo_client import ServoClient, ReadinessResult
+from metrics import MetricsExporter, start_exporter
+from capture import CaptureRecorder, CAPTURE_EXTENSION
+from capture_index import CaptureIndexBuilder
+from compressed_capture import CompressedCaptureRecorder, COMPRESSED_CAPTURE_EXTENSION
 from utils import format_hex_bytes, parse_hex_input, validate_numeric_input
 
 class ServoControlGUI:
@@ -26,16 +31,23 @@ class ServoControlGUI:
         # Initialize components
         self.can_interface = CANInterface()
         self.servo_protocol = ServoProtocol()
+        self.servo_client = ServoClient(self.can_interface, self.servo_protocol)
         self.config_manager = ConfigManager()
         
         # GUI state
         self.is_monitoring = False
         self.monitor_thread: Optional[threading.Thread] = None
         self.message_count = 0
+        self.capture_recorder: Optional[Union[CaptureRecorder, CompressedCaptureRecorder]] = None
         
         # Load configuration
         self.config = self.config_manager.load_config()
         
+        # Prometheus exporter for unattended benches, off unless a port is configured
+        self.metrics_exporter: Optional[MetricsExporter] = None
+        if self.config.get('metrics_port'):
+            self.metrics_exporter = start_exporter(self.config['metrics_port'], self.can_interface, self.servo_client)
+        
         # Setup GUI
         self.setup_gui()
         self.setup_message_callback()
@@ -262,6 +274,10 @@ Requirements:
         ttk.Button(controls_frame, text="Save Log", 
                   command=self.save_message_log).pack(side=tk.LEFT, padx=(0, 10))
         
+        self.capture_btn = ttk.Button(controls_frame, text="Record Capture", 
+                                     command=self.toggle_capture)
+        self.capture_btn.pack(side=tk.LEFT, padx=(0, 10))
+        
         # Message count
         self.message_count_var = tk.StringVar(value="Messages: 0")
         ttk.Label(controls_frame, textvariable=self.message_count_var).pack(side=tk.RIGHT)
@@ -503,7 +519,9 @@ Requirements:
                 if not self.can_interface.send_message(arbitration_id, data, is_extended):
                     messagebox.showerror("Error", "Failed to send CAN ID programming message")
                     return
-                time.sleep(0.1)  # Small delay between messages
+            
+            # Takes effect after save & reset, which then waits for the servo under this identity
+            self.servo_client.note_identity_write(servo_id, 0x3E, new_can_id & 0xFFFF)
             
             self.status_var.set(f"CAN ID set to {new_can_id} for servo {servo_id}")
             self.add_result(f"Set CAN ID: Servo {servo_id} -> CAN ID {new_can_id}")
@@ -538,7 +556,9 @@ Requirements:
                 if not self.can_interface.send_message(arbitration_id, data, is_extended):
                     messagebox.showerror("Error", "Failed to send CAN ID programming message")
                     return
-                time.sleep(0.1)  # Small delay between messages
+            
+            # Takes effect after save & reset, which then waits for the servo under this identity
+            self.servo_client.note_identity_write(servo_id, 0x3C, new_can_id & 0xFFFF)
             
             self.status_var.set(f"CAN ID set to {new_can_id} for servo {servo_id}")
             self.add_result(f"Set CAN ID: Servo {servo_id} -> CAN ID {new_can_id}")
@@ -572,7 +592,9 @@ Requirements:
                 if not self.can_interface.send_message(arbitration_id, data, is_extended):
                     messagebox.showerror("Error", "Failed to send CAN ID programming message")
                     return
-                time.sleep(0.1)  # Small delay between messages
+            
+            # Takes effect after save & reset, which then waits for the servo under this identity
+            self.servo_client.note_identity_write(servo_id, 0x32, new_servo_id)
             
             self.status_var.set(f"SERVO ID set to {new_servo_id} for servo {servo_id}")
             self.add_result(f"Set SERVO ID: Servo {servo_id} -> CAN ID {new_servo_id}")
@@ -597,6 +619,7 @@ Requirements:
             arbitration_id, data = self.servo_protocol.create_set_can_mode_message(servo_id, mode, is_extended)
             
             if self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.servo_client.note_identity_write(servo_id, 0x6A, mode)
                 self.status_var.set(f"CAN mode set to {mode} for servo {servo_id}")
                 self.add_result(f"Set CAN Mode: Servo {servo_id} -> Mode {mode}")
             else:
@@ -650,7 +673,7 @@ Requirements:
                 messagebox.showerror("Error", "CAN interface not connected")
                 return
             
-            arbitration_id, data = self.servo_protocol.create_read_message(servo_id, address, is_extended)
+            arbitration_id, data = self.servo_protocol.create_read_for_servo(servo_id, address, is_extended)
             
             if self.can_interface.send_message(arbitration_id, data, is_extended):
                 reg_info = self.servo_protocol.get_register_info(address)
@@ -704,13 +727,11 @@ Requirements:
             if not messagebox.askyesno("Confirm", f"Save and reset servo {servo_id}?"):
                 return
             
-            arbitration_id, data = self.servo_protocol.create_save_reset_message(servo_id, is_extended)
+            self.servo_client.is_extended = is_extended
+            self.status_var.set(f"Saving and resetting servo {servo_id}, waiting for it to come back...")
             
-            if self.can_interface.send_message(arbitration_id, data, is_extended):
-                self.status_var.set(f"Save and reset command sent to servo {servo_id}")
-                self.add_result(f"Save & Reset: Servo {servo_id}")
-            else:
-                messagebox.showerror("Error", "Failed to send save and reset command")
+            # Probe in the background so the GUI stays responsive while the servo reboots
+            threading.Thread(target=self.save_and_reset_worker, args=(servo_id,), daemon=True).start()
                 
         except ValueError:
             messagebox.showerror("Error", "Invalid servo ID")
@@ -718,6 +739,22 @@ Requirements:
             self.logger.error(f"Error saving and resetting: {e}")
             messagebox.showerror("Error", f"Failed to save and reset:\n{e}")
     
+    def save_and_reset_worker(self, servo_id: int):
+        """Send save & reset and wait until the servo answers again"""
+        try:
+            result = self.servo_client.save_reset_and_wait(servo_id)
+        except Exception as e:
+            self.logger.error(f"Error saving and resetting: {e}")
+            result = ReadinessResult(servo_id=servo_id, ready=False, message=str(e))
+        self.root.after(0, self.show_readiness_result, result)
+    
+    def show_readiness_result(self, result: ReadinessResult):
+        """Report the outcome of a save & reset"""
+        self.status_var.set(result.message)
+        self.add_result(f"Save & Reset: {result.message}")
+        if not result.ready:
+            messagebox.showwarning("Save & Reset", result.message)
+    
     def toggle_monitoring(self):
         """Toggle CAN message monitoring"""
         if self.is_monitoring:
@@ -760,33 +797,45 @@ Requirements:
     def on_can_message_received(self, message: CANMessage):
         """Callback for received CAN messages"""
         # This runs in the CAN receive thread, so we need to use after()
+        self.servo_protocol.observe_frame(message.data)
         self.root.after(0, self.display_can_message, message)
     
+    def format_can_message(self, message: CANMessage) -> Tuple[tuple, Optional[Dict]]:
+        """
+        Format a CAN message for the monitor
+        
+        Returns:
+            Tuple of (monitor row values, parsed response or None)
+        """
+        timestamp = datetime.fromtimestamp(message.timestamp).strftime('%H:%M:%S.%f')[:-3]
+        can_id = f"0x{message.arbitration_id:X}"
+        if message.is_extended_id:
+            can_id += " (Ext)"
+        
+        data_hex = format_hex_bytes(message.data)
+        
+        # Try to parse servo protocol message
+        description = "Unknown"
+        parsed = self.servo_protocol.parse_response_message(message.data)
+        if parsed:
+            if parsed['type'] in ('single_response', 'legacy_response'):
+                description = f"Response: {parsed['register_name']} = {parsed['value']} (Servo {parsed['servo_id']})"
+            elif parsed['type'] == 'dual_response':
+                description = f"Response: {parsed['register_name_a']} = {parsed['value_a']}, {parsed['register_name_b']} = {parsed['value_b']} (Servo {parsed['servo_id']})"
+        
+        return (timestamp, can_id, data_hex, description), parsed
+    
     def display_can_message(self, message: CANMessage):
         """Display CAN message in the monitor"""
         try:
             self.message_count += 1
             self.message_count_var.set(f"Messages: {self.message_count}")
             
-            # Format message data
-            timestamp = datetime.fromtimestamp(message.timestamp).strftime('%H:%M:%S.%f')[:-3]
-            can_id = f"0x{message.arbitration_id:X}"
-            if message.is_extended_id:
-                can_id += " (Ext)"
-            
-            data_hex = format_hex_bytes(message.data)
-            
-            # Try to parse servo protocol message
-            description = "Unknown"
-            parsed = self.servo_protocol.parse_response_message(message.data)
-            if parsed:
-                if parsed['type'] == 'single_response':
-                    description = f"Response: {parsed['register_name']} = {parsed['value']} (Servo {parsed['servo_id']})"
-                elif parsed['type'] == 'dual_response':
-                    description = f"Response: {parsed['register_name_a']} = {parsed['value_a']}, {parsed['register_name_b']} = {parsed['value_b']} (Servo {parsed['servo_id']})"
+            values, parsed = self.format_can_message(message)
+            description = values[3]
             
             # Insert into tree
-            self.message_tree.insert('', 0, values=(timestamp, can_id, data_hex, description))
+            self.message_tree.insert('', 0, values=values)
             
             # Limit number of displayed messages
             children = self.message_tree.get_children()
@@ -809,14 +858,27 @@ Requirements:
     
     def reset_can_connection(self):
         """Attempt to reset the CAN interface if it's in a heavy bus error state"""
+        self.status_var.set("Resetting CAN connection...")
+        threading.Thread(target=self.reset_can_worker, daemon=True).start()
+    
+    def reset_can_worker(self):
+        """Reopen the bus as soon as the adapter accepts it"""
         try:
-            self.disconnect_can()
-            time.sleep(1)
-            self.connect_can()
-            self.status_var.set("CAN bus reconnected after warning")
+            reconnected = self.can_interface.reconnect()
+            error = None
         except Exception as e:
             self.logger.error(f"Failed to reset CAN connection: {e}")
-            messagebox.showerror("CAN Reset Failed", f"Could not recover CAN connection:\n{e}")
+            reconnected, error = False, e
+        self.root.after(0, self.finish_can_reset, reconnected, error)
+    
+    def finish_can_reset(self, reconnected: bool, error: Optional[Exception] = None):
+        """Update connection state after a reset attempt"""
+        if reconnected:
+            self.status_var.set("CAN bus reconnected after warning")
+            self.update_connection_info()
+        else:
+            self.disconnect_can()
+            messagebox.showerror("CAN Reset Failed", f"Could not recover CAN connection:\n{error or 'Adapter did not come back'}")
 
 
     def send_custom_message(self):
@@ -881,6 +943,45 @@ Requirements:
             self.logger.error(f"Error saving message log: {e}")
             messagebox.showerror("Error", f"Failed to save log:\n{e}")
     
+    def toggle_capture(self):
+        """Start or stop recording all CAN traffic to a binary capture file"""
+        try:
+            if self.capture_recorder:
+                recorder = self.capture_recorder
+                self.capture_recorder = None
+                recorder.detach()
+                recorder.stop()
+                stats = recorder.get_stats()
+                self.capture_btn.config(text="Record Capture")
+                self.status_var.set(f"Capture saved to {stats['filename']}: {stats['records_written']} frames, "
+                                    f"{stats['dropped']} dropped")
+                return
+            
+            filename = filedialog.asksaveasfilename(
+                defaultextension=CAPTURE_EXTENSION,
+                filetypes=[("CAN captures", f"*{CAPTURE_EXTENSION}"),
+                           ("Compressed CAN captures", f"*{COMPRESSED_CAPTURE_EXTENSION}"), ("All files", "*.*")]
+            )
+            if not filename:
+                return
+            
+            index_builder = CaptureIndexBuilder.for_capture(filename)
+            if filename.endswith(COMPRESSED_CAPTURE_EXTENSION):
+                recorder = CompressedCaptureRecorder(filename, index_builder=index_builder)
+            else:
+                recorder = CaptureRecorder(filename, index_builder=index_builder)
+            if not recorder.start():
+                messagebox.showerror("Error", f"Could not create capture file {filename}")
+                return
+            recorder.attach(self.can_interface)
+            self.capture_recorder = recorder
+            self.capture_btn.config(text="Stop Capture")
+            self.status_var.set(f"Recording capture to {filename}")
+            
+        except Exception as e:
+            self.logger.error(f"Error toggling capture: {e}")
+            messagebox.showerror("Error", f"Failed to toggle capture:\n{e}")
+    
     def add_result(self, text: str):
         """Add result to results display"""
         timestamp = datetime.now().strftime('%H:%M:%S')
@@ -986,6 +1087,12 @@ Requirements:
             if self.is_monitoring:
                 self.stop_monitoring()
             
+            # Finish any capture in progress
+            if self.capture_recorder:
+                self.capture_recorder.detach()
+                self.capture_recorder.stop()
+                self.capture_recorder = None
+            
             # Disconnect CAN
             if self.can_interface.is_connected:
                 self.disconnect_can()
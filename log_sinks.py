@@ -0,0 +1,254 @@
+"""
+Trace log sinks for CAN traffic
+Writes frames to python-can log formats (BLF, ASC, CSV, TRC, ...) from a background thread
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from queue import Queue, Empty, Full
+from typing import Any, Dict, Optional, Tuple
+
+import can
+
+from can_interface import CANMessage
+
+class LogSink:
+    """
+    Writes every frame seen by a CANInterface to a python-can log file
+
+    The file format follows the filename suffix, as with can.Logger (e.g.
+    .blf, .asc, .csv, .trc, optionally with .gz). Callbacks only put frames
+    on a bounded queue; a dedicated writer thread does all formatting and disk
+    I/O. When the queue is full, new frames are dropped and counted.
+
+    With max_bytes or max_seconds set, the log is rotated into numbered files
+    named <stem>_<start time>_<index><suffix>.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, max_seconds: float = 0.0,
+                 queue_size: int = 10000, include_tx: bool = True, channel: Optional[str] = None):
+        """
+        Initialize log sink
+
+        Args:
+            filename: Log file; its suffix selects the format
+            max_bytes: Rotate once the current file reaches this size, 0 to disable
+            max_seconds: Rotate once the current file is this old, 0 to disable
+            queue_size: Maximum frames waiting for the writer
+            include_tx: Also log frames sent by this tool
+            channel: Channel name stored with each frame
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.include_tx = include_tx
+        self.channel = channel
+
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rotations = 0
+        self.max_queue_depth = 0
+
+        self.writer: Optional[can.io.MessageWriter] = None
+        self.current_file: Optional[str] = None
+        self.file_opened_at = 0.0
+        self.writer_thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.is_running = False
+
+        stem, suffix = self._split_suffix(filename)
+        self._stem = stem
+        self._suffix = suffix
+
+    @staticmethod
+    def _split_suffix(filename: str) -> Tuple[str, str]:
+        """Split 'trace.asc.gz' into ('trace', '.asc.gz')"""
+        root, suffix = os.path.splitext(filename)
+        if suffix.lower() == '.gz':
+            root, inner = os.path.splitext(root)
+            suffix = inner + suffix
+        return root, suffix
+
+    @property
+    def rotating(self) -> bool:
+        return self.max_bytes > 0 or self.max_seconds > 0
+
+    def start(self) -> bool:
+        """
+        Open the log file and start the writer thread
+
+        Returns:
+            True if the sink started, False otherwise
+        """
+        if self.is_running:
+            return True
+        try:
+            self._open_writer()
+        except Exception as e:
+            self.logger.error(f"Failed to open log sink {self.filename}: {e}")
+            return False
+
+        self.stop_event.clear()
+        self.is_running = True
+        self.writer_thread = threading.Thread(target=self._writer_worker, name=f"log-sink-{os.path.basename(self.filename)}",
+                                              daemon=True)
+        self.writer_thread.start()
+        self.logger.info(f"Logging CAN traffic to {self.current_file}")
+        return True
+
+    def stop(self):
+        """Write remaining frames and close the log file"""
+        if not self.is_running:
+            return
+        self.is_running = False
+        self.stop_event.set()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=5.0)
+            self.writer_thread = None
+        self._close_writer()
+        self.logger.info(f"Log sink {self.filename} closed: {self.written} frames, {self.dropped} dropped")
+
+    def on_receive(self, msg: CANMessage):
+        """CANInterface callback for received and error frames"""
+        self.put(msg, is_tx=False)
+
+    def on_transmit(self, msg: CANMessage):
+        """CANInterface callback for sent frames"""
+        if self.include_tx:
+            self.put(msg, is_tx=True)
+
+    def put(self, msg: CANMessage, is_tx: bool = False) -> bool:
+        """
+        Queue a frame for the writer without blocking
+
+        Returns:
+            True if queued, False if dropped
+        """
+        if not self.is_running:
+            return False
+        try:
+            self.queue.put_nowait((msg, is_tx))
+        except Full:
+            self.dropped += 1
+            return False
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get sink statistics"""
+        return {
+            'filename': self.filename,
+            'current_file': self.current_file,
+            'running': self.is_running,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'rotations': self.rotations,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'queue_size': self.queue.maxsize
+        }
+
+    def _next_filename(self) -> str:
+        """Name of the next file to write"""
+        if not self.rotating:
+            return self.filename
+        started = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return f"{self._stem}_{started}_{self.rotations:03d}{self._suffix}"
+
+    def _open_writer(self):
+        """Open a python-can writer for the next file"""
+        self.current_file = self._next_filename()
+        self.writer = can.Logger(self.current_file)
+        self.file_opened_at = time.monotonic()
+
+    def _close_writer(self):
+        """Flush and close the current writer"""
+        if self.writer is not None:
+            try:
+                self.writer.stop()
+            except Exception as e:
+                self.logger.error(f"Error closing log file {self.current_file}: {e}")
+            self.writer = None
+
+    def _current_size(self) -> int:
+        """Bytes written to the current file so far"""
+        try:
+            return self.writer.file_size()
+        except Exception:
+            return os.path.getsize(self.current_file) if os.path.exists(self.current_file) else 0
+
+    def _rotate_if_needed(self, check_size: bool = True) -> bool:
+        """
+        Start a new file once the size or age limit is reached
+
+        Returns:
+            False if the next file could not be opened; the sink is stopped then
+        """
+        if not self.rotating or self.writer is None:
+            return True
+        too_old = self.max_seconds > 0 and time.monotonic() - self.file_opened_at >= self.max_seconds
+        too_big = check_size and self.max_bytes > 0 and self._current_size() >= self.max_bytes
+        if too_old or too_big:
+            self._close_writer()
+            self.rotations += 1
+            try:
+                self._open_writer()
+            except Exception as e:
+                self._fail(f"Could not open next log file {self.current_file}: {e}")
+                return False
+            self.logger.info(f"Log sink rotated to {self.current_file}")
+        return True
+
+    def _fail(self, message: str):
+        """Stop accepting frames after an unrecoverable error; queued frames count as dropped"""
+        self.errors += 1
+        self.is_running = False
+        self.writer = None
+        self.logger.error(f"{message}; log sink stopped")
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+            self.dropped += 1
+
+    def _to_can_message(self, msg: CANMessage, is_tx: bool) -> can.Message:
+        """Convert a CANInterface message to the python-can type the writers take"""
+        return can.Message(
+            timestamp=msg.timestamp or time.time(),
+            arbitration_id=msg.arbitration_id,
+            is_extended_id=msg.is_extended_id,
+            is_error_frame=msg.is_error_frame,
+            is_rx=not is_tx,
+            data=bytes(msg.data),
+            channel=self.channel
+        )
+
+    def _writer_worker(self):
+        """Drain the queue into the log file"""
+        while True:
+            try:
+                msg, is_tx = self.queue.get(timeout=0.2)
+            except Empty:
+                if self.stop_event.is_set() or not self._rotate_if_needed():
+                    break
+                continue
+
+            try:
+                self.writer.on_message_received(self._to_can_message(msg, is_tx))
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                self.logger.error(f"Error writing to log file {self.current_file}: {e}")
+            # Checking the file size may hit the disk, so only do it every few frames
+            if not self._rotate_if_needed(check_size=self.written % 256 == 0):
+                break
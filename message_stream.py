@@ -0,0 +1,666 @@
+"""
+Live message streaming for the web interface
+Fans received CAN messages out to Server-Sent Events clients in small batches, filtered or aggregated per client
+"""
+
+import asyncio
+import base64
+import itertools
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Iterator, List, Mapping, Optional, Tuple
+
+from telemetry import TelemetryStore, encode_telemetry, touches_series
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class MessageFilter:
+    """
+    Which messages a client wants
+
+    Each criterion is a set of accepted values; an empty set accepts
+    everything. Servo ID, opcode and register criteria only match frames
+    that decode as servo protocol frames.
+    """
+    arb_ids: FrozenSet[int] = frozenset()
+    servo_ids: FrozenSet[int] = frozenset()
+    opcodes: FrozenSet[int] = frozenset()
+    registers: FrozenSet[int] = frozenset()
+
+    # Query parameter for each criterion
+    QUERY_KEYS = {'id': 'arb_ids', 'servo': 'servo_ids', 'opcode': 'opcodes', 'register': 'registers'}
+
+    def __bool__(self) -> bool:
+        return bool(self.arb_ids or self.servo_ids or self.opcodes or self.registers)
+
+    def matches(self, message: Dict[str, Any]) -> bool:
+        """Check whether a formatted message passes every criterion"""
+        if self.arb_ids and message.get('arb_id') not in self.arb_ids:
+            return False
+        if self.servo_ids and message.get('servo_id') not in self.servo_ids:
+            return False
+        if self.opcodes and message.get('opcode') not in self.opcodes:
+            return False
+        if self.registers and self.registers.isdisjoint(message.get('registers', ())):
+            return False
+        return True
+
+    @classmethod
+    def from_query(cls, query: Mapping[str, List[str]]) -> 'MessageFilter':
+        """
+        Build a filter from query parameters
+
+        Args:
+            query: Parameter name -> values, e.g. {'id': ['0x100,0x101'], 'servo': ['1']};
+                   values may be repeated or comma-separated, hex with 0x or decimal
+
+        Returns:
+            MessageFilter
+
+        Raises:
+            ValueError: If a value is not a number
+        """
+        criteria = {}
+        for key, field_name in cls.QUERY_KEYS.items():
+            values = set()
+            for value in query.get(key, []):
+                for part in value.split(','):
+                    part = part.strip()
+                    if part:
+                        try:
+                            values.add(int(part, 0))
+                        except ValueError:
+                            raise ValueError(f"Invalid {key} '{part}'")
+            criteria[field_name] = frozenset(values)
+        return cls(**criteria)
+
+def encode_columns(messages: List[Dict[str, Any]], extra: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """
+    Encode formatted messages as parallel arrays
+
+    Instead of one object per message with preformatted strings, each field
+    is one array of raw values: 't' holds microseconds after 'epoch' (the
+    first message's receive time in seconds) and 'data' the base64 of all
+    payloads back to back, split by 'length'. Clients format IDs, bytes and
+    times themselves.
+
+    Args:
+        messages: Formatted messages (see web_app.format_message)
+        extra: Further fields to include as columns, e.g. ('count', 'cycle_ms')
+
+    Returns:
+        Dictionary with 'epoch', 'count' and 'columns'
+    """
+    epoch = messages[0].get('time', 0.0) if messages else 0.0
+    columns = {
+        'seq': [message.get('seq') for message in messages],
+        't': [round((message.get('time', epoch) - epoch) * 1e6) for message in messages],
+        'arb_id': [message.get('arb_id') for message in messages],
+        'length': [message['length'] for message in messages],
+        'data': base64.b64encode(b''.join(bytes.fromhex(message['data']) for message in messages)).decode('ascii')
+    }
+    for name in extra:
+        columns[name] = [message.get(name) for message in messages]
+    return {'epoch': epoch, 'count': len(messages), 'columns': columns}
+
+def gzip_events(events: Iterator[str]) -> Iterator[bytes]:
+    """
+    Compress an event stream for a client that accepts gzip
+
+    One compressor spans the whole stream, so field names and IDs repeated
+    between events cost almost nothing, and every event is flushed so the
+    browser receives it at once.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        for event in events:
+            yield compressor.compress(event.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    finally:
+        events.close()
+
+async def gzip_events_async(events: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """gzip_events for an async event stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        async for event in events:
+            yield compressor.compress(event.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    finally:
+        await events.aclose()
+
+# Trace table fields sent as extra columns
+TRACE_COLUMNS = ('row', 'count', 'cycle_ms')
+
+def trace_row(message: Dict[str, Any]) -> str:
+    """
+    Trace table row a formatted message belongs to
+
+    Servo frames share arbitration IDs (every servo answers on the same
+    one), so they get a row per servo, opcode and register(s). Every
+    message of a row then matches the same filters.
+    """
+    row = f"{message.get('arb_id') or 0:X}"
+    if 'servo_id' in message:
+        registers = '+'.join(f"{address:02X}" for address in message.get('registers', ()))
+        row += f"/{message['servo_id']}/{message.get('opcode') or 0:02X}/{registers}"
+    return row
+
+class TraceTable:
+    """
+    Latest frame, receive count and cycle time per arbitration ID
+
+    The equivalent of a receive list: however fast the bus, a client only
+    gets the rows that changed since its previous update. Servo frames are
+    split further by servo, opcode and register (see trace_row), so a
+    filtered client sees counts and cycle times of the frames it asked for
+    only. Every update replaces the entry with a new dictionary, so entries
+    handed out are never modified afterwards.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+
+    def update(self, message: Dict[str, Any]):
+        """Record a formatted message (caller holds the broadcaster lock)"""
+        self.version += 1
+        row = trace_row(message)
+        previous = self.entries.get(row)
+        entry = dict(message, row=row, count=1, cycle_ms=None, version=self.version)
+        if previous is not None:
+            entry['count'] = previous['count'] + 1
+            if 'time' in message and 'time' in previous:
+                entry['cycle_ms'] = round((message['time'] - previous['time']) * 1000.0, 3)
+        self.entries[row] = entry
+
+    def changes(self, since_version: int, message_filter: Optional[MessageFilter] = None) -> List[Dict[str, Any]]:
+        """Entries updated after since_version that pass the filter, by arbitration ID and row"""
+        return sorted((entry for entry in self.entries.values()
+                       if entry['version'] > since_version and (not message_filter or message_filter.matches(entry))),
+                      key=lambda entry: (entry.get('arb_id') or 0, entry['row']))
+
+    def clear(self):
+        """Forget all rows"""
+        self.entries = {}
+
+class MessageHistory:
+    """
+    Recent messages in a fixed-size ring, numbered by sequence
+
+    Every message gets the next sequence number in a 'seq' field and
+    overwrites the oldest slot, so appending costs the same regardless of
+    depth. Clients fetch with the last sequence number they have as a
+    cursor; if older messages have already been overwritten they are told
+    how many they missed.
+    """
+
+    def __init__(self, depth: int = 1000):
+        """
+        Initialize history
+
+        Args:
+            depth: Number of messages kept
+        """
+        self.depth = max(1, depth)
+        self.slots: List[Optional[Dict[str, Any]]] = [None] * self.depth
+        self.next_seq = 1
+        self.first_seq = 1              # Oldest sequence number not cleared
+        self.lock = threading.Lock()
+
+    def append(self, message: Dict[str, Any]) -> int:
+        """
+        Add a message, setting its 'seq' field
+
+        Returns:
+            Sequence number of the message
+        """
+        with self.lock:
+            seq = self.next_seq
+            message['seq'] = seq
+            self.slots[seq % self.depth] = message
+            self.next_seq = seq + 1
+        return seq
+
+    @property
+    def last_seq(self) -> int:
+        """Sequence number of the newest message, 0 if none yet"""
+        return self.next_seq - 1
+
+    def _oldest(self) -> int:
+        """Oldest sequence number still held (lock must be held)"""
+        return max(self.first_seq, self.next_seq - self.depth)
+
+    def since(self, seq: int, limit: int = 1000) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get messages newer than a cursor, oldest first
+
+        Args:
+            seq: Last sequence number the client has (0 for none)
+            limit: Maximum number of messages
+
+        Returns:
+            Tuple of (messages, number of messages after the cursor that are
+            no longer held)
+        """
+        messages, missed, _ = self.query(seq, limit)
+        return messages, missed
+
+    def query(self, seq: int, limit: int = 1000,
+              message_filter: Optional[MessageFilter] = None) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        Get messages newer than a cursor that pass a filter, oldest first
+
+        Args:
+            seq: Last sequence number the client has (0 for none)
+            limit: Maximum number of messages
+            message_filter: Criteria messages must match, all messages if None
+
+        Returns:
+            Tuple of (messages, number of messages after the cursor that are
+            no longer held, cursor for the next call)
+        """
+        with self.lock:
+            oldest = self._oldest()
+            start = seq + 1
+            missed = max(0, oldest - start) if seq > 0 else 0
+            start = max(start, oldest)
+            if not message_filter:
+                stop = min(self.next_seq, start + max(0, limit))
+                return [self.slots[i % self.depth] for i in range(start, stop)], missed, max(seq, stop - 1)
+
+            messages = []
+            cursor = max(seq, start - 1)
+            for index in range(start, self.next_seq):
+                if len(messages) >= limit:
+                    break
+                message = self.slots[index % self.depth]
+                if message_filter.matches(message):
+                    messages.append(message)
+                cursor = index
+            return messages, missed, cursor
+
+    def latest(self, count: int = 100, message_filter: Optional[MessageFilter] = None) -> List[Dict[str, Any]]:
+        """Get the newest messages that pass a filter, newest first"""
+        with self.lock:
+            oldest = self._oldest()
+            if not message_filter:
+                start = max(oldest, self.next_seq - count)
+                return [self.slots[i % self.depth] for i in range(self.next_seq - 1, start - 1, -1)]
+
+            messages = []
+            for index in range(self.next_seq - 1, oldest - 1, -1):
+                message = self.slots[index % self.depth]
+                if message_filter.matches(message):
+                    messages.append(message)
+                    if len(messages) >= count:
+                        break
+            return messages
+
+    def clear(self):
+        """Forget held messages; sequence numbers keep counting"""
+        with self.lock:
+            self.first_seq = self.next_seq
+            self.slots = [None] * self.depth
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get depth and sequence range"""
+        with self.lock:
+            return {'depth': self.depth, 'first_seq': self._oldest(), 'last_seq': self.next_seq - 1}
+
+class StreamClient:
+    """One connected browser and the messages waiting to be sent to it"""
+
+    def __init__(self, client_id: int, max_pending: int, remote_addr: str = "",
+                 notify: Optional[Callable[[], None]] = None, message_filter: Optional[MessageFilter] = None,
+                 trace: bool = False, columnar: bool = False,
+                 telemetry: Optional[FrozenSet[Tuple[int, int]]] = None):
+        self.client_id = client_id
+        self.remote_addr = remote_addr
+        self.pending: deque = deque(maxlen=max_pending)
+        self.wake_event = threading.Event()
+        self.notify = notify        # Called when wake_event is set, e.g. to wake an event loop
+        self.message_filter = message_filter if message_filter else None
+        self.trace = trace          # Receives trace table updates instead of messages
+        self.trace_version = 0      # Trace table version of the last update sent
+        self.columnar = columnar    # Send batches as parallel arrays (see encode_columns)
+        self.telemetry = telemetry  # (servo_id, address) pairs whose new plot points are sent instead of messages
+        self.telemetry_version = 0  # Telemetry store version of the last update sent
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0            # Messages discarded because the client fell behind
+        self.batches = 0
+        self.last_seq = 0           # Newest sequence number sent
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get delivery counters"""
+        return {
+            'client_id': self.client_id,
+            'remote_addr': self.remote_addr,
+            'connected_for': time.time() - self.connected_at,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'pending': len(self.pending),
+            'filtered': bool(self.message_filter),
+            'trace': self.trace,
+            'columnar': self.columnar,
+            'telemetry': len(self.telemetry) if self.telemetry else 0
+        }
+
+class MessageBroadcaster:
+    """
+    Pushes published messages to every connected stream client
+
+    publish() runs on the CAN receive thread and only appends to each
+    client's bounded queue. Each client's stream generator wakes when
+    messages arrive, waits out the rest of the batch interval and sends
+    everything queued as one event. A client that reads slower than the bus
+    fills its queue; the oldest messages are then discarded and counted in
+    its drop counter, which is reported to the client with every batch, so
+    one slow browser never holds up the receive thread or other clients.
+
+    With a MessageHistory, published messages are also appended to it,
+    batches carry the sequence number of their last message as the event
+    ID, and a browser that reconnects with Last-Event-ID first receives
+    what it missed from the history.
+
+    Clients may subscribe with a MessageFilter, in which case only matching
+    messages are queued for them, or in trace mode, in which case they get
+    the trace table entries that changed since their previous update
+    instead of individual messages. With a TelemetryStore, clients may
+    instead subscribe to registers and get their new plot points.
+    """
+
+    def __init__(self, max_pending: int = 2000, batch_interval: float = 0.05, heartbeat_interval: float = 15.0,
+                 history: Optional[MessageHistory] = None, telemetry: Optional[TelemetryStore] = None):
+        """
+        Initialize broadcaster
+
+        Args:
+            max_pending: Messages queued per client before the oldest are dropped
+            batch_interval: Minimum seconds between batches sent to a client
+            heartbeat_interval: Seconds of silence before a keepalive comment is sent
+            history: History that published messages are appended to, for resuming streams
+            telemetry: Register time series that telemetry clients are sent points from
+        """
+        self.history = history
+        self.telemetry = telemetry
+        self.max_pending = max_pending
+        self.batch_interval = batch_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.clients: Dict[int, StreamClient] = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.dropped = 0            # Drops over all clients, including disconnected ones
+        self.trace = TraceTable()
+
+    def register(self, remote_addr: str = "", resume_from: Optional[int] = None,
+                 notify: Optional[Callable[[], None]] = None, message_filter: Optional[MessageFilter] = None,
+                 trace: bool = False, columnar: bool = False,
+                 telemetry: Optional[FrozenSet[Tuple[int, int]]] = None) -> StreamClient:
+        """
+        Add a client that receives messages published from now on
+
+        Args:
+            remote_addr: Client address, for statistics
+            resume_from: Last sequence number the client received, to replay newer ones from the history
+            notify: Called from the publishing thread when messages become available
+            message_filter: Only deliver messages matching this filter
+            trace: Deliver trace table updates instead of messages
+            columnar: Send batches as parallel arrays
+            telemetry: Deliver new plot points of these (servo_id, address) pairs instead of messages
+        """
+        if telemetry is not None and self.telemetry is None:
+            raise ValueError("Telemetry is not recorded on this stream")
+        client = StreamClient(next(self._ids), self.max_pending, remote_addr, notify, message_filter, trace, columnar,
+                              telemetry)
+        with self.lock:
+            self.clients[client.client_id] = client
+            if telemetry is not None:
+                # The first update is every point kept
+                client.wake_event.set()
+            elif trace:
+                # The first update is the whole table
+                if self.trace.entries:
+                    client.wake_event.set()
+            elif resume_from is not None and self.history is not None:
+                backlog, missed, _ = self.history.query(resume_from, self.max_pending, client.message_filter)
+                client.pending.extend(backlog)
+                client.dropped += missed
+                self.dropped += missed
+                client.last_seq = resume_from
+                if backlog:
+                    client.wake_event.set()
+        logger.info(f"Stream client {client.client_id} connected from {remote_addr or 'unknown'}")
+        return client
+
+    def unregister(self, client: StreamClient):
+        """Remove a client"""
+        with self.lock:
+            self.clients.pop(client.client_id, None)
+        logger.info(f"Stream client {client.client_id} disconnected after {client.sent} messages, "
+                    f"{client.dropped} dropped")
+
+    def publish(self, message: Dict[str, Any]):
+        """
+        Record a message in the history, if any, and queue it for every client
+
+        Args:
+            message: JSON-serializable message
+        """
+        with self.lock:
+            # Under the same lock as register(), so a resuming client gets each message exactly once
+            if self.history is not None:
+                self.history.append(message)
+            self.trace.update(message)
+            self.published += 1
+            for client in self.clients.values():
+                if client.telemetry is not None:
+                    if not client.wake_event.is_set() and touches_series(message, client.telemetry):
+                        client.wake_event.set()
+                        if client.notify is not None:
+                            client.notify()
+                    continue
+                if client.message_filter is not None and not client.message_filter.matches(message):
+                    continue
+                if client.trace:
+                    if not client.wake_event.is_set():
+                        client.wake_event.set()
+                        if client.notify is not None:
+                            client.notify()
+                    continue
+                if len(client.pending) == client.pending.maxlen:
+                    client.dropped += 1
+                    self.dropped += 1
+                client.pending.append(message)
+                if not client.wake_event.is_set():
+                    client.wake_event.set()
+                    if client.notify is not None:
+                        client.notify()
+
+    def _take_batch(self, client: StreamClient) -> List[Dict[str, Any]]:
+        """Remove and return everything queued for a client"""
+        with self.lock:
+            batch = list(client.pending)
+            client.pending.clear()
+            client.wake_event.clear()
+        return batch
+
+    def _next_event(self, client: StreamClient) -> Optional[str]:
+        """Take what is waiting for a client and render it, None if nothing is"""
+        if client.telemetry is not None:
+            return self._next_telemetry(client)
+        if not client.trace:
+            batch = self._take_batch(client)
+            return self._format_batch(client, batch) if batch else None
+
+        with self.lock:
+            entries = self.trace.changes(client.trace_version, client.message_filter)
+            client.trace_version = self.trace.version
+            total = len(self.trace.entries)
+            client.wake_event.clear()
+        if not entries:
+            return None
+        client.sent += len(entries)
+        client.batches += 1
+        if client.columnar:
+            update = {'columns': encode_columns(entries, TRACE_COLUMNS), 'ids': total}
+        else:
+            update = {'trace': entries, 'ids': total}
+        payload = json.dumps(update, separators=(',', ':'))
+        return f"event: trace\ndata: {payload}\n\n"
+
+    def _next_telemetry(self, client: StreamClient) -> Optional[str]:
+        """Render the plot points a telemetry client has not had yet"""
+        with self.lock:
+            client.wake_event.clear()
+        updates, version, pending = self.telemetry.changes(client.telemetry_version, client.telemetry)
+        client.telemetry_version = version
+        if pending:
+            # Come back after the batch interval for the values still in an open bucket
+            client.wake_event.set()
+        if not updates:
+            return None
+        client.sent += sum(len(points) for _, points in updates)
+        client.batches += 1
+        payload = json.dumps(encode_telemetry(updates), separators=(',', ':'))
+        return f"event: telemetry\ndata: {payload}\n\n"
+
+    def get_trace(self, message_filter: Optional[MessageFilter] = None) -> List[Dict[str, Any]]:
+        """Get the trace table, by arbitration ID and row"""
+        with self.lock:
+            return self.trace.changes(0, message_filter)
+
+    def clear_trace(self):
+        """Forget trace table counts and cycle times"""
+        with self.lock:
+            self.trace.clear()
+
+    def stream(self, remote_addr: str = "", batch_interval: Optional[float] = None,
+               resume_from: Optional[int] = None, message_filter: Optional[MessageFilter] = None,
+               trace: bool = False, columnar: bool = False,
+               telemetry: Optional[FrozenSet[Tuple[int, int]]] = None) -> Iterator[str]:
+        """
+        Generate the Server-Sent Events stream for a new client
+
+        Each batch is a 'messages' event whose data is
+        {"messages": [...], "dropped": <total dropped for this client>},
+        or in trace mode a 'trace' event whose data is
+        {"trace": [<changed entries>], "ids": <number of rows in the table>}.
+        With columnar, "messages" and "trace" are replaced by "columns"
+        objects from encode_columns. Telemetry clients get 'telemetry'
+        events with the new points of their registers (see
+        telemetry.encode_telemetry). The client is registered when the stream starts and unregistered when
+        the generator is closed, which the server does when the browser
+        disconnects.
+
+        Args:
+            remote_addr: Client address, for statistics
+            batch_interval: Override of the broadcaster's batch interval
+            resume_from: Last sequence number the client received (from Last-Event-ID)
+            message_filter: Only deliver messages matching this filter
+            trace: Deliver trace table updates instead of messages
+            columnar: Send batches as parallel arrays
+            telemetry: Deliver new plot points of these (servo_id, address) pairs instead of messages
+
+        Yields:
+            Event stream text
+        """
+        interval = self.batch_interval if batch_interval is None else batch_interval
+        last_batch = 0.0
+        client = self.register(remote_addr, resume_from, message_filter=message_filter, trace=trace,
+                               columnar=columnar, telemetry=telemetry)
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                if not client.wake_event.wait(self.heartbeat_interval):
+                    yield ": keepalive\n\n"
+                    continue
+
+                # Let a batch accumulate, but never delay the first message by more than one interval
+                remaining = last_batch + interval - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                last_batch = time.monotonic()
+
+                event = self._next_event(client)
+                if event:
+                    yield event
+        finally:
+            self.unregister(client)
+
+    async def stream_async(self, remote_addr: str = "", batch_interval: Optional[float] = None,
+                           resume_from: Optional[int] = None, message_filter: Optional[MessageFilter] = None,
+                           trace: bool = False, columnar: bool = False,
+                           telemetry: Optional[FrozenSet[Tuple[int, int]]] = None) -> AsyncIterator[str]:
+        """
+        Generate the Server-Sent Events stream for a new client on an event loop
+
+        Same events as stream(), but waiting is done on the running loop, so
+        an idle connection holds no thread. The publishing thread wakes the
+        loop at most once per batch.
+
+        Args:
+            remote_addr: Client address, for statistics
+            batch_interval: Override of the broadcaster's batch interval
+            resume_from: Last sequence number the client received (from Last-Event-ID)
+            message_filter: Only deliver messages matching this filter
+            trace: Deliver trace table updates instead of messages
+            columnar: Send batches as parallel arrays
+            telemetry: Deliver new plot points of these (servo_id, address) pairs instead of messages
+
+        Yields:
+            Event stream text
+        """
+        interval = self.batch_interval if batch_interval is None else batch_interval
+        last_batch = 0.0
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        client = self.register(remote_addr, resume_from, notify=lambda: loop.call_soon_threadsafe(wake.set),
+                               message_filter=message_filter, trace=trace, columnar=columnar, telemetry=telemetry)
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                if not client.wake_event.is_set():
+                    try:
+                        await asyncio.wait_for(wake.wait(), self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                wake.clear()
+
+                remaining = last_batch + interval - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                last_batch = time.monotonic()
+
+                event = self._next_event(client)
+                if event:
+                    yield event
+        finally:
+            self.unregister(client)
+
+    def _format_batch(self, client: StreamClient, batch: List[Dict[str, Any]]) -> str:
+        """Count a batch as sent and render it as a 'messages' event"""
+        client.sent += len(batch)
+        client.batches += 1
+        if client.columnar:
+            payload = json.dumps({'columns': encode_columns(batch), 'dropped': client.dropped}, separators=(',', ':'))
+        else:
+            payload = json.dumps({'messages': batch, 'dropped': client.dropped}, separators=(',', ':'))
+        if 'seq' in batch[-1]:
+            client.last_seq = batch[-1]['seq']
+            return f"id: {client.last_seq}\nevent: messages\ndata: {payload}\n\n"
+        return f"event: messages\ndata: {payload}\n\n"
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Get delivery counters of every connected client"""
+        with self.lock:
+            clients = list(self.clients.values())
+        return [client.get_stats() for client in clients]
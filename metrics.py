@@ -0,0 +1,337 @@
+"""
+Prometheus metrics
+Renders counters, gauges and histograms of the CAN pipeline in the Prometheus text format and serves them over HTTP
+"""
+
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds
+CALLBACK_DURATION_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2, 0.1)
+REQUEST_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Dict[str, str]
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum"""
+
+    def __init__(self, buckets: Sequence[float] = REQUEST_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)     # Last slot counts values above every bound
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Record one value"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[Tuple[float, int]], float, int]:
+        """
+        Get cumulative bucket counts
+
+        Returns:
+            Tuple of ([(upper bound, values <= bound), ...], sum, count); the
+            last bound is infinity
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+def _format_value(value: float) -> str:
+    """Sample value in the text format"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(labels: Optional[Labels]) -> str:
+    """Label set in the text format, empty for none"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels.keys(), escaped)) + '}'
+
+class MetricsWriter:
+    """
+    Builds one exposition in the Prometheus text format
+
+    Samples written under the same name by several collectors, e.g. one
+    per bus session, are grouped into a single metric family.
+    """
+
+    def __init__(self, prefix: str = 'hitec_'):
+        self.prefix = prefix
+        self.families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> Tuple[str, List[str]]:
+        name = self.prefix + name
+        family = self.families.setdefault(name, (kind, help_text, []))
+        return name, family[2]
+
+    @staticmethod
+    def _samples(samples) -> Iterable[Tuple[Optional[Labels], float]]:
+        return samples if isinstance(samples, list) else [(None, samples)]
+
+    def counter(self, name: str, help_text: str, samples: Union[float, List[Tuple[Labels, float]]]):
+        """Add a counter; samples is a value or a list of (labels, value)"""
+        name, lines = self._family(name + '_total', 'counter', help_text)
+        for labels, value in self._samples(samples):
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def gauge(self, name: str, help_text: str, samples: Union[float, List[Tuple[Labels, float]]]):
+        """Add a gauge; samples is a value or a list of (labels, value)"""
+        name, lines = self._family(name, 'gauge', help_text)
+        for labels, value in self._samples(samples):
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def histogram(self, name: str, help_text: str, samples: Union[Histogram, List[Tuple[Labels, Histogram]]]):
+        """Add a histogram; samples is a Histogram or a list of (labels, Histogram)"""
+        name, lines = self._family(name, 'histogram', help_text)
+        for labels, histogram in self._samples(samples):
+            buckets, total, count = histogram.snapshot()
+            for bound, cumulative in buckets:
+                bucket_labels = dict(labels or {}, le=_format_value(bound))
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    def text(self) -> str:
+        """The exposition, ending with a newline"""
+        output = []
+        for name, (kind, help_text, lines) in self.families.items():
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+Collector = Callable[[MetricsWriter], None]
+
+class MetricsRegistry:
+    """Collectors whose metrics are rendered together on every scrape"""
+
+    def __init__(self, prefix: str = 'hitec_'):
+        self.prefix = prefix
+        self.collectors: List[Collector] = []
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add_collector(self, collector: Collector):
+        """Add a function that writes metrics into a MetricsWriter"""
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def remove_collector(self, collector: Collector):
+        """Remove a collector"""
+        with self.lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def render(self) -> str:
+        """Render every collector's metrics"""
+        writer = MetricsWriter(self.prefix)
+        writer.gauge('uptime_seconds', "Seconds since the metrics registry was created", time.time() - self.started)
+        with self.lock:
+            collectors = list(self.collectors)
+        for collector in collectors:
+            try:
+                collector(writer)
+            except Exception as e:
+                logger.error(f"Error in metrics collector: {e}")
+        return writer.text()
+
+class CANInterfaceMetrics:
+    """
+    Collector for a CANInterface's frame, error and queue counters
+
+    Bus load is reported both as a bit counter, for rate() queries, and as
+    a gauge averaged over the time since the previous scrape.
+    """
+
+    def __init__(self, can_interface, labels: Optional[Labels] = None):
+        """
+        Initialize collector
+
+        Args:
+            can_interface: Interface to report on
+            labels: Extra labels for every sample, e.g. a session name
+        """
+        self.can_interface = can_interface
+        self.labels = labels or {}
+        self.last_sample: Optional[Tuple[float, int]] = None
+
+    def _labels(self, **extra) -> Labels:
+        return dict(self.labels, channel=self.can_interface.channel, **extra)
+
+    def bus_load(self) -> float:
+        """Fraction of the bitrate used since the previous call (0 on the first call)"""
+        counters = self.can_interface.get_counters()
+        bits = counters['rx_bits'] + counters['tx_bits']
+        now = time.monotonic()
+        previous, self.last_sample = self.last_sample, (now, bits)
+        if previous is None or now <= previous[0] or not self.can_interface.bitrate:
+            return 0.0
+        return (bits - previous[1]) / (now - previous[0]) / self.can_interface.bitrate
+
+    def __call__(self, writer: MetricsWriter):
+        interface = self.can_interface
+        counters = interface.get_counters()
+        labels = self._labels()
+
+        writer.gauge('can_connected', "1 while the CAN interface is connected", [(labels, int(interface.is_connected))])
+        writer.gauge('can_bitrate_bits_per_second', "Configured bus bitrate", [(labels, interface.bitrate)])
+        writer.counter('can_frames', "CAN frames by direction",
+                       [(self._labels(direction='rx'), counters['rx_frames']),
+                        (self._labels(direction='tx'), counters['tx_frames'])])
+        writer.counter('can_bits', "Bits on the wire by direction, excluding stuff bits",
+                       [(self._labels(direction='rx'), counters['rx_bits']),
+                        (self._labels(direction='tx'), counters['tx_bits'])])
+        writer.gauge('can_bus_load_ratio', "Fraction of the bitrate used since the previous scrape",
+                     [(labels, self.bus_load())])
+        writer.counter('can_tx_failures', "Frames that could not be sent", [(labels, counters['tx_failed'])])
+        writer.counter('can_error_frames', "Error frames received", [(labels, counters['error_frames'])])
+        writer.counter('can_bus_errors', "Bus errors handled, including error frames",
+                       [(labels, counters['bus_errors'])])
+        writer.counter('can_auto_resets', "Automatic bus resets by outcome",
+                       [(self._labels(result='success'), counters['auto_resets']),
+                        (self._labels(result='failure'), counters['auto_reset_failures'])])
+        writer.gauge('can_bus_errors_last_minute', "Bus errors counted towards the auto-reset threshold",
+                     [(labels, interface.bus_error_count)])
+
+        # The receive queue only counts when something polls it (see CANInterface queue_received)
+        dropped, depths = [], []
+        if interface.queue_received:
+            queue_labels = self._labels(queue='receive')
+            dropped.append((queue_labels, counters['rx_queue_dropped']))
+            depths.append((queue_labels, interface.received_messages.qsize()))
+        for sink in interface.log_sinks:
+            stats = sink.get_stats()
+            sink_labels = self._labels(queue=f"log_sink:{stats.get('filename', '')}")
+            dropped.append((sink_labels, stats.get('dropped', 0)))
+            depths.append((sink_labels, stats.get('queue_depth', 0)))
+        writer.counter('queue_dropped_frames', "Frames discarded because a queue was full", dropped)
+        writer.gauge('queue_depth', "Frames waiting in a queue", depths)
+
+        writer.histogram('can_callback_duration_seconds', "Time spent in receive callbacks per frame",
+                         [(labels, interface.callback_durations)])
+
+class ServoClientMetrics:
+    """Collector for a ServoClient's outstanding reads and response latency"""
+
+    def __init__(self, servo_client, labels: Optional[Labels] = None):
+        self.servo_client = servo_client
+        self.labels = labels or {}
+
+    def __call__(self, writer: MetricsWriter):
+        client = self.servo_client
+        with client.lock:
+            pending = sum(len(futures) for futures in client.pending_reads.values())
+        writer.gauge('servo_pending_reads', "Register reads waiting for a response", [(self.labels, pending)])
+        writer.histogram('servo_read_latency_seconds', "Time from a register read request to the response",
+                         [(self.labels, client.read_latency)])
+
+class MetricsExporter:
+    """
+    Serves a registry on /metrics from a background thread
+
+    For the desktop apps, which have no web server of their own.
+    """
+
+    def __init__(self, registry: MetricsRegistry, host: str = '0.0.0.0', port: int = 9108):
+        """
+        Initialize exporter
+
+        Args:
+            registry: Metrics to serve
+            host: Address to listen on
+            port: Port to listen on
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """
+        Start serving
+
+        Returns:
+            True if the port could be opened, False otherwise
+        """
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.server.daemon_threads = True
+        except OSError as e:
+            logger.error(f"Failed to start metrics exporter on port {self.port}: {e}")
+            return False
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        """Stop serving"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def start_exporter(port: int, can_interface, servo_client=None, host: str = '0.0.0.0') -> Optional[MetricsExporter]:
+    """
+    Serve the metrics of a desktop app's interface and client
+
+    Args:
+        port: Port to listen on
+        can_interface: CANInterface to report on
+        servo_client: ServoClient to report on, if any
+        host: Address to listen on
+
+    Returns:
+        Running exporter, or None if it could not start
+    """
+    registry = MetricsRegistry()
+    registry.add_collector(CANInterfaceMetrics(can_interface))
+    if servo_client is not None:
+        registry.add_collector(ServoClientMetrics(servo_client))
+    exporter = MetricsExporter(registry, host, port)
+    return exporter if exporter.start() else None
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Receive pipeline benchmark
+Replays a stored capture through the in-process receive path and reports frames/s and per-stage cost
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+import can
+import numpy as np
+
+from can_interface import CANInterface, CANMessage
+from capture_stats import frame_bits
+from compressed_capture import open_capture
+from servo_protocol import ServoProtocol
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StageResult:
+    """Timing of one pipeline stage"""
+    name: str
+    frames: int = 0
+    seconds: float = 0.0
+
+    @property
+    def us_per_frame(self) -> float:
+        return self.seconds / self.frames * 1e6 if self.frames else 0.0
+
+    @property
+    def frames_per_s(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+def _headless(cls, **attributes):
+    """Create a GUI object without building its window, for timing its formatting methods"""
+    instance = cls.__new__(cls)
+    for name, value in attributes.items():
+        setattr(instance, name, value)
+    return instance
+
+class PipelineBenchmark:
+    """
+    Times each step a received frame goes through, then the whole path
+
+    Stages, each timed on its own over the same frames:
+        read        capture records from the file
+        construct   CANMessage from the python-can Message returned by bus.recv()
+        queue       CANInterface dispatch into the receive queue and draining it
+        parse       observe_frame() and parse_response_message()
+        describe    desktop_app decode_message_description()
+        web_format  web_app message formatting
+        gui_format  gui_main and desktop_app monitor row formatting
+        end_to_end  construct plus inject_message() with the web callback and
+                    both GUI formatting callbacks registered
+
+    Tk widget updates run later on the GUI thread and are not included.
+    """
+
+    def __init__(self, filename: str, limit: Optional[int] = None, chunk_frames: int = 50000):
+        """
+        Initialize benchmark
+
+        Args:
+            filename: Plain or compressed capture to replay
+            limit: Maximum number of frames, all if None
+            chunk_frames: Frames held in memory at a time
+        """
+        self.filename = filename
+        self.limit = limit
+        self.chunk_frames = chunk_frames
+        self.stages: Dict[str, StageResult] = {}
+        self.wire_bits = 0
+        self.frames = 0
+
+    def _time(self, name: str, frames: int, function: Callable[[], None]):
+        """Run one stage over a chunk and add its time"""
+        stage = self.stages.setdefault(name, StageResult(name))
+        start = time.perf_counter()
+        function()
+        stage.seconds += time.perf_counter() - start
+        stage.frames += frames
+
+    def run(self) -> Dict[str, StageResult]:
+        """
+        Replay the capture through every stage
+
+        Returns:
+            Dictionary of stage name -> StageResult
+        """
+        # Imported here so the benchmark's own imports stay light; the GUI modules need tkinter
+        import web_app
+        import gui_main
+        import desktop_app
+
+        protocol = ServoProtocol()
+        web_app.app_state['messages'] = []
+        gui = _headless(gui_main.ServoControlGUI, servo_protocol=protocol)
+        desktop = _headless(desktop_app.ServoControlGUI, servo_protocol=protocol,
+                            logger=logging.getLogger('desktop_app'))
+
+        queue_interface = CANInterface()
+        pipeline_interface = web_app.can_interface
+        web_app.setup_message_callback()
+        pipeline_interface.add_message_callback(gui.format_can_message)
+        pipeline_interface.add_message_callback(desktop.format_can_message)
+
+        with open_capture(self.filename) as reader:
+            total = len(reader) if self.limit is None else min(self.limit, len(reader))
+            for start in range(0, total, self.chunk_frames):
+                stop = min(start + self.chunk_frames, total)
+                records: List = []
+                self._time('read', stop - start, lambda: records.extend(reader.records(start, stop)))
+                records = [record for record in records if not record.is_error_frame]
+                self._run_chunk(records, protocol, queue_interface, pipeline_interface,
+                                web_app.format_message, gui, desktop)
+
+        pipeline_interface.remove_message_callback(gui.format_can_message)
+        pipeline_interface.remove_message_callback(desktop.format_can_message)
+        return self.stages
+
+    def _run_chunk(self, records: List, protocol: ServoProtocol, queue_interface: CANInterface,
+                   pipeline_interface: CANInterface, format_message: Callable, gui, desktop):
+        """Time every stage over one chunk of records"""
+        count = len(records)
+        self.frames += count
+        dlc = np.fromiter((record.dlc for record in records), dtype=np.uint8, count=count)
+        extended = np.fromiter((record.is_extended_id for record in records), dtype=bool, count=count)
+        self.wire_bits += int(frame_bits(dlc, extended, stuffing=True).sum())
+
+        # What bus.recv() hands the receive worker
+        bus_messages = [can.Message(arbitration_id=record.arbitration_id, data=record.data,
+                                    is_extended_id=record.is_extended_id, timestamp=record.timestamp)
+                        for record in records]
+
+        def construct() -> List[CANMessage]:
+            return [CANMessage(arbitration_id=msg.arbitration_id, data=msg.data, is_extended_id=msg.is_extended_id,
+                               timestamp=msg.timestamp, is_error_frame=getattr(msg, 'is_error_frame', False))
+                    for msg in bus_messages]
+
+        messages: List[CANMessage] = []
+        self._time('construct', count, lambda: messages.extend(construct()))
+
+        def queue():
+            # The GUIs poll the queue in small batches while the worker fills it
+            for index, msg in enumerate(messages):
+                queue_interface._dispatch_message(msg)
+                if index % 10 == 9:
+                    queue_interface.get_received_messages(10)
+            queue_interface.clear_received_messages()
+        self._time('queue', count, queue)
+
+        def parse():
+            for msg in messages:
+                protocol.observe_frame(msg.data)
+                protocol.parse_response_message(msg.data)
+        self._time('parse', count, parse)
+
+        def describe():
+            for msg in messages:
+                desktop.decode_message_description(msg.arbitration_id, msg.data)
+        self._time('describe', count, describe)
+
+        def web_format():
+            for msg in messages:
+                format_message(msg)
+        self._time('web_format', count, web_format)
+
+        def gui_format():
+            for msg in messages:
+                gui.format_can_message(msg)
+                desktop.format_can_message(msg)
+        self._time('gui_format', count, gui_format)
+
+        def end_to_end():
+            for msg in bus_messages:
+                pipeline_interface.inject_message(CANMessage(
+                    arbitration_id=msg.arbitration_id, data=msg.data, is_extended_id=msg.is_extended_id,
+                    timestamp=msg.timestamp, is_error_frame=getattr(msg, 'is_error_frame', False)))
+                if pipeline_interface.received_messages.qsize() >= 10:
+                    pipeline_interface.get_received_messages(10)
+            pipeline_interface.clear_received_messages()
+        self._time('end_to_end', count, end_to_end)
+
+    def report(self, bitrate: int = 1000000) -> Dict:
+        """
+        Summarize the run
+
+        Args:
+            bitrate: Bus bitrate whose saturated frame rate the pipeline must sustain
+
+        Returns:
+            Dictionary with per-stage results, the saturated bus frame rate for
+            this capture's frame mix, and end-to-end headroom over it
+        """
+        bus_frames_per_s = self.frames / (self.wire_bits / bitrate) if self.wire_bits else 0.0
+        end_to_end = self.stages.get('end_to_end', StageResult('end_to_end'))
+        return {
+            'capture': self.filename,
+            'frames': self.frames,
+            'bitrate': bitrate,
+            'saturated_bus_frames_per_s': bus_frames_per_s,
+            'end_to_end_frames_per_s': end_to_end.frames_per_s,
+            'headroom': end_to_end.frames_per_s / bus_frames_per_s if bus_frames_per_s else 0.0,
+            'stages': {name: dict(asdict(stage), us_per_frame=stage.us_per_frame, frames_per_s=stage.frames_per_s)
+                       for name, stage in self.stages.items()}
+        }
+
+def format_report(report: Dict, baseline: Optional[Dict] = None) -> str:
+    """Render a benchmark report as plain text, with changes against a baseline report if given"""
+    lines = [
+        f"Capture:    {report['capture']} ({report['frames']} frames)",
+        f"End to end: {report['end_to_end_frames_per_s']:.0f} frames/s, "
+        f"{report['headroom']:.2f}x a saturated {report['bitrate'] // 1000} kbit/s bus "
+        f"({report['saturated_bus_frames_per_s']:.0f} frames/s)",
+        "",
+        f"{'stage':<12}{'us/frame':>10}{'frames/s':>12}" + (f"{'vs base':>10}" if baseline else "")
+    ]
+    for name, stage in report['stages'].items():
+        line = f"{name:<12}{stage['us_per_frame']:>10.2f}{stage['frames_per_s']:>12.0f}"
+        base = baseline['stages'].get(name) if baseline else None
+        if base and base['us_per_frame']:
+            line += f"{(stage['us_per_frame'] / base['us_per_frame'] - 1) * 100:>+9.1f}%"
+        lines.append(line)
+    return '\n'.join(lines)
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark the receive pipeline with a stored capture")
+    parser.add_argument('capture', help="Capture file (.hcap or .hcapz)")
+    parser.add_argument('--limit', type=int, help="Maximum number of frames to replay")
+    parser.add_argument('--bitrate', type=int, default=1000000, help="Bus bitrate the pipeline must keep up with")
+    parser.add_argument('--output', help="Write the report as JSON, e.g. to compare revisions")
+    parser.add_argument('--baseline', help="JSON report of an earlier run to compare against")
+    parser.add_argument('--min-headroom', type=float, default=0.0,
+                        help="Exit with status 1 if end-to-end throughput is below this multiple of the bus rate")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    benchmark = PipelineBenchmark(args.capture, args.limit)
+    benchmark.run()
+    report = benchmark.report(args.bitrate)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if report['headroom'] < args.min_headroom:
+        print(f"End-to-end throughput is below {args.min_headroom:.2f}x the bus rate", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Servo position time series from captures
+Extracts per-servo position registers as NumPy arrays and downsamples them for display
+"""
+
+import argparse
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from bulk_decoder import capture_records, decode_frames
+from compressed_capture import open_capture
+from servo_protocol import FRAME_LAYOUTS, LEGACY_REQUEST_HEADER, RESPONSE_FRAME_TYPES, ServoProtocol
+
+logger = logging.getLogger(__name__)
+
+# POSITION_NEW, POSITION_EXT and the position command register
+POSITION_REGISTERS = (0x0C, 0x10, 0x1E)
+
+# Value sources
+KIND_RESPONSE = 'response'      # Value read back from the servo
+KIND_COMMAND = 'command'        # Value written to the servo
+
+def _build_kind_table() -> np.ndarray:
+    """Per-opcode source: 0 = no value, 1 = response, 2 = command (legacy requests decided per frame)"""
+    kinds = np.zeros(256, dtype=np.uint8)
+    for opcode, (frame_type, _, _) in FRAME_LAYOUTS.items():
+        if frame_type in RESPONSE_FRAME_TYPES:
+            kinds[opcode] = 1
+        elif frame_type.startswith('write'):
+            kinds[opcode] = 2
+    return kinds
+
+_OPCODE_KINDS = _build_kind_table()
+_KIND_NAMES = {1: KIND_RESPONSE, 2: KIND_COMMAND}
+
+# Dual frames whose second register carries a value (dual writes and dual responses)
+_DUAL_VALUE_OPCODES = np.array([opcode for opcode, (_, _, layout) in FRAME_LAYOUTS.items()
+                                if layout == 'value_dual'], dtype=np.uint8)
+
+@dataclass
+class PositionSeries:
+    """Values of one register of one servo over time"""
+    servo_id: int
+    address: int
+    kind: str                   # 'response' or 'command'
+    timestamps: np.ndarray      # Seconds since the epoch (float64)
+    values: np.ndarray
+
+    @property
+    def name(self) -> str:
+        register = ServoProtocol.REGISTERS.get(self.address)
+        return register.name if register else f"0x{self.address:02X}"
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+def extract_position_series(reader, registers: Iterable[int] = POSITION_REGISTERS,
+                            servo_ids: Optional[Iterable[int]] = None, start: int = 0, stop: Optional[int] = None,
+                            block_records: int = 1 << 20, signed: bool = False
+                            ) -> Dict[Tuple[int, int, str], PositionSeries]:
+    """
+    Extract register values per servo from a capture
+
+    The capture is decoded in blocks with the vectorized decoder, so no
+    per-frame Python objects are created and memory grows only with the
+    number of matching values. Both registers of dual frames are used.
+
+    Args:
+        reader: Open capture (see compressed_capture.open_capture)
+        registers: Register addresses to extract
+        servo_ids: Only these servos, all if None
+        start: First record index
+        stop: Index after the last record, end of capture if None
+        block_records: Records decoded per block
+        signed: Interpret values as signed 16-bit
+
+    Returns:
+        Dictionary of (servo_id, address, kind) -> PositionSeries
+    """
+    registers = np.array(sorted(set(registers)), dtype=np.uint8)
+    servo_filter = np.array(sorted(set(servo_ids)), dtype=np.uint8) if servo_ids is not None else None
+    stop = len(reader) if stop is None else min(stop, len(reader))
+    parts: Dict[Tuple[int, int, int], list] = {}
+
+    for block_start in range(start, stop, block_records):
+        records = capture_records(reader, block_start, min(block_start + block_records, stop))
+        decoded = decode_frames(records['data'], records['dlc'], records['arb_id'], records['timestamp_ns'] / 1e9)
+
+        kinds = _OPCODE_KINDS[decoded['opcode']]
+        legacy_request = decoded['opcode'] == LEGACY_REQUEST_HEADER
+        if legacy_request.any():
+            # Old format requests carry a value only when REG length is 2 (write)
+            reg_length = records['data'][decoded['index'], 3]
+            kinds[legacy_request] = np.where(reg_length[legacy_request] == 2, 2, 0)
+
+        keep = kinds != 0
+        if servo_filter is not None:
+            keep &= np.isin(decoded['servo_id'], servo_filter)
+
+        # First and second register of each frame
+        for address_field, value_field in (('address', 'value'), ('address_b', 'value_b')):
+            mask = keep & np.isin(decoded[address_field], registers)
+            if address_field == 'address_b':
+                mask &= np.isin(decoded['opcode'], _DUAL_VALUE_OPCODES)
+            if not mask.any():
+                continue
+            selected = decoded[mask]
+            selected_kinds = kinds[mask]
+            keys = (selected['servo_id'].astype(np.uint32) << 16) | \
+                   (selected[address_field].astype(np.uint32) << 8) | selected_kinds
+            for key in np.unique(keys):
+                rows = keys == key
+                parts.setdefault((int(key) >> 16, (int(key) >> 8) & 0xFF, int(key) & 0xFF), []).append(
+                    (selected['timestamp'][rows], selected[value_field][rows]))
+
+    series = {}
+    for (servo_id, address, kind), chunks in parts.items():
+        timestamps = np.concatenate([chunk[0] for chunk in chunks])
+        values = np.concatenate([chunk[1] for chunk in chunks])
+        values = values.view(np.int16).astype(np.int32) if signed else values.astype(np.int32)
+        # Frames are recorded from several threads; keep each series in time order
+        order = np.argsort(timestamps, kind='stable')
+        series[(servo_id, address, _KIND_NAMES[kind])] = PositionSeries(
+            servo_id, address, _KIND_NAMES[kind], timestamps[order], values[order])
+
+    logger.debug(f"Extracted {len(series)} series from records {start}-{stop}")
+    return series
+
+def load_position_series(filename: str, **kwargs) -> Dict[Tuple[int, int, str], PositionSeries]:
+    """
+    Extract position series from a capture file
+
+    Args:
+        filename: Plain or compressed capture
+        **kwargs: Passed to extract_position_series
+
+    Returns:
+        Dictionary of (servo_id, address, kind) -> PositionSeries
+    """
+    with open_capture(filename) as reader:
+        return extract_position_series(reader, **kwargs)
+
+def minmax_downsample(timestamps: np.ndarray, values: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsample by keeping the minimum and maximum of each bucket
+
+    Preserves peaks exactly, which suits spotting overshoot and glitches.
+
+    Args:
+        timestamps: Sample times, ascending
+        values: Sample values
+        threshold: Maximum number of output points
+
+    Returns:
+        Tuple of (timestamps, values) with at most threshold points, in time order
+    """
+    count = len(timestamps)
+    if threshold >= count or threshold < 4:
+        return timestamps, values
+
+    buckets = threshold // 2
+    edges = np.linspace(0, count, buckets + 1).astype(np.int64)
+    picks = np.empty(buckets * 2, dtype=np.int64)
+    for bucket in range(buckets):
+        low, high = edges[bucket], edges[bucket + 1]
+        window = values[low:high]
+        first, second = low + np.argmin(window), low + np.argmax(window)
+        picks[2 * bucket], picks[2 * bucket + 1] = min(first, second), max(first, second)
+
+    picks = np.unique(picks)
+    return timestamps[picks], values[picks]
+
+def lttb(timestamps: np.ndarray, values: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsample with Largest-Triangle-Three-Buckets
+
+    Keeps the first and last points and, for each bucket in between, the point
+    forming the largest triangle with the previous pick and the next bucket's
+    average, which preserves the visual shape of the series.
+
+    Args:
+        timestamps: Sample times, ascending
+        values: Sample values
+        threshold: Number of output points
+
+    Returns:
+        Tuple of (timestamps, values) with threshold points
+    """
+    count = len(timestamps)
+    if threshold >= count or threshold < 3:
+        return timestamps, values
+
+    x = timestamps.astype(np.float64)
+    y = values.astype(np.float64)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    picks = np.empty(threshold, dtype=np.int64)
+    picks[0] = 0
+    picks[-1] = count - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        next_low, next_high = high, edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x = x[next_low:next_high].mean()
+        next_y = y[next_low:next_high].mean()
+
+        # Twice the triangle area for every candidate in this bucket
+        areas = np.abs((x[previous] - next_x) * (y[low:high] - y[previous]) -
+                       (x[previous] - x[low:high]) * (next_y - y[previous]))
+        previous = low + int(np.argmax(areas))
+        picks[bucket + 1] = previous
+
+    return timestamps[picks], values[picks]
+
+def downsample(series: PositionSeries, threshold: int, method: str = 'lttb') -> PositionSeries:
+    """
+    Reduce a series to a display-sized number of points
+
+    Args:
+        series: Series to reduce
+        threshold: Maximum number of points
+        method: 'lttb' (shape-preserving) or 'minmax' (peak-preserving)
+
+    Returns:
+        New PositionSeries
+    """
+    if method == 'lttb':
+        timestamps, values = lttb(series.timestamps, series.values, threshold)
+    elif method == 'minmax':
+        timestamps, values = minmax_downsample(series.timestamps, series.values, threshold)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    return PositionSeries(series.servo_id, series.address, series.kind, timestamps, values)
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Extract servo position time series from a capture")
+    parser.add_argument('capture', help="Capture file (.hcap or .hcapz)")
+    parser.add_argument('--servo', type=int, action='append', help="Servo ID (repeatable, default all)")
+    parser.add_argument('--register', type=lambda v: int(v, 0), action='append',
+                        help="Register address (repeatable, default 0x0C 0x10 0x1E)")
+    parser.add_argument('--points', type=int, default=0, help="Downsample each series to this many points")
+    parser.add_argument('--method', choices=('lttb', 'minmax'), default='lttb', help="Downsampling method")
+    parser.add_argument('--signed', action='store_true', help="Treat values as signed 16-bit")
+    parser.add_argument('--output', help="Write the series to a .npz file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    series = load_position_series(args.capture, registers=args.register or POSITION_REGISTERS,
+                                  servo_ids=args.servo, signed=args.signed)
+    if args.points:
+        series = {key: downsample(item, args.points, args.method) for key, item in series.items()}
+
+    arrays = {}
+    for (servo_id, address, kind), item in sorted(series.items()):
+        span = item.timestamps[-1] - item.timestamps[0] if len(item) else 0.0
+        print(f"Servo {servo_id:3d} {item.name:<14} {kind:<8} {len(item):>10} points over {span:.1f} s")
+        prefix = f"servo{servo_id}_0x{address:02X}_{kind}"
+        arrays[f"{prefix}_t"] = item.timestamps
+        arrays[f"{prefix}_v"] = item.values
+
+    if args.output:
+        np.savez_compressed(args.output, **arrays)
+        print(f"Wrote {len(series)} series to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Fleet provisioning for Hitec CAN servos
+Applies register profiles to many servos spread over several CAN channels in parallel
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Any, Callable, Dict, List, Optional
+
+from can_interface import CANInterface
+from servo_client import ServoClient, ProfileResult
+
+@dataclass
+class ManifestEntry:
+    """One servo to provision"""
+    channel: str
+    servo_id: int
+    profile: Dict[int, int]
+    profile_name: str = ""
+
+@dataclass
+class ProvisioningEvent:
+    """Progress report streamed while provisioning"""
+    channel: str
+    servo_id: Optional[int]     # None for channel-level events (connect, disconnect)
+    stage: str                  # connecting, reading, writing, saving, verifying, done, failed
+    message: str
+    timestamp: float = field(default_factory=time.time)
+    result: Optional[ProfileResult] = None
+
+def _parse_int(value: Any) -> int:
+    """Parse an int from a JSON number or a decimal/hex string"""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    return int(value, 16) if value.lower().startswith('0x') else int(value)
+
+def parse_profile(profile: Dict[str, Any]) -> Dict[int, int]:
+    """
+    Parse a register profile from its JSON form
+
+    Args:
+        profile: Dictionary of register address -> value, e.g. {"0x6A": 1}
+
+    Returns:
+        Dictionary of int address -> int value
+    """
+    registers = {}
+    for address, value in profile.items():
+        address = _parse_int(address)
+        value = _parse_int(value)
+        if not (0 <= address <= 0xFF and address % 2 == 0):
+            raise ValueError(f"Invalid register address 0x{address:02X}")
+        if not 0 <= value <= 0xFFFF:
+            raise ValueError(f"Invalid value {value} for register 0x{address:02X}")
+        registers[address] = value
+    return registers
+
+def load_manifest(filename: str) -> Dict[str, Any]:
+    """
+    Load a provisioning manifest
+
+    The manifest is JSON with named profiles and one entry per servo:
+        {
+          "bitrate": 1000000,
+          "profiles": {"extended": {"0x6A": 1}},
+          "servos": [{"channel": "PCAN_USBBUS1", "servo_id": 1, "profile": "extended"}]
+        }
+    An entry's profile may also be an inline register dictionary.
+
+    Args:
+        filename: Path to manifest file
+
+    Returns:
+        Dictionary with 'bitrate', 'interface', 'is_extended' and 'entries' (list of ManifestEntry)
+    """
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+
+    profiles = {name: parse_profile(registers) for name, registers in manifest.get('profiles', {}).items()}
+
+    entries = []
+    for item in manifest.get('servos', []):
+        profile = item.get('profile', {})
+        if isinstance(profile, str):
+            if profile not in profiles:
+                raise ValueError(f"Unknown profile '{profile}' for servo {item.get('servo_id')}")
+            entries.append(ManifestEntry(item['channel'], _parse_int(item['servo_id']), profiles[profile], profile))
+        else:
+            entries.append(ManifestEntry(item['channel'], _parse_int(item['servo_id']), parse_profile(profile)))
+
+    return {
+        'bitrate': int(manifest.get('bitrate', 500000)),
+        'interface': manifest.get('interface', 'pcan'),
+        'is_extended': bool(manifest.get('extended_id', False)),
+        'entries': entries
+    }
+
+class ProvisioningRunner:
+    """Runs one provisioning worker per CAN channel"""
+
+    def __init__(self, entries: List[ManifestEntry], bitrate: int = 500000, interface: str = 'pcan',
+                 is_extended: bool = False, progress_callback: Optional[Callable[[ProvisioningEvent], None]] = None):
+        """
+        Initialize provisioning runner
+
+        Args:
+            entries: Servos to provision
+            bitrate: CAN bus bitrate in bps for every channel
+            interface: python-can interface name
+            is_extended: Use extended CAN ID format for requests
+            progress_callback: Called from worker threads for every ProvisioningEvent
+        """
+        self.logger = logging.getLogger(__name__)
+        self.entries = entries
+        self.bitrate = bitrate
+        self.interface = interface
+        self.is_extended = is_extended
+        self.progress_callback = progress_callback
+
+        # Every event is also queued so callers can stream progress from another thread
+        self.events: Queue = Queue()
+        self.results: Dict[str, Dict[int, ProfileResult]] = {}
+        self.lock = threading.Lock()
+
+    def _emit(self, event: ProvisioningEvent):
+        """Publish a progress event"""
+        self.events.put(event)
+        if self.progress_callback:
+            try:
+                self.progress_callback(event)
+            except Exception as e:
+                self.logger.error(f"Error in progress callback: {e}")
+
+    def run(self, read_timeout: float = 0.5, verify_timeout: float = 2.0) -> Dict[str, Dict[int, ProfileResult]]:
+        """
+        Provision every servo, one concurrent worker per channel
+
+        Args:
+            read_timeout: Time to wait for current register values in seconds
+            verify_timeout: Time allowed for servos to come back after SAVE_RESET in seconds
+
+        Returns:
+            Dictionary of channel -> {servo_id: ProfileResult}
+        """
+        by_channel: Dict[str, List[ManifestEntry]] = {}
+        for entry in self.entries:
+            by_channel.setdefault(entry.channel, []).append(entry)
+
+        workers = [threading.Thread(target=self._channel_worker, args=(channel, entries, read_timeout, verify_timeout),
+                                    name=f"provision-{channel}", daemon=True)
+                   for channel, entries in by_channel.items()]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return self.results
+
+    def _channel_worker(self, channel: str, entries: List[ManifestEntry], read_timeout: float, verify_timeout: float):
+        """Provision all servos on one channel"""
+        self._emit(ProvisioningEvent(channel, None, 'connecting', f"Connecting to {channel} at {self.bitrate} bps"))
+
+        can_interface = CANInterface(channel, self.bitrate, self.interface, queue_received=False)
+        if not can_interface.connect():
+            for entry in entries:
+                result = ProfileResult(servo_id=entry.servo_id, success=False, message=f"Could not connect to {channel}")
+                self._store(channel, result)
+                self._emit(ProvisioningEvent(channel, entry.servo_id, 'failed', result.message, result=result))
+            return
+
+        client = ServoClient(can_interface, is_extended=self.is_extended)
+        try:
+            profiles = {}
+            for entry in entries:
+                if entry.servo_id in profiles:
+                    self.logger.warning(f"Servo {entry.servo_id} listed twice on {channel}, using the last profile")
+                profiles[entry.servo_id] = entry.profile
+
+            def progress(servo_id: int, stage: str, message: str):
+                # Final stages are reported below together with the result
+                if stage not in ('done', 'failed'):
+                    self._emit(ProvisioningEvent(channel, servo_id, stage, message))
+
+            results = client.apply_profiles(profiles, use_cache=False, read_timeout=read_timeout,
+                                            verify_timeout=verify_timeout, progress=progress)
+            for result in results.values():
+                self._store(channel, result)
+                self._emit(ProvisioningEvent(channel, result.servo_id, 'done' if result.success else 'failed',
+                                             result.message, result=result))
+
+        except Exception as e:
+            self.logger.error(f"Provisioning failed on {channel}: {e}")
+            for entry in entries:
+                if entry.servo_id not in self.results.get(channel, {}):
+                    result = ProfileResult(servo_id=entry.servo_id, success=False, message=f"Provisioning error: {e}")
+                    self._store(channel, result)
+                    self._emit(ProvisioningEvent(channel, entry.servo_id, 'failed', result.message, result=result))
+        finally:
+            client.close()
+            can_interface.disconnect()
+
+    def _store(self, channel: str, result: ProfileResult):
+        """Record a servo result"""
+        with self.lock:
+            self.results.setdefault(channel, {})[result.servo_id] = result
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Provision Hitec CAN servos from a manifest")
+    parser.add_argument('manifest', help="Manifest JSON file")
+    parser.add_argument('--read-timeout', type=float, default=0.5, help="Seconds to wait for current values")
+    parser.add_argument('--verify-timeout', type=float, default=2.0, help="Seconds to wait for verification")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    manifest = load_manifest(args.manifest)
+
+    def print_event(event: ProvisioningEvent):
+        servo = f"servo {event.servo_id}" if event.servo_id is not None else "bus"
+        print(f"[{event.channel}] {servo}: {event.stage} - {event.message}", file=sys.stderr if args.json else sys.stdout)
+
+    runner = ProvisioningRunner(manifest['entries'], manifest['bitrate'], manifest['interface'],
+                                manifest['is_extended'], progress_callback=print_event)
+    start_time = time.perf_counter()
+    results = runner.run(args.read_timeout, args.verify_timeout)
+    elapsed = time.perf_counter() - start_time
+
+    failed = [(channel, servo_id) for channel, servos in results.items()
+              for servo_id, result in servos.items() if not result.success]
+
+    if args.json:
+        print(json.dumps({
+            channel: {str(servo_id): {
+                'success': result.success,
+                'message': result.message,
+                'written': {f"0x{a:02X}": v for a, v in result.written.items()},
+                'unchanged': {f"0x{a:02X}": v for a, v in result.unchanged.items()},
+                'frames_sent': result.frames_sent
+            } for servo_id, result in servos.items()}
+            for channel, servos in results.items()
+        }, indent=2))
+    else:
+        total = sum(len(servos) for servos in results.values())
+        print(f"Provisioned {total - len(failed)}/{total} servos in {elapsed:.2f} s")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
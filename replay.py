@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Capture replay for Hitec CAN servo traffic
+Plays a recorded capture back onto a CAN bus or straight into a CANInterface's subscribers
+"""
+
+import argparse
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import can
+
+from can_interface import CANInterface, CANMessage
+from capture import CaptureRecord
+from compressed_capture import open_capture
+
+MIN_SPEED = 0.1
+MAX_SPEED = 100.0
+
+# Below this, sleep() overshoots enough that the last stretch is spent yielding instead
+_SPIN_THRESHOLD = 0.002
+
+def wait_until(deadline: float, stop_event: Optional[threading.Event] = None) -> bool:
+    """
+    Wait until a time.perf_counter() deadline with sub-millisecond precision
+
+    Sleeps for the bulk of the wait and yields for the final stretch, which
+    keeps jitter low without spinning a core for long gaps.
+
+    Args:
+        deadline: perf_counter() value to wait for
+        stop_event: Returns early when set (e.g. to stop, or to reschedule)
+
+    Returns:
+        False if stopped early, True otherwise
+    """
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return True
+        if stop_event is not None and stop_event.is_set():
+            return False
+        if remaining > _SPIN_THRESHOLD:
+            # Block on the event when there is one so a stop or wake request ends the wait at once
+            if stop_event is not None:
+                if stop_event.wait(remaining - _SPIN_THRESHOLD):
+                    return False
+            else:
+                time.sleep(remaining - _SPIN_THRESHOLD)
+        else:
+            time.sleep(0)
+
+class CaptureReplayer:
+    """
+    Replays a capture file at its original pace, scaled, or as fast as possible
+
+    Records are read lazily from the capture's memory map, so captures of any
+    size replay in constant memory. Pacing is scheduled against the start of
+    the replay rather than the previous frame, so timing errors do not add up.
+    """
+
+    def __init__(self, filename: str, speed: Optional[float] = 1.0, include_rx: bool = True,
+                 include_tx: bool = True, start: int = 0, stop: Optional[int] = None,
+                 loops: int = 1, rebase_timestamps: bool = False):
+        """
+        Initialize replayer
+
+        Args:
+            filename: Capture file, plain or compressed
+            speed: Playback rate multiplier (0.1-100), None for as fast as possible
+            include_rx: Replay frames that were received
+            include_tx: Replay frames that were sent by the tool
+            start: First record index
+            stop: Index after the last record, end of capture if None
+            loops: Number of passes over the capture, 0 to repeat until stopped
+            rebase_timestamps: Stamp frames with the replay time instead of the recorded time
+        """
+        if speed is not None and not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"Replay speed must be between {MIN_SPEED} and {MAX_SPEED}, or None")
+
+        self.logger = logging.getLogger(__name__)
+        self.reader = open_capture(filename)
+        self.speed = speed
+        self.include_rx = include_rx
+        self.include_tx = include_tx
+        self.start_index = start
+        self.stop_index = stop
+        self.loops = loops
+        self.rebase_timestamps = rebase_timestamps
+
+        self.frames_sent = 0
+        self.max_lag = 0.0          # Worst lateness behind schedule in seconds
+        self.position = start
+        self.loop_count = 0
+        self.errors = 0
+
+        self.replay_thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.is_running = False
+
+    def to_bus(self, bus: can.BusABC) -> Callable[[CaptureRecord], None]:
+        """Target that sends each record on a python-can bus (e.g. a virtual channel)"""
+        def send(record: CaptureRecord):
+            bus.send(can.Message(
+                timestamp=self._timestamp(record),
+                arbitration_id=record.arbitration_id,
+                is_extended_id=record.is_extended_id,
+                is_error_frame=record.is_error_frame,
+                data=record.data
+            ))
+        return send
+
+    def to_interface(self, can_interface: CANInterface) -> Callable[[CaptureRecord], None]:
+        """Target that injects each record into a CANInterface's receive pipeline"""
+        def inject(record: CaptureRecord):
+            can_interface.inject_message(CANMessage(
+                arbitration_id=record.arbitration_id,
+                data=record.data,
+                is_extended_id=record.is_extended_id,
+                timestamp=self._timestamp(record),
+                is_error_frame=record.is_error_frame
+            ))
+        return inject
+
+    def _timestamp(self, record: CaptureRecord) -> float:
+        return time.time() if self.rebase_timestamps else record.timestamp
+
+    def run(self, target: Callable[[CaptureRecord], None]) -> int:
+        """
+        Replay in the calling thread until done or stopped
+
+        Args:
+            target: Called with each record at its scheduled time (see to_bus/to_interface)
+
+        Returns:
+            Number of frames delivered
+        """
+        self.is_running = True
+        self.stop_event.clear()
+        try:
+            while not self.stop_event.is_set() and (self.loops == 0 or self.loop_count < self.loops):
+                if not self._replay_pass(target):
+                    # Nothing to replay; looping would only spin
+                    self.logger.warning("Replay range has no frames matching the filters")
+                    break
+                self.loop_count += 1
+        finally:
+            self.is_running = False
+        self.logger.info(f"Replay finished: {self.frames_sent} frames, max lag {self.max_lag * 1000:.2f} ms")
+        return self.frames_sent
+
+    def _replay_pass(self, target: Callable[[CaptureRecord], None]) -> bool:
+        """
+        Replay the selected record range once
+
+        Returns:
+            False if no record in the range passed the filters
+        """
+        first_timestamp_ns = None
+        started = time.perf_counter()
+        selected = False
+
+        for index, record in enumerate(self.reader.records(self.start_index, self.stop_index), self.start_index):
+            if self.stop_event.is_set():
+                return True
+            if record.is_tx and not self.include_tx or not record.is_tx and not self.include_rx:
+                continue
+            selected = True
+
+            if self.speed is not None:
+                if first_timestamp_ns is None:
+                    first_timestamp_ns = record.timestamp_ns
+                deadline = started + (record.timestamp_ns - first_timestamp_ns) / 1e9 / self.speed
+                if not wait_until(deadline, self.stop_event):
+                    return True
+                lag = time.perf_counter() - deadline
+                if lag > self.max_lag:
+                    self.max_lag = lag
+
+            try:
+                target(record)
+                self.frames_sent += 1
+            except Exception as e:
+                self.errors += 1
+                self.logger.error(f"Error replaying frame {index}: {e}")
+            self.position = index
+        return selected
+
+    def start(self, target: Callable[[CaptureRecord], None]):
+        """Replay in a background thread"""
+        if self.replay_thread and self.replay_thread.is_alive():
+            return
+        self.replay_thread = threading.Thread(target=self.run, args=(target,), name="capture-replay", daemon=True)
+        self.replay_thread.start()
+
+    def stop(self):
+        """Stop a running replay"""
+        self.stop_event.set()
+        if self.replay_thread and self.replay_thread is not threading.current_thread():
+            self.replay_thread.join(timeout=2.0)
+            self.replay_thread = None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for a background replay to finish
+
+        Returns:
+            True if the replay finished, False on timeout
+        """
+        if self.replay_thread:
+            self.replay_thread.join(timeout)
+            return not self.replay_thread.is_alive()
+        return True
+
+    def close(self):
+        """Stop replaying and release the capture"""
+        self.stop()
+        self.reader.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get replay progress"""
+        return {
+            'running': self.is_running,
+            'frames_sent': self.frames_sent,
+            'position': self.position,
+            'total_records': len(self.reader),
+            'loop': self.loop_count,
+            'max_lag_ms': self.max_lag * 1000,
+            'errors': self.errors,
+            'speed': self.speed
+        }
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Replay a CAN capture onto a bus")
+    parser.add_argument('capture', help="Capture file (.hcap or .hcapz)")
+    parser.add_argument('--channel', default='replay', help="Target channel (default: virtual channel 'replay')")
+    parser.add_argument('--interface', default='virtual', help="python-can interface of the target bus")
+    parser.add_argument('--bitrate', type=int, default=500000, help="Bitrate for hardware interfaces")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help=f"Playback rate multiplier ({MIN_SPEED}-{MAX_SPEED}), 0 for as fast as possible")
+    parser.add_argument('--rx-only', action='store_true', help="Only replay frames that were received")
+    parser.add_argument('--loops', type=int, default=1, help="Number of passes, 0 to repeat until interrupted")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    replayer = CaptureReplayer(args.capture, speed=args.speed or None, include_tx=not args.rx_only,
+                               loops=args.loops, rebase_timestamps=True)
+    kwargs = {} if args.interface == 'virtual' else {'bitrate': args.bitrate}
+    bus = can.Bus(interface=args.interface, channel=args.channel, **kwargs)
+    try:
+        replayer.run(replayer.to_bus(bus))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = replayer.get_stats()
+        print(f"Replayed {stats['frames_sent']} frames, max lag {stats['max_lag_ms']:.2f} ms")
+        replayer.close()
+        bus.shutdown()
+
+if __name__ == "__main__":
+    main()
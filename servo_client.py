@@ -0,0 +1,782 @@
+"""
+Servo request/response client
+Matches register reads to servo responses and applies register profiles with a minimal number of frames
+"""
+
+import threading
+import time
+import logging
+from concurrent.futures import Future, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from can_interface import CANInterface, CANMessage
+from metrics import Histogram
+from servo_protocol import ServoProtocol, ProtocolVariant, RESPONSE_FRAME_TYPES
+
+SAVE_RESET_ADDRESS = 0x70
+SERVO_ID_ADDRESS = 0x32
+CAN_MODE_ADDRESS = 0x6A
+
+# Registers that change how a servo is addressed once saved and reset
+IDENTITY_REGISTERS = (SERVO_ID_ADDRESS, 0x3C, 0x3E, CAN_MODE_ADDRESS)
+
+@dataclass
+class ProfileResult:
+    """Outcome of applying a register profile to one servo"""
+    servo_id: int
+    success: bool
+    message: str
+    written: Dict[int, int] = field(default_factory=dict)      # Registers that had to change
+    unchanged: Dict[int, int] = field(default_factory=dict)    # Registers already at target
+    mismatched: Dict[int, Tuple[int, Optional[int]]] = field(default_factory=dict)  # address -> (expected, actual)
+    frames_sent: int = 0
+    duration: float = 0.0
+
+@dataclass
+class ReadinessResult:
+    """Outcome of waiting for a servo to answer after a reset"""
+    servo_id: int
+    ready: bool
+    message: str
+    elapsed: float = 0.0
+    attempts: int = 0
+    values: Dict[int, Optional[int]] = field(default_factory=dict)   # Last value read per probed register
+
+# Batch operation kinds
+BATCH_READ = 'read'
+BATCH_WRITE = 'write'
+BATCH_SEND = 'send'
+
+@dataclass
+class BatchOperation:
+    """One step of a batch: a register read or write, or a raw frame"""
+    kind: str                               # BATCH_READ, BATCH_WRITE or BATCH_SEND
+    servo_id: int = 0
+    address: int = 0
+    value: int = 0
+    arbitration_id: int = 0                 # BATCH_SEND only
+    data: bytes = b""                       # BATCH_SEND only
+    is_extended: Optional[bool] = None      # None uses the client's format
+
+@dataclass
+class BatchResult:
+    """Outcome of one batch operation"""
+    index: int
+    kind: str
+    success: bool
+    message: str
+    value: Optional[int] = None             # Register value for reads
+    latency: Optional[float] = None         # Seconds from request to response for reads
+
+class ServoClient:
+    """Request/response helper on top of CANInterface"""
+
+    def __init__(self, can_interface: CANInterface, servo_protocol: Optional[ServoProtocol] = None,
+                 is_extended: bool = False):
+        """
+        Initialize servo client
+
+        Args:
+            can_interface: Connected (or later connected) CAN interface
+            servo_protocol: Protocol handler, shared with the GUI if given
+            is_extended: Use extended CAN ID format for requests
+        """
+        self.logger = logging.getLogger(__name__)
+        self.can_interface = can_interface
+        self.servo_protocol = servo_protocol or ServoProtocol()
+        self.is_extended = is_extended
+        self.lock = threading.Lock()
+
+        # Outstanding reads keyed by (servo_id, address); servo_id 0 matches any servo
+        self.pending_reads: Dict[Tuple[int, int], List[Future]] = {}
+
+        # Last value seen per servo and register, fed by every response on the bus
+        self.register_cache: Dict[int, Dict[int, int]] = {}
+
+        # Identity registers written but not yet saved, per servo
+        self.pending_identity: Dict[int, Dict[int, int]] = {}
+
+        # When a read request was last sent per (servo_id, address), for coalescing
+        self.read_sent_at: Dict[Tuple[int, int], float] = {}
+
+        # Time from the latest request for a register to its response, for metrics
+        self.read_latency = Histogram()
+
+        self.can_interface.add_message_callback(self._on_message)
+
+    def close(self):
+        """Detach from the CAN interface and cancel outstanding reads"""
+        self.can_interface.remove_message_callback(self._on_message)
+        with self.lock:
+            pending = [f for futures in self.pending_reads.values() for f in futures]
+            self.pending_reads.clear()
+        for future in pending:
+            future.cancel()
+
+    def _on_message(self, msg: CANMessage):
+        """Resolve pending reads from a received response (runs in the receive thread)"""
+        frame = self.servo_protocol.observe_frame(msg.data)
+        if frame is None or frame['type'] not in RESPONSE_FRAME_TYPES:
+            return
+
+        servo_id = frame['servo_id']
+        self._resolve(servo_id, frame['address'], frame['value'])
+        if frame['address_b'] is not None:
+            self._resolve(servo_id, frame['address_b'], frame['value_b'])
+
+    def _resolve(self, servo_id: int, address: int, value: int):
+        """Store a register value and complete every read waiting for it"""
+        with self.lock:
+            self.register_cache.setdefault(servo_id, {})[address] = value
+            waiting = self.pending_reads.pop((servo_id, address), [])
+            waiting += self.pending_reads.pop((0, address), [])
+            sent_at = self.read_sent_at.get((servo_id, address)) if waiting else None
+
+        if sent_at is not None:
+            self.read_latency.observe(time.monotonic() - sent_at)
+
+        for future in waiting:
+            if not future.done():
+                future.set_result(value)
+
+    def _add_pending(self, servo_id: int, address: int) -> Future:
+        """Register a future for the next response to (servo_id, address)"""
+        future = Future()
+        with self.lock:
+            self.pending_reads.setdefault((servo_id, address), []).append(future)
+        return future
+
+    def _drop_pending(self, servo_id: int, address: int, future: Future):
+        """Forget a future that timed out or could not be sent"""
+        with self.lock:
+            waiting = self.pending_reads.get((servo_id, address))
+            if waiting and future in waiting:
+                waiting.remove(future)
+                if not waiting:
+                    del self.pending_reads[(servo_id, address)]
+
+    def request_reads(self, servo_id: int, addresses: Iterable[int],
+                      is_extended: Optional[bool] = None) -> Dict[int, Future]:
+        """
+        Send read requests without waiting for the responses
+
+        Registers are paired into dual reads when the servo speaks the new
+        packet format, halving the number of request frames.
+
+        Args:
+            servo_id: Target servo ID
+            addresses: Register addresses to read
+            is_extended: Override the client's CAN ID format for these requests
+
+        Returns:
+            Dictionary of address -> Future resolving to the register value
+        """
+        if is_extended is None:
+            is_extended = self.is_extended
+        addresses = list(dict.fromkeys(addresses))
+        futures = {address: self._add_pending(servo_id, address) for address in addresses}
+
+        if self.servo_protocol.get_servo_variant(servo_id) is ProtocolVariant.LEGACY:
+            groups = [(address,) for address in addresses]
+        else:
+            groups = [tuple(addresses[i:i + 2]) for i in range(0, len(addresses), 2)]
+
+        for group in groups:
+            if len(group) == 2:
+                arbitration_id, data = self.servo_protocol.create_read_dual_message(
+                    servo_id, group[0], group[1], is_extended)
+            else:
+                arbitration_id, data = self.servo_protocol.create_read_for_servo(
+                    servo_id, group[0], is_extended)
+
+            if not self.can_interface.send_message(arbitration_id, data, is_extended):
+                for address in group:
+                    self._drop_pending(servo_id, address, futures[address])
+                    futures[address].set_exception(IOError(f"Failed to send read for register 0x{address:02X}"))
+                continue
+
+            sent_at = time.monotonic()
+            for address in group:
+                self.read_sent_at[(servo_id, address)] = sent_at
+
+        return futures
+
+    def request_read(self, servo_id: int, address: int, is_extended: Optional[bool] = None,
+                     coalesce_window: float = 0.1) -> Future:
+        """
+        Send a read request for one register without waiting for the response
+
+        Callers asking for the same register while a request sent less than
+        coalesce_window ago is still unanswered share that request instead
+        of sending another frame, so many concurrent readers of one register
+        cost one frame and one response.
+
+        Args:
+            servo_id: Target servo ID
+            address: Register address
+            is_extended: Override the client's CAN ID format for the request
+            coalesce_window: Maximum age in seconds of an unanswered request to share
+
+        Returns:
+            Future resolving to the register value
+        """
+        key = (servo_id, address)
+        with self.lock:
+            if self.pending_reads.get(key) and time.monotonic() - self.read_sent_at.get(key, 0.0) < coalesce_window:
+                future = Future()
+                self.pending_reads[key].append(future)
+                return future
+        return self.request_reads(servo_id, [address], is_extended)[address]
+
+    def cancel_read(self, servo_id: int, address: int, future: Future):
+        """Stop waiting for a read requested with request_read, e.g. after a timeout"""
+        self._drop_pending(servo_id, address, future)
+        future.cancel()
+
+    def read_registers(self, servo_id: int, addresses: Iterable[int], timeout: float = 0.5,
+                       use_cache: bool = False) -> Dict[int, Optional[int]]:
+        """
+        Read registers, sending all requests before waiting for any response
+
+        Args:
+            servo_id: Target servo ID
+            addresses: Register addresses to read
+            timeout: Maximum time to wait for all responses in seconds
+            use_cache: Take values already seen on the bus instead of reading them
+
+        Returns:
+            Dictionary of address -> value (None if the servo did not answer)
+        """
+        return self.read_many({servo_id: addresses}, timeout=timeout, use_cache=use_cache)[servo_id]
+
+    def read_many(self, requests: Dict[int, Iterable[int]], timeout: float = 0.5,
+                  use_cache: bool = False, is_extended: Optional[bool] = None) -> Dict[int, Dict[int, Optional[int]]]:
+        """
+        Read registers from several servos in one pipelined burst
+
+        Args:
+            requests: Dictionary of servo_id -> register addresses
+            timeout: Maximum time to wait for all responses in seconds
+            use_cache: Take values already seen on the bus instead of reading them
+            is_extended: Override the client's CAN ID format for these requests
+
+        Returns:
+            Dictionary of servo_id -> {address: value or None}
+        """
+        results: Dict[int, Dict[int, Optional[int]]] = {}
+        futures: Dict[int, Dict[int, Future]] = {}
+
+        for servo_id, addresses in requests.items():
+            results[servo_id] = {}
+            to_read = []
+            for address in dict.fromkeys(addresses):
+                cached = self.get_cached_value(servo_id, address) if use_cache else None
+                if cached is not None:
+                    results[servo_id][address] = cached
+                else:
+                    to_read.append(address)
+            if to_read:
+                futures[servo_id] = self.request_reads(servo_id, to_read, is_extended)
+
+        wait([f for servo_futures in futures.values() for f in servo_futures.values()], timeout=timeout)
+
+        for servo_id, servo_futures in futures.items():
+            for address, future in servo_futures.items():
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    results[servo_id][address] = future.result()
+                else:
+                    self._drop_pending(servo_id, address, future)
+                    results[servo_id][address] = None
+
+        return results
+
+    def write_registers(self, servo_id: int, values: Dict[int, int], is_extended: Optional[bool] = None) -> int:
+        """
+        Write registers, packing pairs into dual writes where the servo supports them
+
+        Args:
+            servo_id: Target servo ID
+            values: Dictionary of address -> value
+            is_extended: Override the client's CAN ID format for these requests
+
+        Returns:
+            Number of frames sent (stops at the first send failure)
+        """
+        if is_extended is None:
+            is_extended = self.is_extended
+        items = list(values.items())
+        frames_sent = 0
+
+        if self.servo_protocol.get_servo_variant(servo_id) is ProtocolVariant.LEGACY:
+            groups = [[item] for item in items]
+        else:
+            groups = [items[i:i + 2] for i in range(0, len(items), 2)]
+
+        for group in groups:
+            if len(group) == 2:
+                (address_a, value_a), (address_b, value_b) = group
+                arbitration_id, data = self.servo_protocol.create_write_dual_message(
+                    servo_id, address_a, value_a, address_b, value_b, is_extended)
+            else:
+                address, value = group[0]
+                arbitration_id, data = self.servo_protocol.create_write_for_servo(
+                    servo_id, address, value, is_extended)
+
+            if not self.can_interface.send_message(arbitration_id, data, is_extended):
+                self.logger.error(f"Failed to write registers {[f'0x{a:02X}' for a, _ in group]} on servo {servo_id}")
+                return frames_sent
+
+            frames_sent += 1
+            with self.lock:
+                cache = self.register_cache.setdefault(servo_id, {})
+                for address, value in group:
+                    cache[address] = value
+                    if address in IDENTITY_REGISTERS:
+                        self.pending_identity.setdefault(servo_id, {})[address] = value
+
+        return frames_sent
+
+    @staticmethod
+    def _batch_group(operations: List[BatchOperation], start: int) -> List[int]:
+        """Positions of the operations from start on that can share frames with it"""
+        first = operations[start]
+        group = [start]
+        if first.kind not in (BATCH_READ, BATCH_WRITE):
+            return group
+
+        addresses = {first.address}
+        for position in range(start + 1, len(operations)):
+            operation = operations[position]
+            if (operation.kind != first.kind or operation.servo_id != first.servo_id or
+                    operation.is_extended != first.is_extended or operation.address in addresses):
+                break
+            group.append(position)
+            addresses.add(operation.address)
+        return group
+
+    def run_batch(self, operations: List[BatchOperation], timeout: float = 1.0,
+                  stop_on_error: bool = False) -> List[BatchResult]:
+        """
+        Execute operations in order without waiting between them
+
+        Each frame is sent as soon as the previous one is queued and read
+        responses are collected at the end, so a batch costs one response
+        timeout rather than a round trip per read. Consecutive reads or
+        writes of one servo are packed into dual frames. A read of a register
+        that is already being read in this batch first waits for the earlier
+        response, so every read reflects the operations before it.
+
+        Args:
+            operations: Operations in execution order
+            timeout: Maximum time to wait for read responses in seconds
+            stop_on_error: Skip the remaining operations after a send failure
+
+        Returns:
+            One BatchResult per operation, in the same order
+        """
+        deadline = time.monotonic() + timeout
+        results: List[Optional[BatchResult]] = [None] * len(operations)
+        reads: List[Tuple[int, Future, float]] = []
+        in_flight: Dict[Tuple[int, int], Future] = {}
+        resolved_at: Dict[int, float] = {}
+        failed = False
+
+        index = 0
+        while index < len(operations):
+            operation = operations[index]
+            group = self._batch_group(operations, index)
+            index = group[-1] + 1
+
+            if failed and stop_on_error:
+                for position in group:
+                    results[position] = BatchResult(position, operations[position].kind, False,
+                                                    "Skipped after an earlier failure")
+                continue
+
+            if operation.kind == BATCH_READ:
+                keys = [(operation.servo_id, operations[position].address) for position in group]
+                earlier = [in_flight[key] for key in keys if key in in_flight]
+                if earlier:
+                    wait(earlier, timeout=max(0.0, deadline - time.monotonic()))
+
+                futures = self.request_reads(operation.servo_id, [address for _, address in keys],
+                                             operation.is_extended)
+                sent_at = time.perf_counter()
+                for position, key in zip(group, keys):
+                    future = futures[key[1]]
+                    in_flight[key] = future
+                    future.add_done_callback(lambda _, position=position: resolved_at.setdefault(
+                        position, time.perf_counter()))
+                    reads.append((position, future, sent_at))
+                    if future.done() and future.exception() is not None:
+                        failed = True
+
+            elif operation.kind == BATCH_WRITE:
+                values = {operations[position].address: operations[position].value for position in group}
+                frames_sent = self.write_registers(operation.servo_id, values, operation.is_extended)
+                legacy = self.servo_protocol.get_servo_variant(operation.servo_id) is ProtocolVariant.LEGACY
+                per_frame = 1 if legacy else 2
+                for number, position in enumerate(group):
+                    sent = number // per_frame < frames_sent
+                    results[position] = BatchResult(position, BATCH_WRITE, sent, "Written" if sent else "Failed to send write")
+                    failed = failed or not sent
+
+            elif operation.kind == BATCH_SEND:
+                sent = self.can_interface.send_message(operation.arbitration_id, operation.data,
+                                                       bool(operation.is_extended))
+                results[index - 1] = BatchResult(index - 1, BATCH_SEND, sent, "Sent" if sent else "Failed to send")
+                failed = failed or not sent
+
+            else:
+                results[index - 1] = BatchResult(index - 1, operation.kind, False, f"Unknown operation '{operation.kind}'")
+                failed = True
+
+        wait([future for _, future, _ in reads], timeout=max(0.0, deadline - time.monotonic()))
+
+        for position, future, sent_at in reads:
+            operation = operations[position]
+            if future.done() and not future.cancelled() and future.exception() is None:
+                latency = resolved_at.get(position, time.perf_counter()) - sent_at
+                results[position] = BatchResult(position, BATCH_READ, True, "Read", future.result(), latency)
+            elif future.done() and not future.cancelled():
+                results[position] = BatchResult(position, BATCH_READ, False, str(future.exception()))
+            else:
+                self._drop_pending(operation.servo_id, operation.address, future)
+                results[position] = BatchResult(position, BATCH_READ, False, "No response within timeout")
+
+        return results
+
+    def save_and_reset(self, servo_id: int) -> bool:
+        """
+        Send a single SAVE_RESET command
+
+        Args:
+            servo_id: Target servo ID
+
+        Returns:
+            True if the frame was sent
+        """
+        arbitration_id, data = self.servo_protocol.create_write_for_servo(
+            servo_id, SAVE_RESET_ADDRESS, 0xFFFF, self.is_extended)
+        if not self.can_interface.send_message(arbitration_id, data, self.is_extended):
+            return False
+
+        # Values cached before the reset are no longer trustworthy
+        self.invalidate_cache(servo_id)
+        return True
+
+    def apply_profile(self, servo_id: int, target_registers: Dict[int, int], use_cache: bool = True,
+                      read_timeout: float = 0.5, verify_timeout: float = 2.0) -> ProfileResult:
+        """
+        Bring a servo to a register profile writing only what differs
+
+        Current values come from the cache where available and are otherwise
+        read in one pipelined burst. Registers already at target are skipped,
+        the rest are sent as dual writes followed by one SAVE_RESET and a
+        read-back of the changed registers.
+
+        Args:
+            servo_id: Target servo ID
+            target_registers: Dictionary of address -> desired value
+            use_cache: Trust register values already seen on the bus
+            read_timeout: Time to wait for the current values in seconds
+            verify_timeout: Time allowed for the servo to come back and verify in seconds
+
+        Returns:
+            ProfileResult describing what was changed
+        """
+        return self.apply_profiles({servo_id: target_registers}, use_cache=use_cache,
+                                   read_timeout=read_timeout, verify_timeout=verify_timeout)[servo_id]
+
+    def apply_profiles(self, profiles: Dict[int, Dict[int, int]], use_cache: bool = True,
+                       read_timeout: float = 0.5, verify_timeout: float = 2.0,
+                       progress: Optional[Callable[[int, str, str], None]] = None,
+                       settle_time: float = 0.05) -> Dict[int, ProfileResult]:
+        """
+        Apply register profiles to several servos on this bus
+
+        Each stage (read, write, save/reset, verify) is issued for every servo
+        before waiting on any of them, so the bus stays busy and the total time
+        is close to that of a single servo. Like save_reset_and_wait, the
+        read-back goes to the servo ID and CAN ID format the servo answers on
+        after the reset when the profile changes them.
+
+        Args:
+            profiles: Dictionary of servo_id -> {address: desired value}
+            use_cache: Trust register values already seen on the bus
+            read_timeout: Time to wait for the current values in seconds
+            verify_timeout: Time allowed for the servos to come back and verify in seconds
+            progress: Optional callback(servo_id, stage, message)
+            settle_time: Quiet time after the resets before the first read-back, so
+                a servo still answering from RAM is not taken as verified
+
+        Returns:
+            Dictionary of servo_id -> ProfileResult
+        """
+        start_time = time.perf_counter()
+
+        def report(servo_id: int, stage: str, message: str):
+            if progress:
+                try:
+                    progress(servo_id, stage, message)
+                except Exception as e:
+                    self.logger.error(f"Error in progress callback: {e}")
+
+        for servo_id, target_registers in profiles.items():
+            if SAVE_RESET_ADDRESS in target_registers:
+                raise ValueError(f"SAVE_RESET (0x70) cannot be part of the profile for servo {servo_id}")
+            report(servo_id, 'reading', f"Reading {len(target_registers)} register(s)")
+
+        current = self.read_many({servo_id: targets.keys() for servo_id, targets in profiles.items()},
+                                 timeout=read_timeout, use_cache=use_cache)
+
+        results: Dict[int, ProfileResult] = {}
+        to_verify: Dict[int, Dict[int, int]] = {}
+
+        for servo_id, target_registers in profiles.items():
+            # Registers that did not answer are written anyway
+            written = {address: value for address, value in target_registers.items()
+                       if current[servo_id].get(address) != value}
+            unchanged = {address: value for address, value in target_registers.items()
+                         if address not in written}
+            result = ProfileResult(servo_id=servo_id, success=True, message="",
+                                   written=written, unchanged=unchanged)
+            results[servo_id] = result
+
+            if not written:
+                result.message = "Servo already matches profile"
+                report(servo_id, 'done', result.message)
+                continue
+
+            report(servo_id, 'writing', f"Writing {len(written)} register(s)")
+            result.frames_sent = self.write_registers(servo_id, written)
+            if self.servo_protocol.get_servo_variant(servo_id) is ProtocolVariant.LEGACY:
+                expected_frames = len(written)
+            else:
+                expected_frames = (len(written) + 1) // 2
+            if result.frames_sent < expected_frames:
+                result.success = False
+                result.message = "Failed to send register writes"
+                report(servo_id, 'failed', result.message)
+                continue
+
+            to_verify[servo_id] = written
+
+        identities: Dict[int, Tuple[int, Optional[bool]]] = {}
+        for servo_id in to_verify:
+            report(servo_id, 'saving', "Sending SAVE_RESET")
+            with self.lock:
+                identity = self.pending_identity.pop(servo_id, {})
+            if self.save_and_reset(servo_id):
+                results[servo_id].frames_sent += 1
+                identities[servo_id] = self._identity_after_reset(servo_id, identity)
+            else:
+                results[servo_id].success = False
+                results[servo_id].message = "Failed to send SAVE_RESET"
+                report(servo_id, 'failed', results[servo_id].message)
+
+        to_verify = {servo_id: written for servo_id, written in to_verify.items() if results[servo_id].success}
+        for servo_id in to_verify:
+            new_servo_id = identities[servo_id][0]
+            report(servo_id, 'verifying', "Waiting for servo to answer and reading back changed registers" +
+                   (f" as servo {new_servo_id}" if new_servo_id != servo_id else ""))
+
+        verify_start = time.perf_counter()
+        if to_verify and settle_time > 0:
+            time.sleep(min(settle_time, verify_timeout))
+
+        # One read-back per CAN ID format; servos are addressed by the ID they answer on after the reset
+        mismatches: Dict[int, Dict[int, Tuple[int, Optional[int]]]] = {}
+        for is_extended in sorted({identity[1] for identity in identities.values()}, key=str):
+            group = {servo_id: written for servo_id, written in to_verify.items()
+                     if identities[servo_id][1] == is_extended}
+            if not group:
+                continue
+            remaining = max(0.0, verify_timeout - (time.perf_counter() - verify_start))
+            by_new_id = self._verify({identities[servo_id][0]: written for servo_id, written in group.items()},
+                                     remaining, is_extended)
+            for servo_id in group:
+                mismatches[servo_id] = by_new_id[identities[servo_id][0]]
+
+        for servo_id, mismatched in mismatches.items():
+            result = results[servo_id]
+            result.mismatched = mismatched
+            result.success = not mismatched
+            result.message = (f"Wrote {len(result.written)} register(s), {len(result.unchanged)} unchanged"
+                              if result.success else f"Verification failed for {len(mismatched)} register(s)")
+            report(servo_id, 'done' if result.success else 'failed', result.message)
+
+        duration = time.perf_counter() - start_time
+        for result in results.values():
+            result.duration = duration
+        return results
+
+    def _verify(self, expected: Dict[int, Dict[int, int]], timeout: float,
+                is_extended: Optional[bool] = None) -> Dict[int, Dict[int, Tuple[int, Optional[int]]]]:
+        """Read back registers of several servos until they match or the timeout expires"""
+        actual, _, _ = self._poll(expected, timeout, is_extended=is_extended)
+        return {servo_id: {address: (value, actual[servo_id][address]) for address, value in registers.items()
+                           if actual[servo_id][address] != value}
+                for servo_id, registers in expected.items()}
+
+    def _poll(self, expected: Dict[int, Dict[int, Optional[int]]], timeout: float,
+              is_extended: Optional[bool] = None, initial_interval: float = 0.02,
+              max_interval: float = 0.25) -> Tuple[Dict[int, Dict[int, Optional[int]]], int, float]:
+        """
+        Poll registers with adaptive backoff until every one holds its expected value
+
+        Each attempt only re-reads registers that are still missing or wrong and
+        waits one interval for the answers. The interval starts short so a servo
+        that is already up answers on the first attempt, and grows by half each
+        time up to max_interval so a rebooting servo is not flooded.
+
+        Args:
+            expected: Dictionary of servo_id -> {address: value}, None meaning any answer
+            timeout: Maximum total time in seconds
+            is_extended: Override the client's CAN ID format for the probes
+            initial_interval: First per-attempt wait in seconds
+            max_interval: Largest per-attempt wait in seconds
+
+        Returns:
+            Tuple of (last values read per servo, attempts, elapsed seconds)
+        """
+        start_time = time.perf_counter()
+        deadline = start_time + timeout
+        actual = {servo_id: {address: None for address in registers} for servo_id, registers in expected.items()}
+        interval = initial_interval
+        attempts = 0
+
+        while True:
+            missing = {}
+            for servo_id, registers in expected.items():
+                addresses = [address for address, value in registers.items()
+                             if actual[servo_id][address] is None
+                             or (value is not None and actual[servo_id][address] != value)]
+                if addresses:
+                    missing[servo_id] = addresses
+            if not missing:
+                break
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            attempts += 1
+            for servo_id, values in self.read_many(missing, timeout=min(interval, remaining),
+                                                   is_extended=is_extended).items():
+                for address, value in values.items():
+                    if value is not None:
+                        actual[servo_id][address] = value
+            interval = min(interval * 1.5, max_interval)
+
+        return actual, attempts, time.perf_counter() - start_time
+
+    def wait_until_ready(self, servo_id: int, expected: Optional[Dict[int, int]] = None, timeout: float = 3.0,
+                         is_extended: Optional[bool] = None, settle_time: float = 0.05) -> ReadinessResult:
+        """
+        Wait for a servo to answer under its (possibly new) identity
+
+        Polls SERVO_ID plus any expected registers (e.g. new CAN ID or CAN mode)
+        and returns as soon as they all answer with the expected values.
+
+        Args:
+            servo_id: Servo ID the node should answer as
+            expected: Dictionary of address -> value that must be read back
+            timeout: Maximum time to wait in seconds
+            is_extended: CAN ID format to probe with (e.g. after switching CAN mode)
+            settle_time: Quiet time before the first probe so a servo that is about
+                to reset is not mistaken for one that already came back
+
+        Returns:
+            ReadinessResult with the time it took
+        """
+        probe = {SERVO_ID_ADDRESS: None}
+        probe.update(expected or {})
+
+        start_time = time.perf_counter()
+        if settle_time > 0:
+            time.sleep(min(settle_time, timeout))
+        remaining = max(0.0, timeout - (time.perf_counter() - start_time))
+
+        actual, attempts, _ = self._poll({servo_id: probe}, remaining, is_extended=is_extended)
+        values = actual[servo_id]
+        elapsed = time.perf_counter() - start_time
+
+        answered = [address for address, value in values.items() if value is not None]
+        mismatched = [address for address, value in (expected or {}).items() if values.get(address) != value]
+
+        if answered and not mismatched and len(answered) == len(probe):
+            message = f"Servo {servo_id} ready after {elapsed * 1000:.0f} ms"
+            ready = True
+        elif not answered:
+            message = f"Servo {servo_id} did not answer within {timeout:.1f} s"
+            ready = False
+        else:
+            details = ', '.join(f"0x{a:02X}={values.get(a)} (expected {expected[a]})" for a in mismatched)
+            message = f"Servo {servo_id} answered but identity does not match: {details or 'incomplete answer'}"
+            ready = False
+
+        self.logger.info(message)
+        return ReadinessResult(servo_id=servo_id, ready=ready, message=message,
+                               elapsed=elapsed, attempts=attempts, values=values)
+
+    def note_identity_write(self, servo_id: int, address: int, value: int):
+        """Remember an identity register written outside the client until the next save/reset"""
+        if address in IDENTITY_REGISTERS:
+            with self.lock:
+                self.pending_identity.setdefault(servo_id, {})[address] = value
+
+    def save_reset_and_wait(self, servo_id: int, timeout: float = 3.0) -> ReadinessResult:
+        """
+        Send SAVE_RESET and wait until the servo answers under its new identity
+
+        Identity changes written before the save (SERVO_ID, CAN ID, CAN mode)
+        decide which servo ID, CAN ID format and values are probed.
+
+        Args:
+            servo_id: Servo ID before the reset
+            timeout: Maximum time to wait in seconds
+
+        Returns:
+            ReadinessResult for the servo's new identity
+        """
+        with self.lock:
+            identity = self.pending_identity.pop(servo_id, {})
+
+        if not self.save_and_reset(servo_id):
+            return ReadinessResult(servo_id=servo_id, ready=False, message="Failed to send SAVE_RESET")
+
+        new_servo_id, is_extended = self._identity_after_reset(servo_id, identity)
+        return self.wait_until_ready(new_servo_id, expected=identity, timeout=timeout, is_extended=is_extended)
+
+    @staticmethod
+    def _identity_after_reset(servo_id: int, identity: Dict[int, int]) -> Tuple[int, Optional[bool]]:
+        """
+        Servo ID and CAN ID format a servo answers on once saved identity writes take effect
+
+        Args:
+            servo_id: Servo ID before the reset
+            identity: Identity registers written since the last save (see pending_identity)
+
+        Returns:
+            Tuple of (servo ID, True/False for extended/standard IDs or None if unchanged)
+        """
+        new_servo_id = identity.get(SERVO_ID_ADDRESS, servo_id) or servo_id
+        is_extended = None
+        if CAN_MODE_ADDRESS in identity:
+            is_extended = identity[CAN_MODE_ADDRESS] == 1
+        return new_servo_id, is_extended
+
+    def get_cached_value(self, servo_id: int, address: int) -> Optional[int]:
+        """Get the last value seen for a register, or None"""
+        with self.lock:
+            return self.register_cache.get(servo_id, {}).get(address)
+
+    def invalidate_cache(self, servo_id: Optional[int] = None):
+        """Forget cached register values for one servo or all servos"""
+        with self.lock:
+            if servo_id is None:
+                self.register_cache.clear()
+            else:
+                self.register_cache.pop(servo_id, None)
@@ -9,6 +9,8 @@ from typing import Dict, List, Optional, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum
 
+from utils import calculate_checksum
+
 class MessageType(Enum):
     """CAN message types for servo protocol"""
     WRITE_SINGLE = ord('w')      # 0x77 - Write single register
@@ -20,6 +22,104 @@ class MessageType(Enum):
     RESPONSE_SINGLE = ord('v')   # 0x76 - Single register response
     RESPONSE_DUAL = ord('V')     # 0x56 - Dual register response
 
+# OLD normal packet format headers (manual section 1-5)
+LEGACY_REQUEST_HEADER = 0x96     # Controller -> servo, write (REG length 2) or read (REG length 0)
+LEGACY_RETURN_HEADER = 0x69      # Servo -> controller, read response (REG length 2)
+
+class ProtocolVariant(Enum):
+    """Packet format spoken by a servo node"""
+    CUSTOM = "custom"    # New packet format ('w', 'r', 'v', ... message IDs)
+    LEGACY = "legacy"    # OLD normal packet format (0x96/0x69 header with checksum)
+
+# Frame layouts keyed by first data byte: (frame type, minimum length, field layout)
+FRAME_LAYOUTS = {
+    MessageType.WRITE_SINGLE.value: ('write_single', 5, 'value'),
+    MessageType.WRITE_SINGLE_READ.value: ('write_single_read', 5, 'value'),
+    MessageType.WRITE_DUAL.value: ('write_dual', 8, 'value_dual'),
+    MessageType.WRITE_DUAL_READ.value: ('write_dual_read', 8, 'value_dual'),
+    MessageType.READ_SINGLE.value: ('read_single', 3, 'address'),
+    MessageType.READ_DUAL.value: ('read_dual', 4, 'address_dual'),
+    MessageType.RESPONSE_SINGLE.value: ('single_response', 5, 'value'),
+    MessageType.RESPONSE_DUAL.value: ('dual_response', 8, 'value_dual'),
+    LEGACY_REQUEST_HEADER: ('legacy_request', 5, 'legacy'),
+    LEGACY_RETURN_HEADER: ('legacy_response', 7, 'legacy'),
+}
+
+# Frame types sent by a servo; these tell us which packet format the node speaks
+RESPONSE_FRAME_TYPES = ('single_response', 'dual_response', 'legacy_response')
+
+def decode_frame(data: bytes) -> Optional[Dict]:
+    """
+    Decode any servo protocol frame (request, response or old format packet)
+    
+    This is the shared decoder used by the GUIs, the web monitor and the
+    capture tools, so it avoids struct and exceptions on the hot path.
+    Old format packets are only accepted when their checksum matches,
+    mirroring the servo which silently drops packets with a bad checksum.
+    
+    Args:
+        data: Message data bytes
+        
+    Returns:
+        Dictionary with 'type', 'opcode', 'servo_id', 'address', 'value',
+        'address_b' and 'value_b' (unused fields are None), or None if the
+        frame is not a valid servo protocol frame
+    """
+    length = len(data)
+    if length < 3:
+        return None
+    
+    opcode = data[0]
+    layout = FRAME_LAYOUTS.get(opcode)
+    if layout is None or length < layout[1]:
+        return None
+    
+    frame_type, _, fields = layout
+    value = address_b = value_b = None
+    
+    if fields == 'value':
+        value = data[3] | (data[4] << 8)
+    elif fields == 'value_dual':
+        value = data[3] | (data[4] << 8)
+        address_b = data[5]
+        value_b = data[6] | (data[7] << 8)
+    elif fields == 'address_dual':
+        address_b = data[3]
+    elif fields == 'legacy':
+        reg_length = data[3]
+        if reg_length == 2:
+            end = 7
+            if length < end:
+                return None
+            value = data[4] | (data[5] << 8)
+            if opcode == LEGACY_REQUEST_HEADER:
+                frame_type = 'legacy_write'
+        elif reg_length == 0 and opcode == LEGACY_REQUEST_HEADER:
+            end = 5
+            frame_type = 'legacy_read'
+        else:
+            return None
+        
+        # Checksum covers every byte except the header
+        if calculate_checksum(data[1:end - 1]) != data[end - 1]:
+            return None
+    
+    return {
+        'type': frame_type,
+        'opcode': opcode,
+        'servo_id': data[1],
+        'address': data[2],
+        'value': value,
+        'address_b': address_b,
+        'value_b': value_b
+    }
+
+def frame_variant(opcode: int) -> ProtocolVariant:
+    """Get the packet format a frame belongs to from its first data byte"""
+    if opcode == LEGACY_REQUEST_HEADER or opcode == LEGACY_RETURN_HEADER:
+        return ProtocolVariant.LEGACY
+    return ProtocolVariant.CUSTOM
+
 @dataclass
 class ServoRegister:
     """Servo register definition"""
@@ -53,6 +153,9 @@ class ServoProtocol:
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        
+        # Packet format detected per servo ID from observed responses
+        self.servo_variants: Dict[int, ProtocolVariant] = {}
     
     def create_write_message(self, servo_id: int, address: int, value: int, 
                            is_extended: bool = False) -> Tuple[int, bytes]:
@@ -95,7 +198,7 @@ class ServoProtocol:
         Returns:
             Tuple of (arbitration_id, message_data)
         """
-        data = struct.pack('<BBBBBBB',
+        data = struct.pack('<BBBBBBBB',
                           MessageType.WRITE_DUAL.value,
                           servo_id,
                           address_a,
@@ -275,45 +378,37 @@ class ServoProtocol:
             Dictionary with parsed data or None if invalid
         """
         try:
-            if len(data) < 3:
+            frame = decode_frame(data)
+            if frame is None:
                 return None
             
-            message_type = data[0]
-            servo_id = data[1]
+            frame_type = frame['type']
+            servo_id = frame['servo_id']
             
-            if message_type == MessageType.RESPONSE_SINGLE.value:
-                if len(data) < 5:
-                    return None
-                
-                address = data[2]
-                value = struct.unpack('<H', data[3:5])[0]
+            if frame_type == 'single_response' or frame_type == 'legacy_response':
+                address = frame['address']
                 
                 return {
-                    'type': 'single_response',
+                    'type': frame_type,
                     'servo_id': servo_id,
                     'address': address,
-                    'value': value,
-                    'register_name': self.REGISTERS.get(address, ServoRegister(address, f"ADDR_{address:02X}", "Unknown")).name
+                    'value': frame['value'],
+                    'register_name': self.get_register_info(address).name
                 }
             
-            elif message_type == MessageType.RESPONSE_DUAL.value:
-                if len(data) < 8:
-                    return None
-                
-                address_a = data[2]
-                value_a = struct.unpack('<H', data[3:5])[0]
-                address_b = data[5]
-                value_b = struct.unpack('<H', data[6:8])[0]
+            elif frame_type == 'dual_response':
+                address_a = frame['address']
+                address_b = frame['address_b']
                 
                 return {
                     'type': 'dual_response',
                     'servo_id': servo_id,
                     'address_a': address_a,
-                    'value_a': value_a,
+                    'value_a': frame['value'],
                     'address_b': address_b,
-                    'value_b': value_b,
-                    'register_name_a': self.REGISTERS.get(address_a, ServoRegister(address_a, f"ADDR_{address_a:02X}", "Unknown")).name,
-                    'register_name_b': self.REGISTERS.get(address_b, ServoRegister(address_b, f"ADDR_{address_b:02X}", "Unknown")).name
+                    'value_b': frame['value_b'],
+                    'register_name_a': self.get_register_info(address_a).name,
+                    'register_name_b': self.get_register_info(address_b).name
                 }
             
             return None
@@ -322,6 +417,74 @@ class ServoProtocol:
             self.logger.error(f"Error parsing response message: {e}")
             return None
     
+    def observe_frame(self, data: bytes) -> Optional[Dict]:
+        """
+        Decode a received frame and remember which packet format its servo uses
+        
+        Only responses are used for detection, so no probe frames are ever sent.
+        
+        Args:
+            data: Message data bytes
+            
+        Returns:
+            Decoded frame (see decode_frame) or None if invalid
+        """
+        frame = decode_frame(data)
+        if frame is not None and frame['type'] in RESPONSE_FRAME_TYPES:
+            servo_id = frame['servo_id']
+            variant = frame_variant(frame['opcode'])
+            if servo_id != 0 and self.servo_variants.get(servo_id) is not variant:
+                self.servo_variants[servo_id] = variant
+                self.logger.info(f"Servo {servo_id} detected as {variant.value} packet format")
+        return frame
+    
+    def get_servo_variant(self, servo_id: int) -> ProtocolVariant:
+        """Get the packet format used by a servo (new format until detected otherwise)"""
+        return self.servo_variants.get(servo_id, ProtocolVariant.CUSTOM)
+    
+    def set_servo_variant(self, servo_id: int, variant: ProtocolVariant):
+        """Force the packet format used for a servo"""
+        self.servo_variants[servo_id] = variant
+    
+    def clear_servo_variants(self):
+        """Forget all detected packet formats"""
+        self.servo_variants.clear()
+    
+    def create_read_for_servo(self, servo_id: int, address: int,
+                              is_extended: bool = False) -> Tuple[int, bytes]:
+        """
+        Create a read request in the packet format detected for the servo
+        
+        Args:
+            servo_id: Target servo ID
+            address: Register address to read
+            is_extended: Use extended CAN ID format
+            
+        Returns:
+            Tuple of (arbitration_id, message_data)
+        """
+        if self.get_servo_variant(servo_id) is ProtocolVariant.LEGACY:
+            return self.create_old_format_read(servo_id, address)
+        return self.create_read_message(servo_id, address, is_extended)
+    
+    def create_write_for_servo(self, servo_id: int, address: int, value: int,
+                               is_extended: bool = False) -> Tuple[int, bytes]:
+        """
+        Create a write message in the packet format detected for the servo
+        
+        Args:
+            servo_id: Target servo ID
+            address: Register address
+            value: Value to write (16-bit)
+            is_extended: Use extended CAN ID format
+            
+        Returns:
+            Tuple of (arbitration_id, message_data)
+        """
+        if self.get_servo_variant(servo_id) is ProtocolVariant.LEGACY:
+            return self.create_old_format_write(servo_id, address, value)
+        return self.create_write_message(servo_id, address, value, is_extended)
+    
     def create_old_format_write(self, servo_id: int, address: int, value: int) -> Tuple[int, bytes]:
         """
         Create write message using old packet format (for compatibility)
@@ -337,10 +500,10 @@ class ServoProtocol:
         # Old format: Header(0x96), ID, Address, REG Length(0x02), Data Low, Data High, Checksum
         data_low = value & 0xFF
         data_high = (value >> 8) & 0xFF
-        checksum = (servo_id + address + 0x02 + data_low + data_high) & 0xFF
+        checksum = calculate_checksum((servo_id, address, 0x02, data_low, data_high))
         
         data = struct.pack('<BBBBBBB',
-                          0x96,        # Write header
+                          LEGACY_REQUEST_HEADER,  # Write header
                           servo_id,    # Servo ID
                           address,     # Register address
                           0x02,        # REG length
@@ -362,10 +525,10 @@ class ServoProtocol:
             Tuple of (arbitration_id, message_data)
         """
         # Old format: Header(0x96), ID, Address, REG Length(0x00), Checksum
-        checksum = (servo_id + address + 0x00) & 0xFF
+        checksum = calculate_checksum((servo_id, address, 0x00))
         
         data = struct.pack('<BBBBB',
-                          0x96,        # Read header
+                          LEGACY_REQUEST_HEADER,  # Read header
                           servo_id,    # Servo ID
                           address,     # Register address
                           0x00,        # REG length (0 for read)
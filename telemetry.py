@@ -0,0 +1,258 @@
+"""
+Live register telemetry for the web interface
+Keeps decimated time series of the register values servos report and are sent, per servo and register
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from servo_protocol import RESPONSE_FRAME_TYPES, ServoProtocol
+
+# Value sources (same names as position_series)
+KIND_RESPONSE = 'response'      # Value read back from the servo
+KIND_COMMAND = 'command'        # Value written to the servo
+
+# Most series one client may plot at once
+MAX_PLOTTED_SERIES = 32
+
+SeriesKey = Tuple[int, int, str]
+
+def frame_kind(frame: Dict[str, Any]) -> Optional[str]:
+    """Value source of a decoded frame (see servo_protocol.decode_frame), None if it carries no value"""
+    if frame['value'] is None:
+        return None
+    return KIND_RESPONSE if frame['type'] in RESPONSE_FRAME_TYPES else KIND_COMMAND
+
+def parse_series(values: Iterable[str]) -> FrozenSet[Tuple[int, int]]:
+    """
+    Parse plot selections of the form servo:register, e.g. "1:0x0C"
+
+    Args:
+        values: Selections, each possibly comma-separated
+
+    Returns:
+        Set of (servo_id, address)
+
+    Raises:
+        ValueError: If a selection is malformed or too many are given
+    """
+    selected = set()
+    for value in values:
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            servo, separator, register = item.partition(':')
+            if not separator:
+                raise ValueError(f"Invalid series '{item}' (expected servo:register, e.g. 1:0x0C)")
+            try:
+                key = (int(servo, 0), int(register, 16))
+            except ValueError:
+                raise ValueError(f"Invalid series '{item}' (expected servo:register, e.g. 1:0x0C)")
+            if not (0 <= key[0] <= 0xFF and 0 <= key[1] <= 0xFF):
+                raise ValueError(f"Series '{item}' out of range")
+            selected.add(key)
+    if len(selected) > MAX_PLOTTED_SERIES:
+        raise ValueError(f"Too many series ({len(selected)}, maximum {MAX_PLOTTED_SERIES})")
+    return frozenset(selected)
+
+def touches_series(message: Dict[str, Any], selected: FrozenSet[Tuple[int, int]]) -> bool:
+    """Check whether a formatted message (see web_app.format_message) carries a selected register"""
+    servo_id = message.get('servo_id')
+    return any((servo_id, address) in selected for address in message.get('registers', ()))
+
+class TelemetrySeries:
+    """
+    Decimated values of one register of one servo
+
+    Values are collected in buckets of a fixed width and each closed
+    bucket contributes its minimum and maximum, in time order, so peaks
+    survive however fast the register is polled. Points are numbered with
+    the store's version counter so clients can ask for the ones they have
+    not seen.
+    """
+
+    def __init__(self, servo_id: int, address: int, kind: str, depth: int):
+        self.servo_id = servo_id
+        self.address = address
+        self.kind = kind
+        self.points: deque = deque(maxlen=depth)     # (version, timestamp, value)
+        self.bucket: Optional[int] = None              # Index of the open bucket (timestamp // resolution)
+        self.bucket_min: Optional[Tuple[float, int]] = None
+        self.bucket_max: Optional[Tuple[float, int]] = None
+        self.bucket_opened = 0.0                       # time.monotonic() of the bucket's first value
+        self.last: Optional[Tuple[float, int]] = None
+
+    @property
+    def name(self) -> str:
+        register = ServoProtocol.REGISTERS.get(self.address)
+        return register.name if register else f"0x{self.address:02X}"
+
+    def add(self, timestamp: float, value: int, resolution: float, version: int) -> int:
+        """
+        Add a value, closing the current bucket if the value falls after it
+
+        Returns:
+            The store version after any points were added
+        """
+        bucket = int(timestamp // resolution)
+        if self.bucket is not None and bucket != self.bucket:
+            version = self.close_bucket(version)
+        if self.bucket is None:
+            self.bucket = bucket
+            self.bucket_min = self.bucket_max = (timestamp, value)
+            self.bucket_opened = time.monotonic()
+        elif value < self.bucket_min[1]:
+            self.bucket_min = (timestamp, value)
+        elif value > self.bucket_max[1]:
+            self.bucket_max = (timestamp, value)
+        self.last = (timestamp, value)
+        return version
+
+    def close_bucket(self, version: int) -> int:
+        """Turn the open bucket into points; returns the store version after them"""
+        if self.bucket is None:
+            return version
+        low, high = sorted((self.bucket_min, self.bucket_max))
+        for timestamp, value in ((low,) if low == high else (low, high)):
+            version += 1
+            self.points.append((version, timestamp, value))
+        self.bucket = self.bucket_min = self.bucket_max = None
+        return version
+
+    def since(self, version: int) -> List[Tuple[int, float, int]]:
+        """Points numbered after version, oldest first"""
+        newer = []
+        for point in reversed(self.points):
+            if point[0] <= version:
+                break
+            newer.append(point)
+        newer.reverse()
+        return newer
+
+    def get_info(self) -> Dict[str, Any]:
+        """Summary for the series list"""
+        return {
+            'servo_id': self.servo_id,
+            'address': f"0x{self.address:02X}",
+            'name': self.name,
+            'kind': self.kind,
+            'points': len(self.points),
+            'last_value': self.last[1] if self.last else None
+        }
+
+class TelemetryStore:
+    """
+    Register time series of every servo on one bus
+
+    observe() runs on the CAN receive and transmit paths and costs a dict
+    lookup and a comparison per value. Clients remember the version of the
+    last update they got and ask for newer points only. A bucket that stops
+    receiving values is closed once it has been open for one resolution of
+    wall-clock time, so the last values before a servo stops show up.
+    """
+
+    def __init__(self, resolution: float = 0.02, depth: int = 3000):
+        """
+        Initialize store
+
+        Args:
+            resolution: Bucket width in seconds; at most two points are kept per bucket
+            depth: Points kept per series
+        """
+        self.resolution = resolution
+        self.depth = depth
+        self.series: Dict[SeriesKey, TelemetrySeries] = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def observe(self, frame: Optional[Dict[str, Any]], timestamp: float):
+        """
+        Record the register values of a decoded frame
+
+        Args:
+            frame: Decoded frame (see servo_protocol.decode_frame), ignored if None
+            timestamp: Receive or send time in seconds
+        """
+        if frame is None:
+            return
+        kind = frame_kind(frame)
+        if kind is None:
+            return
+        with self.lock:
+            self._add(frame['servo_id'], frame['address'], kind, timestamp, frame['value'])
+            if frame['value_b'] is not None:
+                self._add(frame['servo_id'], frame['address_b'], kind, timestamp, frame['value_b'])
+
+    def _add(self, servo_id: int, address: int, kind: str, timestamp: float, value: int):
+        key = (servo_id, address, kind)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = TelemetrySeries(servo_id, address, kind, self.depth)
+        self.version = series.add(timestamp, value, self.resolution, self.version)
+
+    def changes(self, since_version: int, selected: FrozenSet[Tuple[int, int]]
+                ) -> Tuple[List[Tuple[TelemetrySeries, List[Tuple[int, float, int]]]], int, bool]:
+        """
+        Points of the selected registers added after since_version
+
+        Args:
+            since_version: Version of the previous update, 0 for everything kept
+            selected: (servo_id, address) pairs; both sources of each are returned
+
+        Returns:
+            Tuple of ([(series, points)], current version, True if a selected
+            series still has an open bucket whose points are not out yet)
+        """
+        now = time.monotonic()
+        updates = []
+        pending = False
+        with self.lock:
+            for key, series in self.series.items():
+                if key[:2] not in selected:
+                    continue
+                if series.bucket is not None:
+                    if now - series.bucket_opened >= self.resolution:
+                        self.version = series.close_bucket(self.version)
+                    else:
+                        pending = True
+                points = series.since(since_version)
+                if points:
+                    updates.append((series, points))
+            return updates, self.version, pending
+
+    def get_series(self) -> List[Dict[str, Any]]:
+        """Summaries of every series, by servo and register"""
+        with self.lock:
+            return [self.series[key].get_info() for key in sorted(self.series)]
+
+    def clear(self):
+        """Forget all series"""
+        with self.lock:
+            self.series = {}
+
+def encode_telemetry(updates: List[Tuple[TelemetrySeries, List[Tuple[int, float, int]]]]) -> Dict[str, Any]:
+    """
+    Render telemetry points compactly
+
+    Args:
+        updates: Series and their new points, from TelemetryStore.changes
+
+    Returns:
+        {"epoch": <seconds>, "series": [{"servo_id", "address", "name",
+        "kind", "t": [microseconds after epoch], "v": [values]}]}
+    """
+    epoch = min((points[0][1] for _, points in updates), default=0.0)
+    return {
+        'epoch': epoch,
+        'series': [{
+            'servo_id': series.servo_id,
+            'address': f"0x{series.address:02X}",
+            'name': series.name,
+            'kind': series.kind,
+            't': [round((timestamp - epoch) * 1e6) for _, timestamp, _ in points],
+            'v': [value for _, _, value in points]
+        } for series, points in updates]
+    }
@@ -0,0 +1,122 @@
+"""
+Shared fixtures: a connected virtual CAN interface and simulated servos on the same bus
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+
+import can
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from can_interface import CANInterface, CANMessage
+from capture import CaptureRecorder
+
+SERVO_ID_ADDRESS = 0x32
+SAVE_RESET_ADDRESS = 0x70
+
+_channels = itertools.count()
+
+class FakeServo(threading.Thread):
+    """
+    Servo answering the new packet format on a virtual bus
+
+    Writes change RAM only; SAVE_RESET copies RAM to the saved registers
+    (except the volatile ones), stays silent for reset_delay and comes back
+    with the saved values, including a changed servo ID.
+    """
+
+    def __init__(self, channel: str, servo_id: int, registers=None, volatile=(), reset_delay: float = 0.1):
+        super().__init__(daemon=True)
+        self.bus = can.Bus(interface='virtual', channel=channel, receive_own_messages=False)
+        self.servo_id = servo_id
+        self.saved = {SERVO_ID_ADDRESS: servo_id, 0x6A: 0, **(registers or {})}
+        self.ram = dict(self.saved)
+        self.volatile = set(volatile)
+        self.reset_delay = reset_delay
+        self.down_until = 0.0
+        self.resets = 0
+        self.stopped = threading.Event()
+
+    def _reply(self, data: bytes):
+        self.bus.send(can.Message(arbitration_id=0, data=data, is_extended_id=False))
+
+    def _reset(self):
+        self.saved.update({address: value for address, value in self.ram.items() if address not in self.volatile})
+        self.ram = dict(self.saved)
+        self.servo_id = self.saved[SERVO_ID_ADDRESS]
+        self.down_until = time.monotonic() + self.reset_delay
+        self.resets += 1
+
+    def run(self):
+        while not self.stopped.is_set():
+            message = self.bus.recv(0.02)
+            if message is None or time.monotonic() < self.down_until:
+                continue
+            data = bytes(message.data)
+            opcode, servo_id = data[0], data[1]
+            if servo_id not in (0, self.servo_id):
+                continue
+            registers = self.ram
+            if opcode == 0x77:
+                if data[2] == SAVE_RESET_ADDRESS:
+                    self._reset()
+                else:
+                    registers[data[2]] = data[3] | data[4] << 8
+            elif opcode == 0x57:
+                registers[data[2]] = data[3] | data[4] << 8
+                registers[data[5]] = data[6] | data[7] << 8
+            elif opcode == 0x72:
+                value = registers.get(data[2], 0)
+                self._reply(bytes([0x76, self.servo_id, data[2], value & 0xFF, value >> 8]))
+            elif opcode == 0x52:
+                a, b = registers.get(data[2], 0), registers.get(data[3], 0)
+                self._reply(bytes([0x56, self.servo_id, data[2], a & 0xFF, a >> 8, data[3], b & 0xFF, b >> 8]))
+
+    def close(self):
+        self.stopped.set()
+        self.join(1.0)
+        self.bus.shutdown()
+
+@pytest.fixture
+def channel():
+    return f"test-{next(_channels)}"
+
+@pytest.fixture
+def can_interface(channel):
+    interface = CANInterface(channel, interface='virtual')
+    assert interface.connect()
+    yield interface
+    interface.disconnect()
+
+@pytest.fixture
+def make_servo(channel):
+    servos = []
+
+    def make(servo_id: int, **kwargs) -> FakeServo:
+        servo = FakeServo(channel, servo_id, **kwargs)
+        servo.start()
+        servos.append(servo)
+        return servo
+
+    yield make
+    for servo in servos:
+        servo.close()
+
+@pytest.fixture
+def write_capture(tmp_path):
+    """Write (timestamp, data, is_tx) frames to a capture file and return its path"""
+    def write(name, frames):
+        filename = str(tmp_path / name)
+        recorder = CaptureRecorder(filename)
+        assert recorder.start()
+        for timestamp, data, is_tx in frames:
+            recorder.record(CANMessage(0, bytes(data), False, timestamp), is_tx)
+        recorder.stop()
+        return filename
+
+    return write
@@ -0,0 +1,50 @@
+"""Tests for CANInterface metric counters"""
+
+import threading
+
+import can
+
+from bus_sessions import BusSession
+from can_interface import FRAME_OVERHEAD_BITS, CANMessage
+from metrics import MetricsRegistry
+
+def test_counters_are_not_lost_across_threads(can_interface, channel):
+    receiver = can.Bus(interface='virtual', channel=channel)
+    threads, per_thread = 4, 2000
+
+    def send():
+        for i in range(per_thread):
+            can_interface.send_message(0x100, bytes([i & 0xFF]))
+
+    def inject():
+        for i in range(per_thread):
+            can_interface.inject_message(CANMessage(0x200, bytes([i & 0xFF]), False, 0.0))
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    workers += [threading.Thread(target=inject) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    receiver.shutdown()
+
+    counters = can_interface.get_counters()
+    assert counters['tx_frames'] == threads * per_thread
+    assert counters['rx_frames'] == threads * per_thread
+    assert counters['tx_bits'] == threads * per_thread * (FRAME_OVERHEAD_BITS[False] + 8)
+
+def test_callback_only_session_reports_no_receive_queue_drops():
+    session = BusSession('bench', channel='vcan-metrics')
+    history = []
+    session.can_interface.add_message_callback(history.append)
+    for i in range(1500):
+        session.can_interface.inject_message(CANMessage(0x100, bytes([i & 0xFF]), False, 0.0))
+
+    registry = MetricsRegistry()
+    for collector in session.collectors:
+        registry.add_collector(collector)
+    text = registry.render()
+
+    assert len(history) == 1500
+    assert session.can_interface.get_counters()['rx_queue_dropped'] == 0
+    assert 'queue="receive"' not in text
@@ -0,0 +1,29 @@
+"""Tests for the capture recorder"""
+
+import time
+
+from can_interface import CANMessage
+from capture import HEADER_SIZE, RECORD_SIZE, CaptureReader, CaptureRecorder
+
+def test_stop_finalizes_capture_after_writer_failure(tmp_path):
+    filename = str(tmp_path / 'failed.hcap')
+    recorder = CaptureRecorder(filename, window_size=1)
+    assert recorder.start()
+    per_window = (recorder.window_size - HEADER_SIZE) // RECORD_SIZE
+
+    def fail(index):
+        raise OSError("disk full")
+    recorder._map_window = fail
+
+    for i in range(per_window + 10):
+        recorder.record(CANMessage(0x100, bytes([i & 0xFF]), False, 1.0 + i))
+    deadline = time.monotonic() + 2.0
+    while recorder.is_recording and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not recorder.is_recording
+
+    recorder.stop()
+
+    assert recorder._file is None and recorder._header is None
+    with CaptureReader(filename) as reader:
+        assert len(reader) == recorder.records_written > 0
@@ -0,0 +1,35 @@
+"""Tests for transaction pairing in the capture diff"""
+
+import numpy as np
+
+from capture import CaptureReader
+from capture_diff import TransactionStream, diff_captures
+
+def broadcast_polls(count, value=lambda i: i, latency=0.002):
+    frames = []
+    for i in range(count):
+        start = 1.0 + i * 0.01
+        frames.append((start, [0x72, 0, 0x0C], True))
+        frames.append((start + latency, [0x76, 3, 0x0C, value(i), 0, 0, 0, 0], False))
+    return frames
+
+def test_broadcast_requests_are_answered(write_capture):
+    filename = write_capture('broadcast.hcap', broadcast_polls(10))
+
+    for block_records in (1 << 18, 3):
+        with CaptureReader(filename) as reader:
+            stream = TransactionStream(reader, block_records=block_records)
+            transactions = np.concatenate(list(stream))
+        assert len(transactions) == 10
+        assert transactions['answered'].all()
+        assert transactions['value'].tolist() == list(range(10))
+        assert stream.unsolicited == 0
+
+def test_diff_reports_changed_broadcast_answers(write_capture):
+    filename_a = write_capture('a.hcap', broadcast_polls(10))
+    filename_b = write_capture('b.hcap', broadcast_polls(10, value=lambda i: i ^ (i == 4)))
+
+    totals = diff_captures(filename_a, filename_b)['totals']
+
+    assert totals['unsolicited_a'] == totals['unsolicited_b'] == 0
+    assert totals['changed'] == 1
@@ -0,0 +1,45 @@
+"""Tests for request/response matching in capture statistics"""
+
+import numpy as np
+
+from capture_stats import ROLE_REQUEST, ROLE_RESPONSE, analyze_capture, match_requests
+
+def read(servo_id, address=0x0C):
+    return [0x72, servo_id, address]
+
+def response(servo_id, value, address=0x0C):
+    return [0x76, servo_id, address, value, 0, 0, 0, 0]
+
+def test_broadcast_request_matches_first_response_from_any_servo():
+    keys = np.array([0x00C, 0x30C, 0x50C, 0x10C, 0x10C], dtype=np.int64)
+    roles = np.array([ROLE_REQUEST, ROLE_RESPONSE, ROLE_RESPONSE, ROLE_REQUEST, ROLE_RESPONSE], dtype=np.uint8)
+    times = np.array([0, 10, 20, 30, 40], dtype=np.int64)
+
+    responses, requests, open_requests = match_requests(keys, roles, times, 1000)
+
+    assert sorted(zip(responses.tolist(), requests.tolist())) == [(1, 0), (4, 3)]
+    assert len(open_requests) == 0
+
+def test_addressed_request_takes_precedence_over_broadcast():
+    keys = np.array([0x00C, 0x20C, 0x20C], dtype=np.int64)
+    roles = np.array([ROLE_REQUEST, ROLE_REQUEST, ROLE_RESPONSE], dtype=np.uint8)
+    times = np.array([0, 5, 10], dtype=np.int64)
+
+    responses, requests, open_requests = match_requests(keys, roles, times, 1000)
+
+    assert (responses.tolist(), requests.tolist()) == ([2], [1])
+    assert open_requests.tolist() == [0]
+
+def test_broadcast_latency_counts_toward_responding_servo(write_capture):
+    frames = []
+    for i in range(20):
+        start = 1.0 + i * 0.01
+        frames.append((start, read(0), True))
+        frames.append((start + 0.002, response(4, i), False))
+    filename = write_capture('broadcast.hcap', frames)
+
+    for block_records in (1 << 20, 3):
+        report = analyze_capture(filename, block_records=block_records)
+        assert report['matched_responses'] == 20
+        assert list(report['latency']) == [4]
+        assert abs(report['latency'][4]['mean_ms'] - 2.0) < 0.01
@@ -0,0 +1,33 @@
+"""Tests for the chunk-compressed capture recorder"""
+
+from can_interface import CANMessage
+from capture_index import CaptureIndexBuilder, load_index, search_capture
+from compressed_capture import CompressedCaptureRecorder, open_capture
+
+def test_index_matches_file_after_dropped_chunk(tmp_path):
+    filename = str(tmp_path / 'dropped.hcapz')
+    recorder = CompressedCaptureRecorder(filename, codec='zlib', chunk_records=4,
+                                         index_builder=CaptureIndexBuilder.for_capture(filename, block_records=4))
+    compress = recorder._compress
+    calls = []
+
+    def fail_second_chunk(raw):
+        calls.append(len(raw))
+        if len(calls) == 2:
+            raise OSError("disk full")
+        return compress(raw)
+    recorder._compress = fail_second_chunk
+
+    assert recorder.start()
+    for servo_id in (1, 2, 3):
+        for i in range(4):
+            recorder.record(CANMessage(0, bytes([0x72, servo_id, 0x0C]), False, servo_id + i * 0.001), True)
+    recorder.stop()
+
+    assert recorder.records_written == 8 and recorder.dropped == 4
+    index = load_index(filename)
+    assert index.indexed_records == 8
+    with open_capture(filename) as reader:
+        found = list(search_capture(reader, index, servo_id=3))
+    assert [record.data[1] for _, record, _ in found] == [3] * 4
+    assert [position for position, _, _ in found] == [4, 5, 6, 7]
@@ -0,0 +1,34 @@
+"""Tests for python-can log sinks"""
+
+import time
+
+import pytest
+
+from can_interface import CANMessage
+from log_sinks import LogSink
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.mark.parametrize('idle', [True, False])
+def test_failed_rotation_stops_the_sink(tmp_path, monkeypatch, idle):
+    sink = LogSink(str(tmp_path / 'trace.csv'), max_seconds=0.05)
+    assert sink.start()
+    sink.put(CANMessage(0x100, b'\x01', False, 1.0))
+    assert wait_for(lambda: sink.written == 1)
+
+    def fail():
+        raise OSError("disk full")
+    monkeypatch.setattr(sink, '_open_writer', fail)
+    if not idle:
+        time.sleep(0.06)
+        sink.put(CANMessage(0x100, b'\x02', False, 2.0))
+
+    assert wait_for(lambda: not sink.is_running)
+    assert wait_for(lambda: not sink.writer_thread.is_alive())
+    assert sink.errors == 1 and sink.writer is None
+    assert not sink.put(CANMessage(0x100, b'\x03', False, 3.0))
+    sink.stop()
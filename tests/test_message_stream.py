@@ -0,0 +1,30 @@
+"""Tests for the live message broadcaster"""
+
+from message_stream import MessageBroadcaster, MessageFilter
+
+def servo_response(servo_id, time, address=0x0C):
+    return {'arb_id': 0, 'id': '0x000', 'data': '76', 'length': 5, 'time': time,
+            'servo_id': servo_id, 'opcode': 0x76, 'registers': [address]}
+
+def test_trace_keeps_servos_sharing_an_id_apart():
+    broadcaster = MessageBroadcaster()
+    for i in range(10):
+        broadcaster.publish(servo_response(3, 1.0 + i * 0.02))
+        broadcaster.publish(servo_response(4, 1.001 + i * 0.1))
+
+    servo_3 = broadcaster.get_trace(MessageFilter(servo_ids=frozenset({3})))
+    servo_4 = broadcaster.get_trace(MessageFilter(servo_ids=frozenset({4})))
+
+    assert [(entry['servo_id'], entry['count'], entry['cycle_ms']) for entry in servo_3] == [(3, 10, 20.0)]
+    assert [(entry['servo_id'], entry['count'], entry['cycle_ms']) for entry in servo_4] == [(4, 10, 100.0)]
+    assert len(broadcaster.get_trace()) == 2
+
+def test_trace_client_gets_only_matching_rows():
+    broadcaster = MessageBroadcaster()
+    client = broadcaster.register(trace=True, message_filter=MessageFilter(servo_ids=frozenset({3})))
+    broadcaster.publish(servo_response(3, 1.0))
+    broadcaster.publish(servo_response(4, 1.01))
+
+    event = broadcaster._next_event(client)
+
+    assert '"servo_id":3' in event and '"servo_id":4' not in event
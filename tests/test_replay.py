@@ -0,0 +1,25 @@
+"""Tests for capture replay"""
+
+import threading
+
+from replay import CaptureReplayer
+
+def test_endless_replay_of_empty_selection_returns(write_capture):
+    filename = write_capture('rx.hcap', [(1.0 + i * 0.001, [i], False) for i in range(5)])
+    replayer = CaptureReplayer(filename, speed=None, include_rx=False, loops=0)
+    delivered = []
+
+    thread = threading.Thread(target=replayer.run, args=(delivered.append,), daemon=True)
+    thread.start()
+    thread.join(2.0)
+    alive = thread.is_alive()
+    replayer.stop()
+
+    assert not alive
+    assert delivered == [] and replayer.loop_count == 0
+
+def test_replay_loops(write_capture):
+    filename = write_capture('rx.hcap', [(1.0 + i * 0.001, [i], False) for i in range(5)])
+    replayer = CaptureReplayer(filename, speed=None, loops=3)
+
+    assert replayer.run(lambda record: None) == 15
@@ -0,0 +1,33 @@
+"""Tests for applying register profiles with ServoClient"""
+
+from servo_client import ServoClient
+
+def test_profile_changing_servo_id_is_verified_at_new_id(can_interface, make_servo):
+    servo = make_servo(1, registers={0x3E: 0x100})
+    client = ServoClient(can_interface)
+
+    result = client.apply_profiles({1: {0x32: 9, 0x3E: 0x123}}, use_cache=False)[1]
+
+    assert result.success, result.message
+    assert result.written == {0x32: 9, 0x3E: 0x123}
+    assert servo.servo_id == 9 and servo.resets == 1
+    assert client.read_registers(9, [0x3E]) == {0x3E: 0x123}
+
+def test_profile_changing_servo_id_reports_register_lost_on_reset(can_interface, make_servo):
+    make_servo(1, registers={0x3E: 0x100}, volatile=(0x3E,))
+    client = ServoClient(can_interface)
+
+    result = client.apply_profiles({1: {0x32: 9, 0x3E: 0x123}}, use_cache=False, verify_timeout=0.5)[1]
+
+    assert not result.success
+    assert result.mismatched == {0x3E: (0x123, 0x100)}
+
+def test_save_reset_and_wait_follows_servo_id_change(can_interface, make_servo):
+    make_servo(2)
+    client = ServoClient(can_interface)
+
+    client.write_registers(2, {0x32: 7})
+    result = client.save_reset_and_wait(2, timeout=2.0)
+
+    assert result.ready, result.message
+    assert result.servo_id == 7
@@ -0,0 +1,44 @@
+"""Tests for the PCAN-View transmit list player"""
+
+import time
+
+import can
+
+from xmt_player import TransmitListPlayer, parse_xmt
+
+def test_pause_and_resume_keeps_cycle_rate(can_interface, channel):
+    receiver = can.Bus(interface='virtual', channel=channel)
+    player = TransmitListPlayer(can_interface, parse_xmt("123h 20 1 D 01h ; cyclic"))
+    try:
+        player.start()
+        # Resume while the entry is still scheduled, several times
+        for _ in range(5):
+            player.set_paused('cyclic', True)
+            player.set_paused('cyclic', False)
+        time.sleep(0.5)
+        player.stop()
+    finally:
+        sent = player.get_stats()[0]['sent']
+        received = 0
+        while receiver.recv(0.01) is not None:
+            received += 1
+        receiver.shutdown()
+
+    # 0.5 s at 20 ms is about 25 frames; duplicate schedules would multiply that
+    assert 15 <= sent <= 32
+    assert received == sent
+    assert len(player.schedule) <= 1
+
+def test_resume_after_pause_restarts_cycling(can_interface):
+    player = TransmitListPlayer(can_interface, parse_xmt("123h 20 1 D 01h ; cyclic"))
+    player.start()
+    player.set_paused('cyclic', True)
+    time.sleep(0.1)
+    paused_count = player.get_stats()[0]['sent']
+    time.sleep(0.1)
+    assert player.get_stats()[0]['sent'] == paused_count
+
+    player.set_paused('cyclic', False)
+    time.sleep(0.2)
+    player.stop()
+    assert player.get_stats()[0]['sent'] > paused_count
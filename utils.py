@@ -144,12 +144,13 @@ def parse_can_id(id_string: str) -> tuple[int, bool]:
             raise ValueError(f"Invalid CAN ID format: {id_string}")
         raise
 
-def calculate_checksum(data: List[int]) -> int:
+def calculate_checksum(data: Union[bytes, bytearray, memoryview, List[int], tuple]) -> int:
     """
     Calculate checksum for old protocol format
     
     Args:
-        data: List of byte values
+        data: Byte values excluding the header (bytes-like objects are summed
+            directly without building an intermediate list)
         
     Returns:
         Checksum value (8-bit)
@@ -222,7 +223,8 @@ def create_message_description(msg_type: int, data: bytes) -> str:
         0x52: "Read Dual Register",
         0x76: "Single Register Response",
         0x56: "Dual Register Response",
-        0x96: "Old Format Message"
+        0x96: "Old Format Message",
+        0x69: "Old Format Response"
     }
     
     base_desc = descriptions.get(msg_type, "Unknown Message")
@@ -4,25 +4,35 @@ Web-based Hitec CAN Servo Programming Tool
 Converts the desktop GUI to a Flask web application for Replit compatibility
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import (Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context, g,
+                   abort, make_response)
+import gzip
 import json
 import threading
 import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
 
-from can_interface import CANInterface
-from servo_protocol import ServoProtocol
+from servo_client import BatchOperation, BATCH_READ, BATCH_WRITE, BATCH_SEND
 from config_manager import ConfigManager
+from message_stream import MessageFilter, TRACE_COLUMNS, encode_columns, gzip_events
+from metrics import MetricsRegistry, Histogram, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from bus_sessions import BusSession, SessionRegistry, DEFAULT_SESSION
+from servo_protocol import ServoProtocol, decode_frame
+from telemetry import encode_telemetry, parse_series
 import utils
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'hitec_servo_tool_secret_key'
 
 # Global application state
-can_interface = CANInterface()
-servo_protocol = ServoProtocol()
 config_manager = ConfigManager()
 config = config_manager.load_config()
+metrics_registry = MetricsRegistry()
+session_registry = SessionRegistry(metrics_registry)
+
+# HTTP request duration per (method, route)
+request_latency = {}
 
 # Application state variables
 app_state = {
@@ -31,7 +41,6 @@ app_state = {
     'bitrate': 500000,
     'available_channels': [],
     'connection_status': 'Disconnected',
-    'messages': [],
     'servo_id': 1,
     'register_address': '0x00',
     'register_value': '0x00',
@@ -39,6 +48,90 @@ app_state = {
     'last_update': datetime.now().isoformat()
 }
 
+# Session behind the routes without a session prefix; its connection state is app_state
+default_session = BusSession(DEFAULT_SESSION, history_depth=config.get('web_history_depth', 1000), state=app_state)
+session_registry.add(default_session)
+can_interface = default_session.can_interface
+servo_protocol = default_session.servo_protocol
+servo_client = default_session.servo_client
+message_history = default_session.history
+message_broadcaster = default_session.broadcaster
+
+def collect_web_metrics(writer):
+    """Write HTTP metrics (each session reports its own stream and history metrics)"""
+    writer.histogram('http_request_duration_seconds', "Time to handle an HTTP request",
+                     [({'method': method, 'route': route}, histogram)
+                      for (method, route), histogram in list(request_latency.items())])
+
+metrics_registry.add_collector(collect_web_metrics)
+
+def find_session(name):
+    """Session for a session name from a URL, the default session if name is None"""
+    return default_session if name is None else session_registry.get(name)
+
+def create_session(channel, bitrate):
+    """New session for a CAN channel, with its receive pipeline attached"""
+    session = BusSession(channel, channel, bitrate, config.get('web_history_depth', 1000))
+    setup_message_callback(session)
+    return session
+
+def session_route(rule, **options):
+    """
+    Register a view at /api<rule> for the default session and at
+    /api/sessions/<session><rule> for any session; the view finds its
+    session in g.bus_session
+    """
+    def decorator(view):
+        app.add_url_rule(f'/api{rule}', view_func=view, **options)
+        app.add_url_rule(f'/api/sessions/<session>{rule}', view_func=view, **options)
+        return view
+    return decorator
+
+@app.url_value_preprocessor
+def select_session(endpoint, values):
+    """Look up the session named in the URL before the view runs"""
+    name = values.pop('session', None) if values else None
+    g.bus_session = find_session(name)
+    if g.bus_session is None:
+        abort(make_response(jsonify({'success': False, 'message': f'Unknown session {name}'}), 404))
+
+@app.before_request
+def start_request_timer():
+    """Note when a request started, for the latency histogram"""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Add the request's duration to its route's latency histogram"""
+    start = g.get('request_start')
+    if start is not None:
+        # Routes rather than paths, so label values stay bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request_latency(request.method, route, time.perf_counter() - start)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """gzip JSON and metrics responses for clients that accept it"""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough or
+            'Content-Encoding' in response.headers or
+            response.mimetype not in ('application/json', 'text/plain') or
+            not accepts_gzip(request.headers.get('Accept-Encoding', ''))):
+        return response
+    body = response.get_data()
+    if len(body) >= GZIP_MIN_SIZE:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def observe_request_latency(method, route, seconds):
+    """Add a request's duration to the latency histogram of its route"""
+    histogram = request_latency.get((method, route))
+    if histogram is None:
+        histogram = request_latency.setdefault((method, route), Histogram())
+    histogram.observe(seconds)
+
 def update_available_channels():
     """Update list of available CAN channels"""
     try:
@@ -49,31 +142,113 @@ def update_available_channels():
         app_state['available_channels'] = []
         return []
 
-def setup_message_callback():
-    """Setup callback for receiving CAN messages"""
+def format_message(msg, frame=None):
+    """
+    Format a received CAN message for the message list
+    
+    Args:
+        msg: Received CANMessage
+        frame: Its decoded servo protocol frame, if it is one (see servo_protocol.decode_frame)
+    
+    Returns:
+        Message dictionary; the raw ID, receive time and decoded servo ID,
+        opcode and registers are included for server-side filtering
+    """
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+    message = {
+        'timestamp': timestamp,
+        'id': f"0x{msg.arbitration_id:03X}",
+        'data': ' '.join([f"{b:02X}" for b in msg.data]),
+        'length': len(msg.data),
+        'arb_id': msg.arbitration_id,
+        'time': msg.timestamp
+    }
+    if frame is not None:
+        message['servo_id'] = frame['servo_id']
+        message['opcode'] = frame['opcode']
+        message['registers'] = [frame['address']] if frame['address_b'] is None else \
+            [frame['address'], frame['address_b']]
+    return message
+
+def message_query(query):
+    """
+    Read the message filter, mode and format from query parameters
+    
+    Args:
+        query: Parameter name -> list of values (id, servo, opcode, register, mode, format)
+    
+    Returns:
+        Tuple of (MessageFilter, True for trace mode, True for columnar format)
+    
+    Raises:
+        ValueError: If a filter value is not a number
+    """
+    return (MessageFilter.from_query(query), query.get('mode', [''])[0] == 'trace',
+            query.get('format', [''])[0] == 'columnar')
+
+def telemetry_query(query):
+    """
+    Read the registers to plot from query parameters
+    
+    Args:
+        query: Parameter name -> list of values (mode, series)
+    
+    Returns:
+        Set of (servo_id, address) for mode=telemetry, otherwise None
+    
+    Raises:
+        ValueError: If no series is given or one is malformed
+    """
+    if query.get('mode', [''])[0] != 'telemetry':
+        return None
+    selected = parse_series(query.get('series', []))
+    if not selected:
+        raise ValueError("mode=telemetry needs at least one series=<servo>:<register>")
+    return selected
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+def accepts_gzip(accept_encoding):
+    """Check whether an Accept-Encoding header allows gzip"""
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() == 'gzip':
+            params = params.replace(' ', '')
+            try:
+                return not (params.startswith('q=') and float(params[2:]) == 0)
+            except ValueError:
+                return False
+    return False
+
+def setup_message_callback(session=None):
+    """Setup callback for receiving CAN messages of a session (the default session if None)"""
+    session = session or default_session
+    
     def message_callback(msg):
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        message_data = {
-            'timestamp': timestamp,
-            'id': f"0x{msg.arbitration_id:03X}",
-            'data': ' '.join([f"{b:02X}" for b in msg.data]),
-            'length': len(msg.data)
-        }
+        frame = session.servo_protocol.observe_frame(msg.data)
+        message_data = format_message(msg, frame)
         
-        # Keep only last 100 messages
-        app_state['messages'].insert(0, message_data)
-        if len(app_state['messages']) > 100:
-            app_state['messages'] = app_state['messages'][:100]
+        # Before publishing, so telemetry clients woken by the message find its values
+        session.telemetry.observe(frame, msg.timestamp)
         
-        app_state['last_update'] = datetime.now().isoformat()
+        # Numbered into the history and pushed to stream clients
+        session.broadcaster.publish(message_data)
+        session.touch()
+    
+    def transmit_callback(msg):
+        # Commanded values, plotted next to the values servos report
+        session.telemetry.observe(decode_frame(msg.data), msg.timestamp)
     
-    can_interface.add_message_callback(message_callback)
+    session.can_interface.add_message_callback(message_callback)
+    session.can_interface.add_transmit_callback(transmit_callback)
 
 @app.route('/')
 def index():
     """Main application page"""
     update_available_channels()
-    return render_template('index.html', state=app_state)
+    registers = sorted(ServoProtocol.REGISTERS.values(), key=lambda register: register.address)
+    return render_template('index.html', state=app_state, registers=registers)
 
 @app.route('/api/refresh_channels', methods=['POST'])
 def refresh_channels():
@@ -85,29 +260,31 @@ def refresh_channels():
         'message': f'Found {len(channels)} CAN interfaces'
     })
 
-@app.route('/api/connect', methods=['POST'])
+@session_route('/connect', methods=['POST'])
 def connect_can():
     """Connect to CAN interface"""
     try:
+        bus = g.bus_session
         data = request.json
         channel = data.get('channel')
         bitrate = int(data.get('bitrate', 500000))
         
+        if bus is not default_session:
+            # Named sessions stay on the channel they were opened for
+            channel = channel or bus.name
+            if channel != bus.name:
+                return jsonify({
+                    'success': False,
+                    'message': f'Session {bus.name} can only connect to {bus.name}'
+                })
+        
         if not channel or channel == "Select CAN Interface...":
             return jsonify({
                 'success': False,
                 'message': 'Please select a CAN interface first'
             })
         
-        can_interface.channel = channel
-        can_interface.bitrate = bitrate
-        
-        if can_interface.connect():
-            app_state['connected'] = True
-            app_state['channel'] = channel
-            app_state['bitrate'] = bitrate
-            app_state['connection_status'] = f'Connected to {channel} @ {bitrate} bps'
-            
+        if session_registry.connect(bus, channel, bitrate):
             return jsonify({
                 'success': True,
                 'message': f'Connected to {channel} successfully'
@@ -124,14 +301,11 @@ def connect_can():
             'message': f'Connection error: {str(e)}'
         })
 
-@app.route('/api/disconnect', methods=['POST'])
+@session_route('/disconnect', methods=['POST'])
 def disconnect_can():
     """Disconnect from CAN interface"""
     try:
-        can_interface.disconnect()
-        app_state['connected'] = False
-        app_state['connection_status'] = 'Disconnected'
-        app_state['messages'] = []
+        g.bus_session.disconnect()
         
         return jsonify({
             'success': True,
@@ -143,15 +317,23 @@ def disconnect_can():
             'message': f'Disconnect error: {str(e)}'
         })
 
-@app.route('/api/read_register', methods=['POST'])
+@session_route('/read_register', methods=['POST'])
 def read_register():
-    """Read servo register"""
+    """
+    Read servo register
+    
+    With "wait": true the request blocks until the servo answers or
+    "timeout" seconds pass and returns the value, register name and
+    latency; otherwise it returns once the read command is sent.
+    """
     try:
+        bus = g.bus_session
         data = request.json
         servo_id = int(data.get('servo_id', 1))
         register_addr = data.get('register_address', '0x00')
+        wait_for_value = bool(data.get('wait', False))
         
-        if not app_state['connected']:
+        if not bus.connected:
             return jsonify({
                 'success': False,
                 'message': 'Not connected to CAN interface'
@@ -160,9 +342,12 @@ def read_register():
         # Convert register address from hex string to int
         addr = int(register_addr, 16) if register_addr.startswith('0x') else int(register_addr, 16)
         
+        if wait_for_value:
+            return jsonify(wait_for_register(servo_id, addr, read_timeout(data), bus))
+        
         # Send read command
-        arbitration_id, message_data = servo_protocol.create_read_message(servo_id, addr)
-        if can_interface.send_message(arbitration_id, message_data):
+        arbitration_id, message_data = bus.servo_protocol.create_read_for_servo(servo_id, addr)
+        if bus.can_interface.send_message(arbitration_id, message_data):
             return jsonify({
                 'success': True,
                 'message': f'Read command sent to servo {servo_id}, register {register_addr}'
@@ -179,16 +364,71 @@ def read_register():
             'message': f'Read error: {str(e)}'
         })
 
-@app.route('/api/write_register', methods=['POST'])
+# Longest a blocking register read may wait for the servo, in seconds
+MAX_READ_TIMEOUT = 5.0
+
+def read_timeout(data):
+    """Wait time requested for a blocking register read, clamped to a sane range"""
+    return max(0.01, min(float(data.get('timeout', 0.5)), MAX_READ_TIMEOUT))
+
+def register_read_result(servo_id, addr, value, latency):
+    """Response dictionary for a register value received from a servo"""
+    register_name = servo_protocol.get_register_info(addr).name
+    return {
+        'success': True,
+        'message': f'Servo {servo_id} {register_name} = 0x{value:04X} ({value})',
+        'servo_id': servo_id,
+        'register_address': f"0x{addr:02X}",
+        'register_name': register_name,
+        'value': value,
+        'value_hex': f"0x{value:04X}",
+        'latency_ms': round(latency * 1000, 3)
+    }
+
+def register_timeout_result(servo_id, addr, timeout):
+    """Response dictionary for a register read the servo did not answer"""
+    return {
+        'success': False,
+        'message': f'No response from servo {servo_id}, register 0x{addr:02X} within {timeout:.2f} s'
+    }
+
+def wait_for_register(servo_id, addr, timeout, session=None):
+    """
+    Read a register and wait for the servo's response
+    
+    The wait is on the ServoClient future, which the receive thread
+    completes; concurrent reads of the same register share one request.
+    
+    Args:
+        session: Bus session of the servo, the default session if None
+    
+    Returns:
+        Response dictionary with value, register name and latency on success
+    """
+    client = (session or default_session).servo_client
+    start = time.perf_counter()
+    future = client.request_read(servo_id, addr)
+    try:
+        value = future.result(timeout)
+    except FutureTimeoutError:
+        client.cancel_read(servo_id, addr, future)
+        return register_timeout_result(servo_id, addr, timeout)
+    except IOError as e:
+        return {'success': False, 'message': str(e)}
+    
+    return register_read_result(servo_id, addr, value, time.perf_counter() - start)
+
+@session_route('/write_register', methods=['POST'])
 def write_register():
     """Write servo register"""
     try:
+        bus = g.bus_session
         data = request.json
         servo_id = int(data.get('servo_id', 1))
         register_addr = data.get('register_address', '0x00')
         register_value = data.get('register_value', '0x00')
         
-        if not app_state['connected']:
+        if not bus.connected:
             return jsonify({
                 'success': False,
                 'message': 'Not connected to CAN interface'
@@ -199,8 +439,8 @@ def write_register():
         value = int(register_value, 16) if register_value.startswith('0x') else int(register_value, 16)
         
         # Send write command
-        arbitration_id, message_data = servo_protocol.create_write_message(servo_id, addr, value)
-        if can_interface.send_message(arbitration_id, message_data):
+        arbitration_id, message_data = bus.servo_protocol.create_write_for_servo(servo_id, addr, value)
+        if bus.can_interface.send_message(arbitration_id, message_data):
             return jsonify({
                 'success': True,
                 'message': f'Write command sent to servo {servo_id}, register {register_addr} = {register_value}'
@@ -217,15 +457,16 @@ def write_register():
             'message': f'Write error: {str(e)}'
         })
 
-@app.route('/api/send_custom_message', methods=['POST'])
+@session_route('/send_custom_message', methods=['POST'])
 def send_custom_message():
     """Send custom CAN message"""
     try:
+        bus = g.bus_session
         data = request.json
         can_id = data.get('can_id', '0x123')
         message_data = data.get('data', '00 00 00 00 00 00 00 00')
         
-        if not app_state['connected']:
+        if not bus.connected:
             return jsonify({
                 'success': False,
                 'message': 'Not connected to CAN interface'
@@ -240,7 +481,7 @@ def send_custom_message():
             data_bytes.append(int(byte_str, 16))
         
         # Create and send custom message
-        if can_interface.send_message(id_int, bytes(data_bytes)):
+        if bus.can_interface.send_message(id_int, bytes(data_bytes)):
             return jsonify({
                 'success': True,
                 'message': f'Custom message sent: ID={can_id}, Data={message_data}'
@@ -257,24 +498,307 @@ def send_custom_message():
             'message': f'Send error: {str(e)}'
         })
 
-@app.route('/api/get_messages')
+# Largest number of operations accepted in one batch request
+MAX_BATCH_OPERATIONS = 1000
+
+def parse_batch_operation(item):
+    """Convert one JSON batch entry into a BatchOperation"""
+    kind = item.get('op')
+    is_extended = item.get('extended')
+    if kind == BATCH_READ:
+        return BatchOperation(BATCH_READ, servo_id=int(item.get('servo_id', 1)),
+                              address=int(str(item['register_address']), 16), is_extended=is_extended)
+    if kind == BATCH_WRITE:
+        value = int(str(item['register_value']), 16)
+        if not 0 <= value <= 0xFFFF:
+            raise ValueError(f"register value {item['register_value']} out of range")
+        return BatchOperation(BATCH_WRITE, servo_id=int(item.get('servo_id', 1)),
+                              address=int(str(item['register_address']), 16), value=value, is_extended=is_extended)
+    if kind == BATCH_SEND:
+        data_bytes = bytes(int(byte_str, 16) for byte_str in str(item.get('data', '')).split())
+        return BatchOperation(BATCH_SEND, arbitration_id=int(str(item['can_id']), 16), data=data_bytes,
+                              is_extended=bool(is_extended))
+    raise ValueError(f"unknown op '{kind}' (expected read, write or send)")
+
+@session_route('/batch', methods=['POST'])
+def run_batch():
+    """
+    Run a list of read, write and send operations in one request
+    
+    Body: {"operations": [{"op": "read", "servo_id": 1, "register_address": "0x0C"},
+                          {"op": "write", "servo_id": 1, "register_address": "0x1E", "register_value": "0x0800"},
+                          {"op": "send", "can_id": "0x123", "data": "01 02"}],
+           "timeout": 1.0, "stop_on_error": false}
+    
+    Operations run in order without waiting for each other; responses to
+    all reads are collected within one timeout. Each result carries the
+    read value, register name and response latency.
+    """
+    try:
+        bus = g.bus_session
+        data = request.json or {}
+        items = data.get('operations', [])
+        
+        if not bus.connected:
+            return jsonify({
+                'success': False,
+                'message': 'Not connected to CAN interface'
+            })
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': 'No operations given'})
+        if len(items) > MAX_BATCH_OPERATIONS:
+            return jsonify({
+                'success': False,
+                'message': f'Too many operations ({len(items)}, maximum {MAX_BATCH_OPERATIONS})'
+            })
+        
+        operations = []
+        for index, item in enumerate(items):
+            try:
+                operations.append(parse_batch_operation(item))
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                return jsonify({'success': False, 'message': f'Operation {index}: {str(e)}'})
+        
+        timeout = max(0.01, min(float(data.get('timeout', 1.0)), 10.0))
+        start = time.perf_counter()
+        results = bus.servo_client.run_batch(operations, timeout=timeout,
+                                             stop_on_error=bool(data.get('stop_on_error', False)))
+        elapsed = time.perf_counter() - start
+        
+        formatted = []
+        for operation, result in zip(operations, results):
+            entry = {'index': result.index, 'op': result.kind, 'success': result.success, 'message': result.message}
+            if operation.kind == BATCH_SEND:
+                entry['can_id'] = f"0x{operation.arbitration_id:03X}"
+            else:
+                entry.update({
+                    'servo_id': operation.servo_id,
+                    'register_address': f"0x{operation.address:02X}",
+                    'register_name': servo_protocol.get_register_info(operation.address).name
+                })
+            if result.value is not None:
+                entry['value'] = result.value
+                entry['value_hex'] = f"0x{result.value:04X}"
+                entry['latency_ms'] = round(result.latency * 1000, 3)
+            formatted.append(entry)
+        
+        failed = sum(1 for result in results if not result.success)
+        return jsonify({
+            'success': failed == 0,
+            'message': f'{len(results) - failed} of {len(results)} operations succeeded in {elapsed * 1000:.1f} ms',
+            'results': formatted,
+            'elapsed_ms': round(elapsed * 1000, 3)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Batch error: {str(e)}'
+        })
+
+@session_route('/get_messages')
 def get_messages():
-    """Get recent CAN messages"""
+    """
+    Get CAN messages
+    
+    Without since, returns the newest messages, newest first. With
+    since=<seq>, returns up to limit messages newer than that sequence number,
+    oldest first; 'gap' counts messages after the cursor that have already
+    left the history, 'next' is the cursor for the following call and
+    'reset' is set when the cursor was from before a server restart.
+    
+    id, servo, opcode and register (repeated or comma-separated) keep only
+    matching messages. mode=trace returns the latest frame, count and cycle
+    time per ID instead, with servo frames split by servo, opcode and
+    register (see message_stream.trace_row). format=columnar replaces the 'messages' or 'trace'
+    list with parallel arrays under 'columns' (see encode_columns).
+    """
+    bus = g.bus_session
+    since = request.args.get('since', type=int)
+    limit = max(1, min(request.args.get('limit', 100 if since is None else 1000, type=int), 10000))
+    try:
+        message_filter, trace, columnar = message_query(request.args.to_dict(flat=False))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if trace:
+        entries = bus.broadcaster.get_trace(message_filter)
+        return jsonify({
+            **({'columns': encode_columns(entries, TRACE_COLUMNS)} if columnar else {'trace': entries}),
+            'last_update': bus.state['last_update']
+        })
+    
+    if since is None:
+        messages = bus.history.latest(limit, message_filter)
+        return jsonify({
+            **({'columns': encode_columns(messages)} if columnar else {'messages': messages}),
+            'last_seq': bus.history.last_seq,
+            'last_update': bus.state['last_update']
+        })
+    
+    # A cursor ahead of the history means the server restarted; start over
+    reset = since > bus.history.last_seq
+    if reset:
+        since = 0
+    
+    messages, gap, next_seq = bus.history.query(since, limit, message_filter)
     return jsonify({
-        'messages': app_state['messages'],
-        'last_update': app_state['last_update']
+        **({'columns': encode_columns(messages)} if columnar else {'messages': messages}),
+        'gap': gap,
+        'next': next_seq,
+        'more': next_seq < bus.history.last_seq,
+        'reset': reset,
+        'last_update': bus.state['last_update']
     })
 
-@app.route('/api/clear_messages', methods=['POST'])
+def stream_options(interval, last_event_id):
+    """
+    Interpret stream request parameters
+    
+    Args:
+        interval: Requested batch interval in milliseconds, or None
+        last_event_id: Last-Event-ID header sent by a reconnecting browser
+    
+    Returns:
+        Tuple of (batch interval in seconds or None, sequence number to resume from or None)
+    """
+    batch_interval = max(10, min(interval, 1000)) / 1000.0 if interval else None
+    resume_from = int(last_event_id) if last_event_id.isdigit() else None
+    return batch_interval, resume_from
+
+@session_route('/stream')
+def stream_messages():
+    """
+    Push received CAN messages to the browser as Server-Sent Events
+    
+    Takes the same filter, mode and format parameters as /api/get_messages
+    and is gzip-compressed when the browser accepts it. mode=telemetry with
+    series=<servo>:<register> (repeated or comma-separated) sends the new
+    plot points of those registers instead of messages.
+    """
+    batch_interval, resume_from = stream_options(request.args.get('interval', type=int),
+                                                 request.headers.get('Last-Event-ID', ''))
+    try:
+        query = request.args.to_dict(flat=False)
+        message_filter, trace, columnar = message_query(query)
+        telemetry = telemetry_query(query)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    stream = g.bus_session.broadcaster.stream(request.remote_addr or "", batch_interval, resume_from,
+                                              message_filter, trace, columnar, telemetry)
+    compress = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    response = Response(stream_with_context(gzip_events(stream) if compress else stream),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@session_route('/telemetry')
+def get_telemetry():
+    """
+    List the register time series kept for plotting
+    
+    With series=<servo>:<register> (repeated or comma-separated), also
+    returns their points newer than since=<version> in the format of the
+    stream's telemetry events, and the version to pass next time.
+    """
+    telemetry = g.bus_session.telemetry
+    try:
+        selected = parse_series(request.args.getlist('series'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    result = {'success': True, 'series': telemetry.get_series()}
+    if selected:
+        updates, version, _ = telemetry.changes(request.args.get('since', 0, type=int), selected)
+        result['points'] = encode_telemetry(updates)
+        result['version'] = version
+    return jsonify(result)
+
+@session_route('/stream/clients')
+def stream_clients():
+    """Get delivery and drop counters of connected stream clients"""
+    return jsonify({'clients': g.bus_session.broadcaster.get_stats()})
+
+@session_route('/clear_messages', methods=['POST'])
 def clear_messages():
     """Clear message history"""
-    app_state['messages'] = []
+    g.bus_session.history.clear()
+    g.bus_session.broadcaster.clear_trace()
     return jsonify({'success': True, 'message': 'Messages cleared'})
 
-@app.route('/api/get_state')
+@app.route('/metrics')
+def metrics():
+    """Metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@session_route('/get_state')
 def get_state():
     """Get current application state"""
-    return jsonify(app_state)
+    return jsonify(g.bus_session.state)
+
+@app.route('/api/sessions')
+def list_sessions():
+    """List bus sessions"""
+    return jsonify({'sessions': [session.get_info() for session in session_registry.get_sessions()]})
+
+@app.route('/api/sessions', methods=['POST'])
+def open_session():
+    """
+    Open a bus session for a CAN channel and connect it
+    
+    Body: {"channel": "PCAN_USBBUS2", "bitrate": 500000}
+    
+    The session is named after the channel; every route under /api is
+    then also served for it under /api/sessions/<channel>/, e.g.
+    /api/sessions/PCAN_USBBUS2/read_register.
+    """
+    try:
+        data = request.json or {}
+        channel = data.get('channel')
+        bitrate = int(data.get('bitrate', 500000))
+        
+        if not channel or channel == DEFAULT_SESSION or '/' in channel:
+            return jsonify({
+                'success': False,
+                'message': 'Please give the CAN channel to open'
+            })
+        
+        session = session_registry.get_or_create(channel, lambda: create_session(channel, bitrate))
+        if not session.connected and not session_registry.connect(session, channel, bitrate):
+            return jsonify({
+                'success': False,
+                'message': f'Failed to connect to {channel}',
+                'session': session.get_info()
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': f'Session {channel} connected',
+            'session': session.get_info()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Session error: {str(e)}'
+        })
+
+@app.route('/api/sessions/<session>', methods=['DELETE'])
+def close_session():
+    """Disconnect a bus session and remove it"""
+    bus = g.bus_session
+    if bus is default_session:
+        return jsonify({'success': False, 'message': 'The default session cannot be closed'}), 400
+    
+    session_registry.remove(bus.name)
+    if bus.connected:
+        bus.disconnect()
+    return jsonify({'success': True, 'message': f'Session {bus.name} closed'})
 
 if __name__ == '__main__':
     print("Starting Hitec CAN Servo Programming Tool (Web Version)")
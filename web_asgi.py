@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Async (ASGI) serving mode for the web tool
+Serves live streams and blocking register reads on an event loop and every other route through the Flask app
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import web_app
+from message_stream import gzip_events_async
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 1 << 20
+
+# Path prefix of the routes served for a named bus session
+SESSION_PREFIX = '/api/sessions/'
+
+class AsgiApp:
+    """
+    ASGI application serving the web tool
+
+    /api/stream and waiting /api/read_register requests, for the default
+    session and under /api/sessions/<session>/, run as coroutines on the
+    event loop: an open stream or an outstanding read is a
+    suspended coroutine rather than a blocked thread, and the CAN receive
+    thread wakes the loop when frames or responses arrive. Every other
+    route runs the unchanged Flask app in a bounded thread pool, so the
+    REST API answers exactly as it does under the Flask server.
+    """
+
+    def __init__(self, flask_app=None, workers: int = 16):
+        """
+        Initialize application
+
+        Args:
+            flask_app: WSGI application for the remaining routes, web_app.app if None
+            workers: Threads running Flask routes
+        """
+        self.flask_app = flask_app or web_app.app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi')
+        self.routes = {
+            ('GET', '/api/stream'): self.stream,
+            ('POST', '/api/read_register'): self.read_register
+        }
+        self.started = False
+
+    async def __call__(self, scope: Dict[str, Any], receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await self._send_response(send, 413, b'Request body too large', b'text/plain')
+            return
+
+        session_name, path = self._session_path(scope['path'])
+        handler = self.routes.get((scope['method'], path))
+        session = web_app.find_session(session_name) if handler else None
+        # Unknown sessions go to Flask too, which answers them with 404
+        if session is None or not await handler(scope, body, receive, send, session):
+            await self.call_flask(scope, body, send)
+
+    async def lifespan(self, receive, send):
+        """Attach to the CAN interface at startup and disconnect at shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                web_app.session_registry.disconnect_all()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        """Register the message callback once, as web_app does when run directly"""
+        if not self.started:
+            web_app.setup_message_callback()
+            web_app.update_available_channels()
+            self.started = True
+
+    async def stream(self, scope: Dict[str, Any], body: bytes, receive, send, session) -> bool:
+        """Serve /api/stream with the broadcaster's async event stream"""
+        headers = self._headers(scope)
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        interval = query.get('interval', [''])[0]
+        batch_interval, resume_from = web_app.stream_options(int(interval) if interval.isdigit() else None,
+                                                             headers.get('last-event-id', ''))
+        try:
+            message_filter, trace, columnar = web_app.message_query(query)
+            telemetry = web_app.telemetry_query(query)
+        except ValueError as e:
+            await self._send_response(send, 400, json.dumps({'success': False, 'message': str(e)}).encode('utf-8'),
+                                      b'application/json')
+            return True
+        client = scope.get('client')
+        remote_addr = client[0] if client else ""
+        compress = web_app.accepts_gzip(headers.get('accept-encoding', ''))
+
+        response_headers = [(b'content-type', b'text/event-stream; charset=utf-8'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]
+        if compress:
+            response_headers += [(b'content-encoding', b'gzip'), (b'vary', b'Accept-Encoding')]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+
+        events = session.broadcaster.stream_async(remote_addr, batch_interval, resume_from,
+                                                  message_filter, trace, columnar, telemetry)
+        chunks = gzip_events_async(events) if compress else (event.encode('utf-8') async for event in events)
+
+        async def pump():
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        # Servers do not fail send() once the browser is gone, so watch for the disconnect message too
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(self._wait_disconnect(receive))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await chunks.aclose()
+            await events.aclose()
+        return True
+
+    async def read_register(self, scope: Dict[str, Any], body: bytes, receive, send, session) -> bool:
+        """Serve waiting register reads without holding a thread; other reads go to Flask"""
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return False
+        if not isinstance(data, dict) or not data.get('wait'):
+            return False
+
+        start = time.perf_counter()
+        try:
+            if not session.connected:
+                result = {'success': False, 'message': 'Not connected to CAN interface'}
+            else:
+                servo_id = int(data.get('servo_id', 1))
+                addr = int(data.get('register_address', '0x00'), 16)
+                result = await self.wait_for_register(session, servo_id, addr, web_app.read_timeout(data))
+        except Exception as e:
+            result = {'success': False, 'message': f'Read error: {str(e)}'}
+
+        await self._send_response(send, 200, json.dumps(result, sort_keys=True).encode('utf-8'), b'application/json')
+        route = '/read_register' if session is web_app.default_session else '/sessions/<session>/read_register'
+        web_app.observe_request_latency('POST', '/api' + route, time.perf_counter() - start)
+        return True
+
+    async def wait_for_register(self, session, servo_id: int, addr: int, timeout: float) -> Dict[str, Any]:
+        """Await a register value; same result as web_app.wait_for_register"""
+        start = time.perf_counter()
+        future = session.servo_client.request_read(servo_id, addr)
+        try:
+            value = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            session.servo_client.cancel_read(servo_id, addr, future)
+            return web_app.register_timeout_result(servo_id, addr, timeout)
+        except IOError as e:
+            return {'success': False, 'message': str(e)}
+
+        return web_app.register_read_result(servo_id, addr, value, time.perf_counter() - start)
+
+    async def call_flask(self, scope: Dict[str, Any], body: bytes, send):
+        """Run the request through the Flask app in the thread pool"""
+        environ = self._environ(scope, body)
+        loop = asyncio.get_running_loop()
+        try:
+            status, headers, content = await loop.run_in_executor(self.executor, self._run_wsgi, environ)
+        except Exception as e:
+            logger.error(f"Error serving {scope['method']} {scope['path']}: {e}")
+            await self._send_response(send, 500, b'Internal Server Error', b'text/plain')
+            return
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def _run_wsgi(self, environ: Dict[str, Any]) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+        """Call the WSGI app and collect its whole response (runs in a pool thread)"""
+        response: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return chunks.append
+
+        iterable = self.flask_app(environ, start_response)
+        try:
+            chunks.extend(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return response['status'], response['headers'], b''.join(chunks)
+
+    @staticmethod
+    def _environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        """Build a WSGI environ from an ASGI HTTP scope"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0] if client else '',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f"HTTP_{name}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    @staticmethod
+    def _session_path(path: str) -> Tuple[Optional[str], str]:
+        """Split /api/sessions/<session>/<route> into the session name and /api/<route>"""
+        if path.startswith(SESSION_PREFIX):
+            name, separator, route = path[len(SESSION_PREFIX):].partition('/')
+            if separator and route:
+                return name, '/api/' + route
+        return None, path
+
+    @staticmethod
+    def _headers(scope: Dict[str, Any]) -> Dict[str, str]:
+        """Request headers with lower-case names"""
+        return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        """Read the request body, None if it exceeds MAX_BODY_SIZE"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_SIZE:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        """Return once the client has disconnected"""
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    async def _send_response(send, status: int, body: bytes, content_type: bytes):
+        """Send a complete response"""
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+# Application object for ASGI servers, e.g. "uvicorn web_asgi:app"
+app = AsgiApp()
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Serve the web tool with an async (ASGI) server")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=5000, help="Port to listen on")
+    parser.add_argument('--workers', type=int, default=16, help="Threads running the Flask routes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if uvicorn is None:
+        print("The async serving mode needs uvicorn: pip install uvicorn", file=sys.stderr)
+        sys.exit(1)
+
+    print("Starting Hitec CAN Servo Programming Tool (Web Version, async)")
+    uvicorn.run(AsgiApp(workers=args.workers), host=args.host, port=args.port, log_level='info')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+PCAN-View transmit list support
+Loads .xmt transmit lists and plays their entries cyclically or on demand through CANInterface
+"""
+
+import argparse
+import heapq
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Union
+
+import can
+
+from can_interface import CANInterface
+from replay import wait_until
+
+# One data byte as written by PCAN-View, e.g. "7Fh"
+_BYTE_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,2}h$')
+
+@dataclass
+class TransmitEntry:
+    """One message of a PCAN-View transmit list"""
+    arbitration_id: int
+    is_extended_id: bool
+    cycle_ms: int               # 0 = manual trigger only
+    dlc: int
+    data: bytes
+    frame_type: str = 'D'       # D = data, R = remote; FD types start with F
+    paused: bool = False
+    label: str = ""
+    line_number: int = 0
+
+    @property
+    def is_manual(self) -> bool:
+        return self.cycle_ms == 0
+
+    @property
+    def is_remote(self) -> bool:
+        return self.frame_type.upper() == 'R'
+
+    def describe(self) -> str:
+        """One-line summary for listings"""
+        can_id = f"0x{self.arbitration_id:08X}" if self.is_extended_id else f"0x{self.arbitration_id:03X}"
+        timing = "manual" if self.is_manual else f"{self.cycle_ms} ms"
+        data = ' '.join(f"{b:02X}" for b in self.data) if not self.is_remote else f"RTR (DLC {self.dlc})"
+        state = " (paused)" if self.paused else ""
+        return f"{can_id} {timing:>8} {data:<24} {self.label}{state}"
+
+def _parse_hex(token: str) -> int:
+    """Parse a PCAN-View hex token such as '1F4h'"""
+    return int(token[:-1] if token.lower().endswith('h') else token, 16)
+
+def parse_xmt(text: str) -> List[TransmitEntry]:
+    """
+    Parse the contents of a PCAN-View .xmt transmit list
+
+    Each non-comment line reads:
+        <ID>h <cycle ms> <DLC> <frame type> <data bytes>h ... [Paused] [; comment]
+    IDs written with more than three hex digits are 29-bit extended IDs.
+
+    Args:
+        text: File contents
+
+    Returns:
+        List of TransmitEntry in file order
+    """
+    entries = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith(';'):
+            continue
+
+        body, _, comment = line.partition(';')
+        tokens = body.split()
+        if len(tokens) < 4:
+            raise ValueError(f"Line {line_number}: expected ID, cycle time, DLC and frame type")
+
+        try:
+            id_token = tokens[0]
+            arbitration_id = _parse_hex(id_token)
+            is_extended_id = len(id_token.rstrip('hH')) > 3 or arbitration_id > 0x7FF
+            cycle_ms = int(tokens[1])
+            dlc = int(tokens[2])
+            frame_type = tokens[3]
+
+            data_tokens = []
+            flags = []
+            for token in tokens[4:]:
+                if _BYTE_PATTERN.match(token) and not flags:
+                    data_tokens.append(token)
+                else:
+                    flags.append(token.lower())
+            data = bytes(_parse_hex(token) for token in data_tokens)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number}: {e}")
+
+        is_remote = frame_type.upper() == 'R'
+        expected_length = can.util.dlc2len(dlc) if frame_type.upper().startswith('F') else dlc
+        if not is_remote and len(data) != expected_length:
+            raise ValueError(f"Line {line_number}: DLC {dlc} but {len(data)} data bytes")
+
+        entries.append(TransmitEntry(
+            arbitration_id=arbitration_id,
+            is_extended_id=is_extended_id,
+            cycle_ms=cycle_ms,
+            dlc=dlc,
+            data=data,
+            frame_type=frame_type,
+            paused='paused' in flags,
+            label=comment.strip(),
+            line_number=line_number
+        ))
+
+    return entries
+
+def load_xmt(filename: str) -> List[TransmitEntry]:
+    """
+    Load a PCAN-View .xmt transmit list
+
+    Args:
+        filename: Path to .xmt file
+
+    Returns:
+        List of TransmitEntry in file order
+    """
+    with open(filename, 'r', encoding='latin-1') as f:
+        return parse_xmt(f.read())
+
+@dataclass
+class EntryStats:
+    """Transmit timing of one entry"""
+    sent: int = 0
+    failed: int = 0
+    cyclic: int = 0             # Sends made by the scheduler, which the timing covers
+    max_late_ms: float = 0.0
+    _late_sum: float = field(default=0.0, repr=False)
+    _late_sq_sum: float = field(default=0.0, repr=False)
+
+    def add(self, late: float):
+        self.cyclic += 1
+        late_ms = late * 1000
+        self._late_sum += late_ms
+        self._late_sq_sum += late_ms * late_ms
+        if late_ms > self.max_late_ms:
+            self.max_late_ms = late_ms
+
+    def as_dict(self) -> Dict[str, float]:
+        cyclic = self.cyclic or 1
+        mean = self._late_sum / cyclic
+        variance = max(0.0, self._late_sq_sum / cyclic - mean * mean)
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'mean_late_ms': mean,
+            'jitter_ms': variance ** 0.5,
+            'max_late_ms': self.max_late_ms
+        }
+
+class TransmitListPlayer:
+    """
+    Sends transmit list entries at their cycle times through a CANInterface
+
+    One scheduler thread keeps a heap of due times. Each entry's next due time
+    is its previous due time plus its cycle, so the period does not drift with
+    send latency. An entry that falls more than a full cycle behind skips the
+    missed slots rather than bursting. Manual and paused entries only go out
+    through trigger() until resumed.
+    """
+
+    def __init__(self, can_interface: CANInterface, entries: List[TransmitEntry]):
+        """
+        Initialize player
+
+        Args:
+            can_interface: Connected CAN interface to send through
+            entries: Transmit list entries
+        """
+        self.logger = logging.getLogger(__name__)
+        self.can_interface = can_interface
+        self.entries = entries
+        self.paused = [entry.paused for entry in entries]
+        self.stats = [EntryStats() for _ in entries]
+
+        self.lock = threading.Lock()
+        self.schedule: List[tuple] = []        # (due perf_counter time, entry index)
+        self.scheduled: Set[int] = set()        # Entries in the schedule or being sent, at most once each
+        self.scheduler_thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.is_running = False
+
+    def find(self, key: Union[int, str]) -> int:
+        """
+        Resolve an entry by index or label (case-insensitive)
+
+        Returns:
+            Entry index
+        """
+        if isinstance(key, int):
+            if not 0 <= key < len(self.entries):
+                raise IndexError(f"No transmit entry {key}")
+            return key
+        for index, entry in enumerate(self.entries):
+            if entry.label.lower() == key.lower():
+                return index
+        raise KeyError(f"No transmit entry labelled '{key}'")
+
+    def _send(self, index: int) -> bool:
+        """Send one entry now"""
+        entry = self.entries[index]
+        sent = self.can_interface.send_message(entry.arbitration_id, entry.data, entry.is_extended_id,
+                                               is_remote_frame=entry.is_remote, dlc=entry.dlc)
+        if not sent:
+            self.stats[index].failed += 1
+        return sent
+
+    def trigger(self, key: Union[int, str]) -> bool:
+        """
+        Send an entry once immediately (manual trigger)
+
+        Args:
+            key: Entry index or label
+
+        Returns:
+            True if sent, False otherwise
+        """
+        index = self.find(key)
+        sent = self._send(index)
+        if sent:
+            self.stats[index].sent += 1
+            self.logger.info(f"Sent '{self.entries[index].label}'")
+        return sent
+
+    def set_paused(self, key: Union[int, str], paused: bool):
+        """Pause or resume cyclic transmission of an entry"""
+        index = self.find(key)
+        with self.lock:
+            self.paused[index] = paused
+            # An entry still scheduled (e.g. paused and resumed before falling due) keeps its slot
+            if (not paused and self.is_running and not self.entries[index].is_manual
+                    and index not in self.scheduled):
+                heapq.heappush(self.schedule, (time.perf_counter(), index))
+                self.scheduled.add(index)
+        self.wake_event.set()
+
+    def resume_all(self):
+        """Resume every cyclic entry"""
+        for index in range(len(self.entries)):
+            if self.paused[index]:
+                self.set_paused(index, False)
+
+    def start(self):
+        """Start cyclic transmission of all active entries"""
+        if self.is_running:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            self.schedule = [(now, index) for index, entry in enumerate(self.entries)
+                             if not entry.is_manual and not self.paused[index]]
+            heapq.heapify(self.schedule)
+            self.scheduled = {index for _, index in self.schedule}
+        self.stop_event.clear()
+        self.is_running = True
+        self.scheduler_thread = threading.Thread(target=self._scheduler_worker, name="xmt-player", daemon=True)
+        self.scheduler_thread.start()
+
+    def stop(self):
+        """Stop cyclic transmission"""
+        self.is_running = False
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.scheduler_thread:
+            self.scheduler_thread.join(timeout=2.0)
+            self.scheduler_thread = None
+
+    def _scheduler_worker(self):
+        """Send entries as they fall due"""
+        while not self.stop_event.is_set():
+            with self.lock:
+                next_due = self.schedule[0][0] if self.schedule else None
+
+            if next_due is None:
+                self.wake_event.wait(0.5)
+                self.wake_event.clear()
+                continue
+
+            # A resumed entry may become due earlier, so wake on changes too
+            if not wait_until(next_due, self.wake_event):
+                self.wake_event.clear()
+                continue
+
+            with self.lock:
+                if not self.schedule:
+                    continue
+                due, index = heapq.heappop(self.schedule)
+                if self.paused[index]:
+                    self.scheduled.discard(index)
+                    continue
+
+            sent = self._send(index)
+            now = time.perf_counter()
+            if sent:
+                self.stats[index].sent += 1
+                self.stats[index].add(now - due)
+
+            cycle = self.entries[index].cycle_ms / 1000.0
+            next_time = due + cycle
+            if now - next_time > cycle:
+                # Too far behind to catch up without a burst; restart the cycle from now
+                next_time = now + cycle
+            with self.lock:
+                if not self.paused[index]:
+                    heapq.heappush(self.schedule, (next_time, index))
+                else:
+                    self.scheduled.discard(index)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Get per-entry transmit counts and timing"""
+        return [dict(label=entry.label, cycle_ms=entry.cycle_ms, paused=self.paused[index],
+                     **self.stats[index].as_dict())
+                for index, entry in enumerate(self.entries)]
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Play a PCAN-View .xmt transmit list")
+    parser.add_argument('xmt', help="Transmit list file")
+    parser.add_argument('--channel', default='PCAN_USBBUS1', help="CAN channel")
+    parser.add_argument('--interface', default='pcan', help="python-can interface")
+    parser.add_argument('--bitrate', type=int, default=500000, help="CAN bitrate in bps")
+    parser.add_argument('--list', action='store_true', help="List the entries and exit")
+    parser.add_argument('--send', action='append', default=[], metavar='LABEL',
+                        help="Trigger an entry once by label or index (repeatable)")
+    parser.add_argument('--resume-all', action='store_true', help="Also cycle entries saved as paused")
+    parser.add_argument('--duration', type=float, default=0.0, help="Seconds to run cyclic entries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    entries = load_xmt(args.xmt)
+    if args.list:
+        for index, entry in enumerate(entries):
+            print(f"{index:3d} {entry.describe()}")
+        return
+
+    can_interface = CANInterface(args.channel, args.bitrate, args.interface)
+    if not can_interface.connect():
+        raise SystemExit(f"Could not connect to {args.channel}")
+
+    player = TransmitListPlayer(can_interface, entries)
+    try:
+        for key in args.send:
+            player.trigger(int(key) if key.isdigit() else key)
+
+        if args.duration > 0:
+            if args.resume_all:
+                player.paused = [False] * len(entries)
+            player.start()
+            time.sleep(args.duration)
+            player.stop()
+            for stats in player.get_stats():
+                if stats['sent']:
+                    print(f"{stats['label']}: {stats['sent']} sent, jitter {stats['jitter_ms']:.3f} ms, "
+                          f"max late {stats['max_late_ms']:.3f} ms")
+    except KeyboardInterrupt:
+        player.stop()
+    finally:
+        can_interface.disconnect()
+
+if __name__ == "__main__":
+    main()